@@ -7,15 +7,20 @@ STORAGE_MS = "http://localhost:5005"
 CONTROLLER_MS = "http://localhost:5003"
 LOG_MS = "http://localhost:5007"
 
+MAX_BATCH = 1000
+
 def yaml_response(obj, status=200):
     return Response(yaml.safe_dump(obj), status=status, mimetype="application/x-yaml")
 
+def pick_car_id():
+    # simple deterministic car id for demo
+    return f"CAR-{int(time.time())%10000}"
+
 @app.route("/request_car", methods=["POST"])
 def request_car():
     # Controller asked for a car
     data = yaml.safe_load(request.data) or {}
-    # simple deterministic car id for demo
-    car_id = f"CAR-{int(time.time())%10000}"
+    car_id = pick_car_id()
     # Share with Storage_MS
     try:
         requests.post(f"{STORAGE_MS}/store_car_id", data=yaml.safe_dump({"car_id":car_id}), headers={"Content-Type":"application/x-yaml"})
@@ -39,6 +44,28 @@ def notify_assignment():
         print("[Car_MS] Could not inform Controller about acceptance:", e)
     return yaml_response({"status":"ack","from":"Car_MS"})
 
+@app.route("/request_cars", methods=["POST"])
+def request_cars():
+    # Controller asked for one car per parcel of a bulk batch.
+    # Storage learns the car ids from the batched store_deliveries, so no per-car share here.
+    data = yaml.safe_load(request.data) or {}
+    count = int(data.get("count", 0))
+    if count < 1 or count > MAX_BATCH:
+        return yaml_response({"ok":False, "error":f"count must be between 1 and {MAX_BATCH}"}, 400)
+    car_ids = [pick_car_id() for _ in range(count)]
+    try:
+        requests.post(f"{LOG_MS}/log", data=yaml.safe_dump({"event":"cars_issued","count":count,"ts":time.time()}), headers={"Content-Type":"application/x-yaml"})
+    except:
+        pass
+    return yaml_response({"car_ids":car_ids, "ok":True})
+
+@app.route("/notify_assignments", methods=["POST"])
+def notify_assignments():
+    data = yaml.safe_load(request.data) or {}
+    assignments = data.get("assignments", [])
+    print(f"[Car_MS] Received {len(assignments)} bulk assignments")
+    return yaml_response({"status":"ack","from":"Car_MS","count":len(assignments)})
+
 if __name__ == "__main__":
     app.run(port=5006, debug=True)
 
@@ -47,6 +74,8 @@ from flask import Flask, request, Response
 import yaml
 import requests
 import time
+import threading
+from collections import deque, OrderedDict
 
 app = Flask("Controller_MS")
 IDGEN_MS = "http://localhost:5004"
@@ -54,10 +83,129 @@ STORAGE_MS = "http://localhost:5005"
 CAR_MS = "http://localhost:5006"
 LOG_MS = "http://localhost:5007"
 UI_MS = "http://localhost:5002"
+MAX_BATCH = 1000  # parcels per /request_delivery_batch call
+ID_LEASE_SIZE = 200      # parcel ids leased from IDGen_MS per round trip
+ID_LEASE_LOW_WATER = 50  # start leasing the next block below this many ids
+ID_LEASE_MARGIN = 30     # stop handing out a lease's ids this many seconds before it expires
+IDEMPOTENCY_CACHE_SIZE = 10000  # recent /request_delivery responses kept per Idempotency-Key
 
 def yaml_response(obj, status=200):
     return Response(yaml.safe_dump(obj), status=status, mimetype="application/x-yaml")
 
+class IdLeasePool:
+    """
+    Parcel ids leased from IDGen_MS in blocks and handed out locally, so most
+    deliveries need no IDGen round trip. The next block is fetched in the
+    background once the pool runs low. Ids left over when a lease runs out
+    are handed back to IDGen_MS, which reclaims them from Storage_MS.
+    """
+    def __init__(self, block_size=ID_LEASE_SIZE, low_water=ID_LEASE_LOW_WATER):
+        self.block_size = block_size
+        self.low_water = low_water
+        self.leases = deque()  # [lease_id, usable_until (monotonic), deque of ids]
+        self.lock = threading.Lock()
+        self.refilling = False
+
+    def lease_block(self, count):
+        r = requests.post(f"{IDGEN_MS}/lease_ids", data=yaml.safe_dump({"count":count, "holder":"Controller_MS"}), headers={"Content-Type":"application/x-yaml"}, timeout=5)
+        r.raise_for_status()
+        lease = yaml.safe_load(r.content)
+        return [lease["lease_id"], time.monotonic() + lease["ttl"] - ID_LEASE_MARGIN, deque(lease["parcel_ids"])]
+
+    def pop_locked(self, count, expired):
+        ids = []
+        now = time.monotonic()
+        while self.leases and len(ids) < count:
+            lease_id, usable_until, remaining = self.leases[0]
+            if usable_until <= now or not remaining:
+                self.leases.popleft()
+                if remaining:
+                    expired.append((lease_id, list(remaining)))
+                continue
+            ids.append(remaining.popleft())
+        return ids
+
+    def take(self, count=1):
+        expired = []
+        with self.lock:
+            ids = self.pop_locked(count, expired)
+        while len(ids) < count:
+            lease = self.lease_block(min(max(self.block_size, count - len(ids)), MAX_BATCH))
+            with self.lock:
+                self.leases.append(lease)
+                ids += self.pop_locked(count - len(ids), expired)
+        for lease_id, unused in expired:
+            threading.Thread(target=self.release, args=(lease_id, unused), daemon=True).start()
+        self.maybe_refill()
+        return ids
+
+    def release(self, lease_id, unused):
+        try:
+            requests.post(f"{IDGEN_MS}/release_lease", data=yaml.safe_dump({"lease_id":lease_id, "unused":unused}), headers={"Content-Type":"application/x-yaml"}, timeout=5)
+        except Exception as e:
+            # IDGen_MS reclaims the block on expiry anyway
+            print("[Controller_MS] lease release failed:", e)
+
+    def maybe_refill(self):
+        with self.lock:
+            available = sum(len(remaining) for _, _, remaining in self.leases)
+            if available >= self.low_water or self.refilling:
+                return
+            self.refilling = True
+        threading.Thread(target=self.refill, daemon=True).start()
+
+    def refill(self):
+        try:
+            lease = self.lease_block(self.block_size)
+            with self.lock:
+                self.leases.append(lease)
+        except Exception as e:
+            print("[Controller_MS] background id lease failed:", e)
+        finally:
+            with self.lock:
+                self.refilling = False
+
+id_pool = IdLeasePool()
+
+class IdempotencyCache:
+    """
+    Recent /request_delivery responses by Idempotency-Key, so a retried
+    request gets the original assignment back. A duplicate that arrives
+    while the original is running waits for it. Only the newest entries are
+    kept here; Storage_MS keeps every key with its delivery row, so an older
+    retry still stores nothing new and gets the first parcel/car back.
+    """
+    def __init__(self, max_entries=IDEMPOTENCY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.responses = OrderedDict()
+        self.inflight = {}  # key -> Lock held by the request doing the work
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            response = self.responses.get(key)
+            if response is not None:
+                self.responses.move_to_end(key)
+            return response
+
+    def put(self, key, response):
+        with self.lock:
+            self.responses[key] = response
+            self.responses.move_to_end(key)
+            while len(self.responses) > self.max_entries:
+                self.responses.popitem(last=False)
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.inflight.setdefault(key, threading.Lock())
+
+    def done(self, key):
+        # a request arriving after this waits on a fresh lock; Storage_MS still dedupes it
+        with self.lock:
+            self.inflight.pop(key, None)
+
+idempotency = IdempotencyCache()
+
 def log_event(event):
     try:
         requests.post(f"{LOG_MS}/log", data=yaml.safe_dump(event), headers={"Content-Type":"application/x-yaml"})
@@ -66,12 +214,30 @@ def log_event(event):
 
 @app.route("/request_delivery", methods=["POST"])
 def request_delivery():
+    key = request.headers.get("Idempotency-Key")
+    if not key:
+        return yaml_response(assign_delivery(None))
+    try:
+        with idempotency.key_lock(key):
+            response = idempotency.get(key)
+            if response is None:
+                response = assign_delivery(key)
+                idempotency.put(key, response)
+    finally:
+        idempotency.done(key)
+    return yaml_response(response)
+
+def assign_delivery(key):
     data = yaml.safe_load(request.data) or {}
     print("[Controller_MS] Received request:", data)
-    # 1. Request parcel ID from IDGen_MS
-    r = requests.post(f"{IDGEN_MS}/generate_id", data=yaml.safe_dump({"purpose":"parcel"}), headers={"Content-Type":"application/x-yaml"})
-    idgen_resp = yaml.safe_load(r.content)
-    parcel_id = idgen_resp.get("parcel_id")
+    # 1. Take a parcel ID from the local lease pool; ask IDGen_MS directly only if leasing fails
+    try:
+        parcel_id = id_pool.take(1)[0]
+    except Exception as e:
+        print("[Controller_MS] id lease failed, falling back to generate_id:", e)
+        r = requests.post(f"{IDGEN_MS}/generate_id", data=yaml.safe_dump({"purpose":"parcel"}), headers={"Content-Type":"application/x-yaml"})
+        idgen_resp = yaml.safe_load(r.content)
+        parcel_id = idgen_resp.get("parcel_id")
     # Log
     log_event({"event":"parcel_id_generated","parcel_id":parcel_id, "ts":time.time()})
 
@@ -89,25 +255,71 @@ def request_delivery():
 
     # 4. Assign delivery
     assignment = {"parcel_id": parcel_id, "car_id": car_id, "status":"assigned", "assigned_at": time.time()}
+    # 5./6. Car_MS and UI_MS notifications go into Storage_MS's outbox in the same
+    # transaction as the delivery, and are relayed from there with retries
+    outbox = [
+        {"target":"car", "path":"/notify_assignment", "payload":assignment},
+        {"target":"ui", "path":"/notify", "payload":{"status":"delivery_assigned","assignment":assignment,"tracking_id":key}},
+        {"target":"log", "path":"/log", "payload":{"event":"delivery_stored","assignment":assignment, "ts":time.time()}},
+    ]
     # Share with Storage_MS to store in Database_1
-    r_store = requests.post(f"{STORAGE_MS}/store_delivery", data=yaml.safe_dump(assignment), headers={"Content-Type":"application/x-yaml"})
-    storage_ack = yaml.safe_load(r_store.content)
-    log_event({"event":"delivery_stored","assignment":assignment, "ts":time.time()})
+    headers = {"Content-Type":"application/x-yaml"}
+    if key:
+        headers["Idempotency-Key"] = key
+    r_store = requests.post(f"{STORAGE_MS}/store_delivery", data=yaml.safe_dump(dict(assignment, outbox=outbox)), headers=headers)
+    storage_ack = yaml.safe_load(r_store.content) or {}
+    if storage_ack.get("replayed"):
+        # an earlier attempt with this key was already stored; report that delivery
+        assignment = dict(assignment, parcel_id=storage_ack["parcel_id"], car_id=storage_ack["car_id"])
 
-    # 5. Notify Car_MS
-    try:
-        requests.post(f"{CAR_MS}/notify_assignment", data=yaml.safe_dump(assignment), headers={"Content-Type":"application/x-yaml"})
-    except Exception as e:
-        print("[Controller_MS] notify car failed:", e)
-    log_event({"event":"car_notified","assignment":assignment, "ts":time.time()})
+    return {"status":"delivery_assigned","assignment":assignment, "storage_ack":storage_ack}
 
-    # 6. Notify UI_MS then Sender_MS already happens in UI flow
+@app.route("/request_delivery_batch", methods=["POST"])
+def request_delivery_batch():
+    """
+    Bulk counterpart of /request_delivery: one IDGen call, one Car call and one
+    Storage write per batch instead of per parcel. UI_MS feeds this endpoint in
+    bounded batches while it parses a manifest stream.
+    """
+    data = yaml.safe_load(request.data) or {}
+    parcels = data.get("parcels") or []
+    if not parcels or len(parcels) > MAX_BATCH:
+        return yaml_response({"status":"error","msg":f"expected 1..{MAX_BATCH} parcels"}, 400)
+    count = len(parcels)
+    print(f"[Controller_MS] Received batch of {count} parcels")
+    # 1. Parcel IDs for the whole batch, from the local lease pool
     try:
-        requests.post(f"{UI_MS}/notify", data=yaml.safe_dump({"status":"delivery_assigned","assignment":assignment}), headers={"Content-Type":"application/x-yaml"})
+        parcel_ids = id_pool.take(count)
     except Exception as e:
-        print("[Controller_MS] notify ui failed:", e)
+        print("[Controller_MS] id lease failed:", e)
+        return yaml_response({"status":"error","msg":"id generation failed"}, 502)
+    log_event({"event":"parcel_ids_generated","count":count, "ts":time.time()})
+
+    # 2. One car per parcel
+    r = requests.post(f"{CAR_MS}/request_cars", data=yaml.safe_dump({"need":"car","count":count}), headers={"Content-Type":"application/x-yaml"})
+    car_ids = (yaml.safe_load(r.content) or {}).get("car_ids") or []
+    if len(car_ids) != count:
+        return yaml_response({"status":"error","msg":"car selection failed"}, 502)
+    log_event({"event":"car_ids_received","count":count, "ts":time.time()})
 
-    return yaml_response({"status":"delivery_assigned","assignment":assignment, "storage_ack":storage_ack})
+    # 3. Assign and store the batch in one write
+    assigned_at = time.time()
+    assignments = [
+        {"parcel_id": parcel_id, "car_id": car_id, "status":"assigned", "assigned_at": assigned_at}
+        for parcel_id, car_id in zip(parcel_ids, car_ids)
+    ]
+    # 4./5. One notification per batch to Car_MS and UI_MS, committed with the batch via the outbox
+    outbox = [
+        {"target":"car", "path":"/notify_assignments", "payload":{"assignments":assignments}},
+        {"target":"ui", "path":"/notify", "payload":{"status":"deliveries_assigned","count":count}},
+        {"target":"log", "path":"/log", "payload":{"event":"deliveries_stored","count":count, "ts":time.time()}},
+    ]
+    r_store = requests.post(f"{STORAGE_MS}/store_deliveries", data=yaml.safe_dump({"deliveries":assignments, "outbox":outbox}), headers={"Content-Type":"application/x-yaml"})
+    storage_ack = yaml.safe_load(r_store.content) or {}
+    if storage_ack.get("status") != "deliveries_stored":
+        return yaml_response({"status":"error","msg":"storage failed","storage_ack":storage_ack}, 502)
+
+    return yaml_response({"status":"deliveries_assigned","assignments":assignments})
 
 @app.route("/car_update_request", methods=["POST"])
 def car_update_request():
@@ -118,14 +330,13 @@ def car_update_request():
     ack = {"status":"ack","from":"Controller_MS"}
     # Share update with Storage_MS (fetch current then update as example)
     update = {"parcel_id": data.get("parcel_id"), "car_id": data.get("car_id"), "status": data.get("status","in_transit")}
-    r = requests.post(f"{STORAGE_MS}/update_delivery", data=yaml.safe_dump(update), headers={"Content-Type":"application/x-yaml"})
+    # UI notification and log entry are committed with the update via the outbox
+    outbox = [
+        {"target":"ui", "path":"/notify", "payload":{"status":"delivery_update","update":update}},
+        {"target":"log", "path":"/log", "payload":{"event":"delivery_update","update":update}},
+    ]
+    r = requests.post(f"{STORAGE_MS}/update_delivery", data=yaml.safe_dump(dict(update, outbox=outbox)), headers={"Content-Type":"application/x-yaml"})
     storage_ack = yaml.safe_load(r.content)
-    # Notify UI
-    try:
-        requests.post("http://localhost:5002/notify", data=yaml.safe_dump({"status":"delivery_update","update":update}), headers={"Content-Type":"application/x-yaml"})
-    except:
-        pass
-    log_event({"event":"delivery_update","update":update})
     return yaml_response({"ack": ack, "storage_ack": storage_ack})
 
 if __name__ == "__main__":
@@ -134,12 +345,22 @@ if __name__ == "__main__":
 # idgen_ms.py
 from flask import Flask, request, Response
 import yaml, uuid, requests
+import os
 import time
+import threading
 
 app = Flask("IDGen_MS")
 STORAGE_MS = "http://localhost:5005"
 CONTROLLER_MS = "http://localhost:5003"
 LOG_MS = "http://localhost:5007"
+MAX_BATCH = 1000
+LEASE_TTL = 300        # seconds a leased block stays valid for its holder
+LEASE_GRACE = 30       # extra time before unused ids of an expired lease are reclaimed
+REAP_INTERVAL = 10
+
+# lease_id -> {"holder", "parcel_ids", "expires_at"}
+leases = {}
+leases_lock = threading.Lock()
 
 def yaml_response(obj, status=200):
     return Response(yaml.safe_dump(obj), status=status, mimetype="application/x-yaml")
@@ -161,6 +382,94 @@ def generate_id():
         pass
     return yaml_response({"parcel_id": parcel_id})
 
+def register_block(count, event):
+    """Generate `count` parcel ids and share them with Storage_MS in one bulk insert."""
+    parcel_ids = [f"PARCEL-{uuid.uuid4().hex[:8]}" for _ in range(count)]
+    r = requests.post(f"{STORAGE_MS}/store_parcel_ids", data=yaml.safe_dump({"parcel_ids":parcel_ids}), headers={"Content-Type":"application/x-yaml"})
+    r.raise_for_status()
+    try:
+        requests.post(f"{LOG_MS}/log", data=yaml.safe_dump({"event":event,"count":count,"ts":time.time()}), headers={"Content-Type":"application/x-yaml"})
+    except:
+        pass
+    return parcel_ids
+
+def release_ids(parcel_ids):
+    # Storage_MS only deletes ids that never got a car, so used ids are safe to pass
+    requests.post(f"{STORAGE_MS}/release_parcel_ids", data=yaml.safe_dump({"parcel_ids":parcel_ids}), headers={"Content-Type":"application/x-yaml"})
+
+@app.route("/generate_ids", methods=["POST"])
+def generate_ids():
+    # Batched variant of /generate_id: one Storage round trip for the whole batch
+    data = yaml.safe_load(request.data) or {}
+    count = int(data.get("count", 0))
+    if count < 1 or count > MAX_BATCH:
+        return yaml_response({"error": f"count must be between 1 and {MAX_BATCH}"}, 400)
+    try:
+        parcel_ids = register_block(count, "ids_generated")
+    except Exception as e:
+        print("[IDGen_MS] Storage share failed:", e)
+        return yaml_response({"error": "storage share failed"}, 502)
+    return yaml_response({"parcel_ids": parcel_ids})
+
+@app.route("/lease_ids", methods=["POST"])
+def lease_ids():
+    """
+    Lease a block of pre-registered parcel ids to a Controller, which then hands
+    them out locally. The block is stored with one bulk insert; whatever the
+    holder has not used when the lease expires is reclaimed from Storage_MS.
+    """
+    data = yaml.safe_load(request.data) or {}
+    count = int(data.get("count", 0))
+    if count < 1 or count > MAX_BATCH:
+        return yaml_response({"error": f"count must be between 1 and {MAX_BATCH}"}, 400)
+    try:
+        parcel_ids = register_block(count, "ids_leased")
+    except Exception as e:
+        print("[IDGen_MS] Storage share failed:", e)
+        return yaml_response({"error": "storage share failed"}, 502)
+    lease_id = f"LEASE-{uuid.uuid4().hex[:8]}"
+    with leases_lock:
+        leases[lease_id] = {"holder": data.get("holder"), "parcel_ids": parcel_ids, "expires_at": time.time() + LEASE_TTL}
+    # the holder gets a relative ttl so clock skew between machines does not matter
+    return yaml_response({"lease_id": lease_id, "parcel_ids": parcel_ids, "ttl": LEASE_TTL})
+
+@app.route("/release_lease", methods=["POST"])
+def release_lease():
+    # Holder hands back the ids it did not use (e.g. its lease ran out locally)
+    data = yaml.safe_load(request.data) or {}
+    with leases_lock:
+        lease = leases.pop(data.get("lease_id"), None)
+    if lease is None:
+        return yaml_response({"status": "unknown_lease"}, 404)
+    unused = set(data.get("unused") or []) & set(lease["parcel_ids"])
+    if unused:
+        try:
+            release_ids(sorted(unused))
+        except Exception as e:
+            print("[IDGen_MS] Release failed:", e)
+    return yaml_response({"status": "released", "count": len(unused)})
+
+def reap_expired_leases():
+    while True:
+        time.sleep(REAP_INTERVAL)
+        now = time.time()
+        with leases_lock:
+            expired = [lease_id for lease_id, lease in leases.items() if lease["expires_at"] + LEASE_GRACE < now]
+            expired = [leases.pop(lease_id) for lease_id in expired]
+        for lease in expired:
+            try:
+                release_ids(lease["parcel_ids"])
+            except Exception as e:
+                print("[IDGen_MS] Reclaim failed:", e)
+
+# With debug=True, app.run re-executes this script in a reloader child
+# (WERKZEUG_RUN_MAIN=true); only that child holds leases, so only it reaps
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    threading.Thread(target=reap_expired_leases, daemon=True).start()
+
+if __name__ == "__main__":
+    app.run(port=5004, debug=True)
+
 # log_ms.py
 from flask import Flask, request, Response
 import yaml, sqlite3, os, time
@@ -194,6 +503,19 @@ def log():
     print("[Log_MS] Logged event:", event)
     return yaml_response({"status":"logged","event":event})
 
+@app.route("/log_batch", methods=["POST"])
+def log_batch():
+    data = yaml.safe_load(request.data) or {}
+    events = data.get("events") or []
+    now = time.time()
+    rows = [(e.get("event", "<unknown>"), yaml.safe_dump(e), e.get("ts", now)) for e in events]
+    conn = sqlite3.connect(DB3)
+    conn.executemany("INSERT INTO logs(event, payload, ts) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    print(f"[Log_MS] Logged {len(rows)} events")
+    return yaml_response({"status":"logged","count":len(rows)})
+
 # run_sequence.py
 import requests, yaml, time
 
@@ -210,19 +532,81 @@ r = requests.post(f"{SENDER}/request_delivery", data=yaml.safe_dump(payload), he
 print("Final response from UI via Sender:", yaml.safe_load(r.content))
 
 # sender_ms.py
-from flask import Flask, request, Response
+from flask import Flask, request, Response, stream_with_context
 import yaml
 import requests
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
 
 app = Flask("Sender_MS")
 UI_MS = "http://localhost:5002"  # UI_MS endpoint
+CHUNK_SIZE = 64 * 1024
+# UI_MS pushes this sender's updates over one SSE stream keyed by this id
+SENDER_ID = os.environ.get("SENDER_ID", socket.gethostname())
+RECONNECT_DELAY = 2.0
 
 def yaml_response(obj, status=200):
     return Response(yaml.safe_dump(obj), status=status, mimetype="application/x-yaml")
 
+def stream_post(url, chunks, content_type):
+    """
+    POST an iterable of byte chunks with chunked transfer encoding and yield the
+    response body as it arrives. The upload runs on its own thread so results
+    are read while the manifest is still being sent; a client that reads only
+    after uploading would stall once both socket buffers fill up.
+    """
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port)
+    conn.putrequest("POST", parts.path)
+    conn.putheader("Content-Type", content_type)
+    conn.putheader("Transfer-Encoding", "chunked")
+    conn.endheaders()
+
+    def upload():
+        try:
+            for chunk in chunks:
+                if chunk:
+                    conn.send(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            conn.send(b"0\r\n\r\n")
+        except OSError as e:
+            print("[Sender_MS] Manifest upload aborted:", e)
+
+    uploader = threading.Thread(target=upload, daemon=True)
+    uploader.start()
+    try:
+        resp = conn.getresponse()
+        while True:
+            block = resp.read1(CHUNK_SIZE)
+            if not block:
+                break
+            yield block
+    finally:
+        uploader.join()
+        conn.close()
+
+def watch_updates():
+    # Follow /events/<SENDER_ID>, resuming from the last event seen after a disconnect
+    last_event_id = 0
+    while True:
+        try:
+            with requests.get(f"{UI_MS}/events/{SENDER_ID}", headers={"Last-Event-ID":str(last_event_id)}, stream=True, timeout=(5, 60)) as r:
+                for line in r.iter_lines(decode_unicode=True):
+                    if line.startswith("id: "):
+                        last_event_id = int(line[4:])
+                    elif line.startswith("data: "):
+                        print("[Sender_MS] Update:", json.loads(line[6:]))
+        except Exception as e:
+            print("[Sender_MS] Update stream lost:", e)
+        time.sleep(RECONNECT_DELAY)
+
 @app.route("/notify", methods=["POST"])
 def notify():
-    # Received notification from UI_MS
+    # Received notification from UI_MS (only sent when UI_MS runs with SENDER_CALLBACKS=1)
     data = yaml.safe_load(request.data)
     print("[Sender_MS] Received:", data)
     # Acknowledge
@@ -235,22 +619,62 @@ def request_delivery():
     """
     payload = yaml.safe_load(request.data) if request.data else {}
     print("[Sender_MS] Sending request to UI_MS:", payload)
-    r = requests.post(f"{UI_MS}/request_delivery", data=yaml.safe_dump(payload), headers={"Content-Type":"application/x-yaml"})
+    r = requests.post(f"{UI_MS}/request_delivery", data=yaml.safe_dump(payload), headers={"Content-Type":"application/x-yaml", "X-Sender-Id":SENDER_ID})
     resp = yaml.safe_load(r.content)
     return yaml_response({"status":"sent_to_ui", "ui_response": resp})
 
+@app.route("/request_delivery_bulk", methods=["POST"])
+def request_delivery_bulk():
+    """
+    Local endpoint to submit a whole manifest (NDJSON or multi-document YAML).
+    The body is relayed to UI_MS chunk by chunk and per-parcel results are
+    streamed back, so neither side holds the manifest in memory.
+    """
+    content_type = request.content_type or "application/x-yaml"
+    stream = request.stream
+    chunks = iter(lambda: stream.read(CHUNK_SIZE), b"")
+    print("[Sender_MS] Streaming bulk manifest to UI_MS")
+    results = stream_post(f"{UI_MS}/request_delivery_bulk", chunks, content_type)
+    return Response(stream_with_context(results), mimetype=content_type)
+
+# With debug=True, app.run re-executes this script in a reloader child
+# (WERKZEUG_RUN_MAIN=true); only that child serves, so only it watches
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    threading.Thread(target=watch_updates, daemon=True).start()
+
 if __name__ == "__main__":
     app.run(port=5001, debug=True)
 
 # storage_ms.py
 from flask import Flask, request, Response
 import yaml, sqlite3, os, time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask("Storage_MS")
 DB1 = "db_database_1.sqlite"  # deliveries
 DB2 = "db_database_2.sqlite"  # assignments (parcel_id, car_id)
 # DB3 for logs is managed by Log_MS
 
+# Transactional outbox: notifications are committed in DB1 together with the
+# delivery row they describe, then relayed by a background dispatcher.
+OUTBOX_TARGETS = {
+    "car": {"url": "http://localhost:5006", "concurrency": 4},
+    "ui": {"url": "http://localhost:5002", "concurrency": 2},
+    "log": {"url": "http://localhost:5007", "concurrency": 2},
+}
+# (target, path) -> (batch path, list key): records for these are sent together
+OUTBOX_BATCH_PATHS = {
+    ("ui", "/notify"): ("/notify_batch", "notifications"),
+    ("log", "/log"): ("/log_batch", "events"),
+}
+OUTBOX_FETCH = 500
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_BACKOFF = 1.0
+OUTBOX_POLL = 1.0
+
 def yaml_response(obj, status=200):
     return Response(yaml.safe_dump(obj), status=status, mimetype="application/x-yaml")
 
@@ -267,9 +691,38 @@ def init_db():
         c.execute("""CREATE TABLE assignments (parcel_id TEXT PRIMARY KEY, car_id TEXT, created_at REAL)""")
         conn.commit()
         conn.close()
+    conn = sqlite3.connect(DB1)
+    conn.execute("""CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, target TEXT, path TEXT, payload TEXT, status TEXT, attempts INTEGER DEFAULT 0, next_attempt REAL, created_at REAL, last_error TEXT)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, next_attempt)")
+    # Idempotency-Key of every keyed store_delivery, committed with the delivery row
+    conn.execute("""CREATE TABLE IF NOT EXISTS idempotency (key TEXT PRIMARY KEY, parcel_id TEXT, car_id TEXT, created_at REAL)""")
+    # records a previous run was sending when it stopped are sent again
+    conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'inflight'")
+    conn.commit()
+    conn.close()
 
 init_db()
 
+# one event per target, set when records for it are committed
+outbox_wakeup = {target: threading.Event() for target in OUTBOX_TARGETS}
+
+def wake_outbox(records):
+    for target in {rec["target"] for rec in records}:
+        outbox_wakeup[target].set()
+
+def validate_outbox(records):
+    for rec in records:
+        if rec.get("target") not in OUTBOX_TARGETS or not rec.get("path"):
+            return f"bad outbox record: {rec}"
+    return None
+
+def write_outbox(cursor, records):
+    # Called inside the caller's DB1 transaction
+    now = time.time()
+    cursor.executemany(
+        "INSERT INTO outbox(target, path, payload, status, next_attempt, created_at) VALUES (?, ?, ?, 'pending', ?, ?)",
+        [(rec["target"], rec["path"], yaml.safe_dump(rec.get("payload")), now, now) for rec in records])
+
 @app.route("/store_parcel_id", methods=["POST"])
 def store_parcel_id():
     data = yaml.safe_load(request.data) or {}
@@ -285,6 +738,37 @@ def store_parcel_id():
         conn.close()
     return yaml_response({"status":"stored_parcel_id","parcel_id":parcel_id})
 
+@app.route("/store_parcel_ids", methods=["POST"])
+def store_parcel_ids():
+    data = yaml.safe_load(request.data) or {}
+    parcel_ids = data.get("parcel_ids") or []
+    if not parcel_ids:
+        return yaml_response({"status":"error","msg":"no parcel_ids"}, 400)
+    now = time.time()
+    conn = sqlite3.connect(DB2)
+    c = conn.cursor()
+    try:
+        c.executemany("INSERT OR IGNORE INTO assignments(parcel_id, car_id, created_at) VALUES (?, ?, ?)", [(pid, None, now) for pid in parcel_ids])
+        conn.commit()
+    finally:
+        conn.close()
+    return yaml_response({"status":"stored_parcel_ids","count":len(parcel_ids)})
+
+@app.route("/release_parcel_ids", methods=["POST"])
+def release_parcel_ids():
+    # Reclaim leased ids that were never assigned a car
+    data = yaml.safe_load(request.data) or {}
+    parcel_ids = data.get("parcel_ids") or []
+    conn = sqlite3.connect(DB2)
+    c = conn.cursor()
+    try:
+        c.executemany("DELETE FROM assignments WHERE parcel_id = ? AND car_id IS NULL", [(pid,) for pid in parcel_ids])
+        conn.commit()
+        released = c.rowcount
+    finally:
+        conn.close()
+    return yaml_response({"status":"released_parcel_ids","count":released})
+
 @app.route("/get_parcel", methods=["POST"])
 def get_parcel():
     data = yaml.safe_load(request.data) or {}
@@ -331,12 +815,26 @@ def store_delivery():
     car_id = data.get("car_id")
     status = data.get("status","assigned")
     assigned_at = data.get("assigned_at", time.time())
+    outbox = data.get("outbox") or []
     if not parcel_id:
         return yaml_response({"status":"error","msg":"no parcel_id"},400)
+    error = validate_outbox(outbox)
+    if error:
+        return yaml_response({"status":"error","msg":error},400)
+    key = request.headers.get("Idempotency-Key")
     conn = sqlite3.connect(DB1)
     c = conn.cursor()
     try:
+        if key:
+            # Claiming the key takes the write lock, so a concurrent duplicate waits here
+            # and then sees the key; it gets the first delivery back and writes nothing
+            c.execute("INSERT OR IGNORE INTO idempotency(key, parcel_id, car_id, created_at) VALUES (?, ?, ?, ?)", (key, parcel_id, car_id, time.time()))
+            if c.rowcount == 0:
+                first = c.execute("SELECT parcel_id, car_id FROM idempotency WHERE key = ?", (key,)).fetchone()
+                conn.rollback()
+                return yaml_response({"status":"delivery_stored","parcel_id":first[0],"car_id":first[1],"replayed":True})
         c.execute("INSERT OR REPLACE INTO deliveries(parcel_id, car_id, status, assigned_at) VALUES (?, ?, ?, ?)", (parcel_id, car_id, status, assigned_at))
+        write_outbox(c, outbox)
         # also reflect in DB2
         c2 = sqlite3.connect("db_database_2.sqlite")
         cc = c2.cursor()
@@ -347,61 +845,472 @@ def store_delivery():
         conn.commit()
     finally:
         conn.close()
+    wake_outbox(outbox)
     return yaml_response({"status":"delivery_stored","parcel_id":parcel_id})
 
+@app.route("/store_deliveries", methods=["POST"])
+def store_deliveries():
+    # Bulk store_delivery: one transaction per database for the whole batch
+    data = yaml.safe_load(request.data) or {}
+    deliveries = data.get("deliveries") or []
+    outbox = data.get("outbox") or []
+    if not deliveries or any(not d.get("parcel_id") for d in deliveries):
+        return yaml_response({"status":"error","msg":"every delivery needs a parcel_id"},400)
+    error = validate_outbox(outbox)
+    if error:
+        return yaml_response({"status":"error","msg":error},400)
+    now = time.time()
+    rows = [(d["parcel_id"], d.get("car_id"), d.get("status","assigned"), d.get("assigned_at", now)) for d in deliveries]
+    conn = sqlite3.connect(DB1)
+    c2 = sqlite3.connect(DB2)
+    try:
+        conn.executemany("INSERT OR REPLACE INTO deliveries(parcel_id, car_id, status, assigned_at) VALUES (?, ?, ?, ?)", rows)
+        write_outbox(conn.cursor(), outbox)
+        c2.executemany("INSERT OR IGNORE INTO assignments(parcel_id, car_id, created_at) VALUES (?, ?, ?)", [(pid, car_id, now) for pid, car_id, _, _ in rows])
+        c2.executemany("UPDATE assignments SET car_id = ? WHERE parcel_id = ?", [(car_id, pid) for pid, car_id, _, _ in rows])
+        c2.commit()
+        conn.commit()
+    finally:
+        c2.close()
+        conn.close()
+    wake_outbox(outbox)
+    return yaml_response({"status":"deliveries_stored","count":len(rows)})
+
 @app.route("/update_delivery", methods=["POST"])
 def update_delivery():
     data = yaml.safe_load(request.data) or {}
     parcel_id = data.get("parcel_id")
     new_status = data.get("status")
+    outbox = data.get("outbox") or []
     if not parcel_id:
         return yaml_response({"status":"error","msg":"no parcel_id"},400)
+    error = validate_outbox(outbox)
+    if error:
+        return yaml_response({"status":"error","msg":error},400)
     conn = sqlite3.connect(DB1)
     c = conn.cursor()
     try:
         c.execute("UPDATE deliveries SET status = ? WHERE parcel_id = ?", (new_status, parcel_id))
+        write_outbox(c, outbox)
         conn.commit()
     finally:
         conn.close()
+    wake_outbox(outbox)
     return yaml_response({"status":"updated","parcel_id":parcel_id, "new_status":new_status})
 
+@app.route("/outbox_stats", methods=["GET"])
+def outbox_stats():
+    conn = sqlite3.connect(DB1)
+    try:
+        rows = conn.execute("SELECT target, status, COUNT(*) FROM outbox GROUP BY target, status").fetchall()
+    finally:
+        conn.close()
+    stats = {}
+    for target, status, count in rows:
+        stats.setdefault(target, {})[status] = count
+    return yaml_response({"status":"ok","outbox":stats})
+
+def outbox_finish(ids, error=None):
+    conn = sqlite3.connect(DB1)
+    try:
+        if error is None:
+            conn.executemany("UPDATE outbox SET status = 'sent', attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids])
+        else:
+            now = time.time()
+            conn.executemany(
+                """UPDATE outbox SET attempts = attempts + 1, last_error = ?,
+                   status = CASE WHEN attempts + 1 >= ? THEN 'dead' ELSE 'pending' END,
+                   next_attempt = ? * (1 << MIN(attempts, 10)) + ? WHERE id = ?""",
+                [(error, OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF, now, i) for i in ids])
+        conn.commit()
+    finally:
+        conn.close()
+
+def outbox_send(target, path, records):
+    # records: [(id, payload)]; batchable paths go out as one request
+    url = OUTBOX_TARGETS[target]["url"]
+    batch = OUTBOX_BATCH_PATHS.get((target, path))
+    try:
+        if batch and len(records) > 1:
+            r = requests.post(f"{url}{batch[0]}", data=yaml.safe_dump({batch[1]: [payload for _, payload in records]}), headers={"Content-Type":"application/x-yaml"}, timeout=5)
+        else:
+            r = requests.post(f"{url}{path}", data=yaml.safe_dump(records[0][1]), headers={"Content-Type":"application/x-yaml"}, timeout=5)
+        r.raise_for_status()
+        outbox_finish([i for i, _ in records])
+    except Exception as e:
+        print(f"[Storage_MS] outbox delivery to {target}{path} failed:", e)
+        outbox_finish([i for i, _ in records], str(e))
+
+def outbox_claim(target, limit):
+    # Select and mark in one write transaction, so two dispatchers never claim the same rows
+    conn = sqlite3.connect(DB1, isolation_level=None, timeout=30)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, path, payload FROM outbox WHERE status = 'pending' AND target = ? AND next_attempt <= ? ORDER BY id LIMIT ?", (target, time.time(), limit)).fetchall()
+            conn.executemany("UPDATE outbox SET status = 'inflight' WHERE id = ?", [(row[0],) for row in rows])
+    finally:
+        conn.close()
+    return rows
+
+def outbox_dispatcher(target):
+    # One dispatcher per target, so a slow or hung service only holds back its
+    # own records; the semaphore caps concurrent requests to that service and a
+    # send that finishes frees its slot for the next batch right away
+    concurrency = OUTBOX_TARGETS[target]["concurrency"]
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    slots = threading.Semaphore(concurrency)
+    wakeup = outbox_wakeup[target]
+    while True:
+        wakeup.clear()
+        rows = outbox_claim(target, OUTBOX_FETCH)
+        if not rows:
+            wakeup.wait(OUTBOX_POLL)
+            continue
+        groups = {}
+        for rec_id, path, payload in rows:
+            groups.setdefault(path, []).append((rec_id, yaml.safe_load(payload)))
+        for path, records in groups.items():
+            size = OUTBOX_BATCH_SIZE if (target, path) in OUTBOX_BATCH_PATHS else 1
+            for start in range(0, len(records), size):
+                slots.acquire()
+                future = pool.submit(outbox_send, target, path, records[start:start + size])
+                future.add_done_callback(lambda _: slots.release())
+
+# With debug=True, app.run re-executes this script in a reloader child
+# (WERKZEUG_RUN_MAIN=true); only that child serves, so only it relays
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    for target in OUTBOX_TARGETS:
+        threading.Thread(target=outbox_dispatcher, args=(target,), daemon=True).start()
+
 if __name__ == "__main__":
     app.run(port=5005, debug=True)
 
 # ui_ms.py
-from flask import Flask, request, Response
+from flask import Flask, request, Response, stream_with_context
 import yaml
+import json
 import requests
+import os, sqlite3, threading, time, uuid
+from collections import deque
 
 app = Flask("UI_MS")
 CONTROLLER_MS = "http://localhost:5003"
 SENDER_MS = "http://localhost:5001"
+BULK_BATCH_SIZE = 500  # parcels forwarded to the Controller per call
+NDJSON_MIME = "application/x-ndjson"
+
+# Durable intake queue: /request_delivery only writes the request here and
+# answers 202; dispatcher threads drain it into Controller_MS.
+INTAKE_DB = "db_ui_intake.sqlite"
+INTAKE_DISPATCHERS = 4
+INTAKE_MAX_ATTEMPTS = 5
+INTAKE_BACKOFF = 1.0
+INTAKE_POLL = 1.0
+
+# Senders watch /events/<sender_id> (SSE) or /poll/<sender_id> for their
+# parcels' updates; the old per-event POST to Sender_MS /notify is opt-in
+PUSH_BUFFER = 256        # recent events replayable per sender
+PUSH_HEARTBEAT = 15.0    # idle SSE streams get a comment line this often
+MAX_POLL_TIMEOUT = 30.0
+SENDER_CALLBACKS = os.environ.get("SENDER_CALLBACKS") == "1"
 
 def yaml_response(obj, status=200):
     return Response(yaml.safe_dump(obj), status=status, mimetype="application/x-yaml")
 
+def init_intake():
+    conn = sqlite3.connect(INTAKE_DB)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS intake (tracking_id TEXT PRIMARY KEY, sender_id TEXT, parcel_id TEXT, payload TEXT, status TEXT, attempts INTEGER DEFAULT 0, next_attempt REAL, created_at REAL, updated_at REAL, result TEXT)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS intake_ready ON intake (status, next_attempt)")
+    conn.execute("CREATE INDEX IF NOT EXISTS intake_parcel ON intake (parcel_id)")
+    # requests a previous run was dispatching when it stopped are dispatched again
+    conn.execute("UPDATE intake SET status = 'queued' WHERE status = 'dispatching'")
+    conn.commit()
+    conn.close()
+
+init_intake()
+
+intake_wakeup = threading.Event()
+
+class UpdateHub:
+    """
+    Per-sender replay buffers that watchers block on. A publish wakes only
+    the watchers of that sender; a watcher resuming with the last event id it
+    saw (Last-Event-ID / ?after=) gets what it missed, as long as it is
+    still in the buffer.
+    """
+    def __init__(self, buffer_size=PUSH_BUFFER):
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+        self.senders = {}
+        self.last_id = int(time.time() * 1000)  # keeps growing across restarts
+
+    def sender(self, sender_id):
+        if sender_id not in self.senders:
+            self.senders[sender_id] = (deque(maxlen=self.buffer_size), threading.Condition(self.lock))
+        return self.senders[sender_id]
+
+    def publish(self, sender_id, event):
+        with self.lock:
+            events, changed = self.sender(sender_id)
+            self.last_id += 1
+            events.append(dict(event, event_id=self.last_id))
+            changed.notify_all()
+
+    def wait(self, sender_id, after, timeout, tracking_id=None):
+        deadline = time.time() + timeout
+        with self.lock:
+            events, changed = self.sender(sender_id)
+            while True:
+                ready = [e for e in events if e["event_id"] > after and tracking_id in (None, e.get("tracking_id"))]
+                if ready or time.time() >= deadline:
+                    return ready
+                changed.wait(deadline - time.time())
+
+hub = UpdateHub()
+
+def push(event, tracking_id=None, parcel_id=None):
+    # Route an update to the sender whose request it belongs to
+    conn = sqlite3.connect(INTAKE_DB, timeout=30)
+    try:
+        if tracking_id:
+            row = conn.execute("SELECT tracking_id, sender_id FROM intake WHERE tracking_id = ?", (tracking_id,)).fetchone()
+        else:
+            row = conn.execute("SELECT tracking_id, sender_id FROM intake WHERE parcel_id = ?", (parcel_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return
+    hub.publish(row[1], dict(event, tracking_id=row[0]))
+    if SENDER_CALLBACKS:
+        try:
+            requests.post(f"{SENDER_MS}/notify", data=yaml.safe_dump(dict(event, tracking_id=row[0])), headers={"Content-Type":"application/x-yaml"}, timeout=2)
+        except Exception as e:
+            print("[UI_MS] Warning: couldn't notify Sender_MS:", e)
+
+def intake_claim():
+    # Select and mark in one write transaction, so two dispatchers never take the same request
+    conn = sqlite3.connect(INTAKE_DB, isolation_level=None, timeout=30)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tracking_id, payload, attempts FROM intake WHERE status = 'queued' AND next_attempt <= ? ORDER BY next_attempt LIMIT 1", (time.time(),)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE intake SET status = 'dispatching', attempts = attempts + 1, updated_at = ? WHERE tracking_id = ?", (time.time(), row[0]))
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return row[0], yaml.safe_load(row[1]), row[2] + 1
+
+def intake_finish(tracking_id, status, result, next_attempt=None, parcel_id=None):
+    conn = sqlite3.connect(INTAKE_DB, timeout=30)
+    try:
+        conn.execute("UPDATE intake SET status = ?, result = ?, next_attempt = COALESCE(?, next_attempt), parcel_id = COALESCE(?, parcel_id), updated_at = ? WHERE tracking_id = ?",
+                     (status, yaml.safe_dump(result), next_attempt, parcel_id, time.time(), tracking_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def intake_dispatch(tracking_id, data, attempt):
+    forward = {"action":"request_delivery","sender_data":data}
+    try:
+        # the tracking id is the idempotency key, so a redelivered row is not assigned twice
+        r = requests.post(f"{CONTROLLER_MS}/request_delivery", data=yaml.safe_dump(forward), headers={"Content-Type":"application/x-yaml", "Idempotency-Key":tracking_id}, timeout=30)
+        try:
+            controller_resp = yaml.safe_load(r.content) or {}
+        except yaml.YAMLError:
+            controller_resp = {"status":"error", "body":r.text[:500]}
+    except Exception as e:
+        r, controller_resp = None, {"status":"error", "error":str(e)}
+    if r is not None and r.ok:
+        # later car updates only carry the parcel id, so keep it with the request
+        parcel_id = (controller_resp.get("assignment") or {}).get("parcel_id")
+        intake_finish(tracking_id, "completed", controller_resp, parcel_id=parcel_id)
+        push({"state":"completed", "controller":controller_resp}, tracking_id)
+    elif r is not None and r.status_code < 500:
+        # the Controller rejected the request itself; retrying will not help
+        intake_finish(tracking_id, "failed", controller_resp)
+        push({"state":"failed", "controller":controller_resp}, tracking_id)
+    elif attempt >= INTAKE_MAX_ATTEMPTS:
+        intake_finish(tracking_id, "failed", controller_resp)
+        push({"state":"failed", "controller":controller_resp}, tracking_id)
+    else:
+        intake_finish(tracking_id, "queued", controller_resp, time.time() + INTAKE_BACKOFF * 2 ** (attempt - 1))
+
+def intake_dispatcher():
+    while True:
+        intake_wakeup.clear()
+        claimed = intake_claim()
+        if claimed is None:
+            intake_wakeup.wait(INTAKE_POLL)
+            continue
+        intake_dispatch(*claimed)
+
+# With debug=True, app.run re-executes this script in a reloader child
+# (WERKZEUG_RUN_MAIN=true); only that child serves, so only it dispatches
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    for _ in range(INTAKE_DISPATCHERS):
+        threading.Thread(target=intake_dispatcher, daemon=True).start()
+
+def iter_manifest(stream, content_type):
+    """
+    Yield (index, parcel, error) for each record of an NDJSON or multi-document
+    YAML manifest, reading the stream incrementally.
+    """
+    if "json" in content_type:
+        for index, line in enumerate(stream):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line), None
+            except ValueError as e:
+                yield index, None, f"invalid json: {e}"
+    else:
+        index = 0
+        try:
+            for doc in yaml.safe_load_all(stream):
+                if doc is not None:
+                    yield index, doc, None
+                index += 1
+        except yaml.YAMLError as e:
+            # the YAML stream cannot be resynchronised after a syntax error
+            yield index, None, f"invalid yaml, manifest aborted: {e}"
+
+def format_result(result, content_type):
+    if "json" in content_type:
+        return json.dumps(result) + "\n"
+    return "---\n" + yaml.safe_dump(result)
+
+def forward_batch(batch):
+    """Send one batch of parcels to the Controller and return per-parcel results."""
+    results = [{"index": index, "status": "rejected", "error": error} for index, _, error in batch if error]
+    accepted = [(index, parcel) for index, parcel, error in batch if not error]
+    if not accepted:
+        return results
+    forward = {"action":"request_delivery_batch", "parcels":[parcel for _, parcel in accepted]}
+    try:
+        r = requests.post(f"{CONTROLLER_MS}/request_delivery_batch", data=yaml.safe_dump(forward), headers={"Content-Type":"application/x-yaml"})
+        controller_resp = yaml.safe_load(r.content) or {}
+        assignments = controller_resp.get("assignments") or []
+        if r.status_code != 200 or len(assignments) != len(accepted):
+            raise RuntimeError(controller_resp.get("msg", f"controller returned {r.status_code}"))
+    except Exception as e:
+        print("[UI_MS] Batch forward failed:", e)
+        return results + [{"index": index, "status": "failed", "error": str(e)} for index, _ in accepted]
+    for (index, _), assignment in zip(accepted, assignments):
+        results.append({"index": index, "status": assignment["status"], "parcel_id": assignment["parcel_id"], "car_id": assignment["car_id"]})
+    return sorted(results, key=lambda result: result["index"])
+
 @app.route("/request_delivery", methods=["POST"])
 def request_delivery():
     data = yaml.safe_load(request.data) if request.data else {}
     print("[UI_MS] Received request_delivery from Sender_MS:", data)
-    # Forward to Controller_MS
-    forward = {"action":"request_delivery","sender_data":data}
-    r = requests.post(f"{CONTROLLER_MS}/request_delivery", data=yaml.safe_dump(forward), headers={"Content-Type":"application/x-yaml"})
-    controller_resp = yaml.safe_load(r.content)
-    # notify sender to acknowledge
+    # Queue it for the Controller; the sender polls /request_status or watches /events
+    sender_id = request.headers.get("X-Sender-Id") or data.get("sender_id") or "anonymous"
+    tracking_id = f"TRK-{uuid.uuid4().hex[:12]}"
+    now = time.time()
+    conn = sqlite3.connect(INTAKE_DB, timeout=30)
     try:
-        requests.post(f"{SENDER_MS}/notify", data=yaml.safe_dump({"status":"notified_sender"}), headers={"Content-Type":"application/x-yaml"}, timeout=2)
-    except Exception as e:
-        print("[UI_MS] Warning: couldn't notify Sender_MS:", e)
-    return yaml_response({"status":"forwarded_to_controller", "controller": controller_resp})
+        conn.execute("INSERT INTO intake (tracking_id, sender_id, payload, status, next_attempt, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                     (tracking_id, sender_id, yaml.safe_dump(data), now, now, now))
+        conn.commit()
+    finally:
+        conn.close()
+    intake_wakeup.set()
+    hub.publish(sender_id, {"state":"queued", "tracking_id":tracking_id})
+    return yaml_response({"status":"accepted", "tracking_id":tracking_id, "status_url":f"/request_status/{tracking_id}", "events_url":f"/events/{sender_id}"}, 202)
+
+@app.route("/request_status/<tracking_id>", methods=["GET"])
+def request_status(tracking_id):
+    conn = sqlite3.connect(INTAKE_DB, timeout=30)
+    try:
+        row = conn.execute("SELECT status, attempts, result FROM intake WHERE tracking_id = ?", (tracking_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return yaml_response({"status":"unknown", "tracking_id":tracking_id}, 404)
+    return yaml_response({"status":row[0], "tracking_id":tracking_id, "attempts":row[1], "controller":yaml.safe_load(row[2]) if row[2] else None})
+
+@app.route("/request_delivery_bulk", methods=["POST"])
+def request_delivery_bulk():
+    """
+    Bulk intake from Sender_MS. The manifest is parsed as it arrives and handed
+    to the Controller in batches of BULK_BATCH_SIZE; results are streamed back
+    in the manifest's own format, one record per parcel.
+    """
+    content_type = request.content_type or "application/x-yaml"
+    stream = request.stream
+
+    def results():
+        batch = []
+        for record in iter_manifest(stream, content_type):
+            batch.append(record)
+            if len(batch) >= BULK_BATCH_SIZE:
+                for result in forward_batch(batch):
+                    yield format_result(result, content_type)
+                batch = []
+        if batch:
+            for result in forward_batch(batch):
+                yield format_result(result, content_type)
+
+    print("[UI_MS] Receiving bulk manifest from Sender_MS")
+    mimetype = NDJSON_MIME if "json" in content_type else "application/x-yaml"
+    return Response(stream_with_context(results()), mimetype=mimetype)
+
+def route_notification(n):
+    # Assignments carry the tracking id (the Controller's idempotency key), updates the parcel id
+    details = n.get("assignment") or n.get("update") or {}
+    if n.get("tracking_id") or details.get("parcel_id"):
+        push(dict(n, state=n.get("status")), n.get("tracking_id"), details.get("parcel_id"))
 
 @app.route("/notify", methods=["POST"])
 def notify():
-    data = yaml.safe_load(request.data)
+    data = yaml.safe_load(request.data) or {}
     print("[UI_MS] Notification received (from Controller or others):", data)
+    route_notification(data)
     # Acknowledge to the notifier (Controller usually)
     return yaml_response({"status":"ack", "from":"UI_MS"})
 
+@app.route("/notify_batch", methods=["POST"])
+def notify_batch():
+    data = yaml.safe_load(request.data) or {}
+    notifications = data.get("notifications") or []
+    for n in notifications:
+        print("[UI_MS] Notification received (from Controller or others):", n)
+        route_notification(n)
+    return yaml_response({"status":"ack", "from":"UI_MS", "count":len(notifications)})
+
+@app.route("/events/<sender_id>", methods=["GET"])
+def events(sender_id):
+    """
+    Server-Sent Events: one long-lived stream carries every update for this
+    sender's parcels (?tracking_id= narrows it to one request)
+    """
+    after = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+    tracking_id = request.args.get("tracking_id")
+
+    def stream(after):
+        while True:
+            batch = hub.wait(sender_id, after, PUSH_HEARTBEAT, tracking_id)
+            if not batch:
+                yield ": heartbeat\n\n"
+            for event in batch:
+                after = event["event_id"]
+                yield f"id: {after}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(stream(after)), mimetype="text/event-stream", headers={"Cache-Control":"no-cache"})
+
+@app.route("/poll/<sender_id>", methods=["GET"])
+def poll(sender_id):
+    # Long-poll fallback for clients that cannot keep an SSE stream open
+    after = int(request.args.get("after") or 0)
+    timeout = min(float(request.args.get("timeout") or MAX_POLL_TIMEOUT), MAX_POLL_TIMEOUT)
+    batch = hub.wait(sender_id, after, timeout, request.args.get("tracking_id"))
+    return yaml_response({"status":"ok", "events":batch, "last_event_id":batch[-1]["event_id"] if batch else after})
+
 if __name__ == "__main__":
     app.run(port=5002, debug=True)
 
@@ -2,7 +2,7 @@
 # car_ms.py
 from flask import Flask
 import os, yaml, requests
-from common import yaml_request_data, yaml_response, now_iso
+from common import yaml_request_data, yaml_response, now_iso, with_deadline, hop_request, DeadlineExceeded
 
 app = Flask(__name__)
 
@@ -14,6 +14,7 @@ LOG_MS_URL = os.environ.get("LOG_MS_URL", "http://localhost:6006/log")
 CARS = {"CAR-100": {"status":"available"}, "CAR-200": {"status":"busy"}}
 
 @app.route("/check_car", methods=["POST"])
+@with_deadline()
 def check_car():
     data = yaml_request_data()
     requested_car = data.get("car_id")
@@ -25,8 +26,10 @@ def check_car():
         try:
             headers = {"Content-Type":"application/x-yaml"}
             payload = {"car_id": requested_car, "ts": now_iso()}
-            r = requests.post(f"{STORAGE_MS_URL}/store_car", data=yaml.safe_dump(payload), headers=headers, timeout=5)
+            r = hop_request("POST", f"{STORAGE_MS_URL}/store_car", 5, "store_car", data=yaml.safe_dump(payload), headers=headers)
             store_ack = yaml.safe_load(r.text) if r.ok else {"status":"error"}
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             store_ack = {"status":"error","error":str(e)}
         # ack to caller
@@ -62,10 +65,15 @@ if __name__ == "__main__":
 
 #(helpers used by services: YAML I/O, sqlite helpers, small logger)
 import yaml
-from flask import Response, request
+import requests
+from flask import Response, request, make_response, g, has_request_context
 import sqlite3
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from functools import wraps
 
 YAML_MIME = "application/x-yaml"
 
@@ -92,11 +100,258 @@ def ensure_db(path, ddl_statements):
 def now_iso():
     return datetime.utcnow().isoformat() + "Z"
 
+class ReadThroughCache:
+    """
+    Size-bounded LRU cache with TTL expiry for read-mostly lookups.
+    Writers call invalidate() before returning, so readers never see a value
+    older than the last acknowledged write.
+    """
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        # bumped on every invalidation; a load that raced with a write is not cached
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, loader, bypass=False):
+        with self._lock:
+            if bypass:
+                self.bypasses += 1
+            else:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry[0] > time.monotonic():
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return entry[1]
+                    del self._entries[key]
+                    self.expirations += 1
+                self.misses += 1
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bypasses": self.bypasses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+def cache_bypassed():
+    # per-request opt-out: "Cache-Control: no-cache" header or ?cache=bypass
+    return "no-cache" in request.headers.get("Cache-Control", "") or request.args.get("cache") == "bypass"
+
+class IdempotencyStore:
+    """
+    Remembers the response sent for each idempotency key so a retried request
+    gets the original result instead of redoing the work. Recent results sit
+    in a bounded LRU, all results in an SQLite table (kept for ttl seconds).
+    A duplicate that arrives while the original is still running waits for
+    it rather than running in parallel. 5xx results are not remembered, so
+    a retry after a failure does the work again.
+    """
+    def __init__(self, path, max_entries=10000, ttl=86400.0, wait_timeout=30.0):
+        self.conn = ensure_db(path, ["CREATE TABLE IF NOT EXISTS idempotency (key TEXT PRIMARY KEY, status INTEGER, body TEXT, mimetype TEXT, created REAL)"])
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._recent = OrderedDict()  # key -> (created, (status, body, mimetype))
+        self._inflight = {}           # key -> threading.Event
+        self._lock = threading.Lock()
+        self.replays = 0
+        self.stored = 0
+
+    def _lookup(self, key):
+        entry = self._recent.get(key)
+        if entry is None:
+            row = self.conn.execute("SELECT created, status, body, mimetype FROM idempotency WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            entry = (row[0], (row[1], row[2], row[3]))
+        if entry[0] + self.ttl < time.time():
+            return None
+        self._remember(key, entry)
+        return entry[1]
+
+    def _remember(self, key, entry):
+        self._recent[key] = entry
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    def run(self, key, fn):
+        """Return ((status, body, mimetype), replayed); result is None if the original is still running"""
+        with self._lock:
+            result = self._lookup(key)
+            if result is not None:
+                self.replays += 1
+                return result, True
+            done = self._inflight.get(key)
+            owner = done is None
+            if owner:
+                done = self._inflight[key] = threading.Event()
+        if not owner:
+            done.wait(self.wait_timeout)
+            with self._lock:
+                result = self._lookup(key)
+                if result is not None:
+                    self.replays += 1
+            return result, result is not None
+        result = None
+        try:
+            result = fn()
+            if result[0] < 500:
+                created = time.time()
+                with self._lock:
+                    self.conn.execute("INSERT OR REPLACE INTO idempotency (key, status, body, mimetype, created) VALUES (?, ?, ?, ?, ?)", (key, result[0], result[1], result[2], created))
+                    self.stored += 1
+                    if self.stored % 1000 == 0:
+                        self.conn.execute("DELETE FROM idempotency WHERE created < ?", (created - self.ttl,))
+                    self.conn.commit()
+                    self._remember(key, (created, result))
+            return result, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"recent": len(self._recent), "inflight": len(self._inflight), "replays": self.replays, "stored": self.stored}
+
+def idempotency_key():
+    return request.headers.get("Idempotency-Key")
+
+# Request deadlines: the entry point sets a time budget and every hop forwards
+# what is left of it. The header carries milliseconds remaining rather than an
+# absolute time, so clock skew between the laptops and the server does not matter.
+DEADLINE_HEADER = "X-Request-Budget-Ms"
+DEFAULT_BUDGET = float(os.environ.get("DEFAULT_REQUEST_BUDGET", 10.0))
+MIN_HOP_BUDGET = 0.05  # below this a call cannot finish, so do not start it
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Deadline:
+    def __init__(self, seconds=None):
+        self.expires = None if seconds is None else time.monotonic() + seconds
+
+    @classmethod
+    def from_request(cls, default=DEFAULT_BUDGET):
+        raw = request.headers.get(DEADLINE_HEADER)
+        return cls(float(raw) / 1000.0 if raw else default)
+
+    @classmethod
+    def at(cls, epoch):
+        return cls(None if epoch is None else epoch - time.time())
+
+    def remaining(self):
+        return float("inf") if self.expires is None else self.expires - time.monotonic()
+
+    def check(self, step):
+        """Raise DeadlineExceeded instead of starting `step` with no budget left"""
+        if self.remaining() < MIN_HOP_BUDGET:
+            raise DeadlineExceeded(step)
+
+    def timeout(self, cap, step):
+        self.check(step)
+        return min(cap, self.remaining())
+
+    def headers(self, base):
+        if self.expires is None:
+            return base
+        return dict(base, **{DEADLINE_HEADER: str(max(int(self.remaining() * 1000), 0))})
+
+def current_deadline():
+    if has_request_context() and "deadline" in g:
+        return g.deadline
+    return Deadline(None)
+
+def hop_request(method, url, cap, step, deadline=None, headers=None, **kwargs):
+    """
+    requests.request bounded by the request deadline: the timeout is the
+    smaller of `cap` and the budget left, and the downstream service gets
+    the remaining budget so it can stop at the same moment we give up.
+    """
+    deadline = deadline or current_deadline()
+    try:
+        return requests.request(method, url, headers=deadline.headers(headers or {}), timeout=deadline.timeout(cap, step), **kwargs)
+    except requests.Timeout:
+        if deadline.remaining() < MIN_HOP_BUDGET:
+            raise DeadlineExceeded(step) from None
+        raise
+
+def with_deadline(default=DEFAULT_BUDGET):
+    """Bind the caller's deadline to the request; answer 504 once it has passed"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.deadline = Deadline.from_request(default)
+            try:
+                g.deadline.check(request.path)
+                return view(*args, **kwargs)
+            except DeadlineExceeded as e:
+                return yaml_response({"status":"error","reason":"deadline_exceeded","step":str(e)}, 504)
+        return wrapper
+    return decorator
+
+def idempotent(store):
+    """Replay the stored response for requests carrying a known Idempotency-Key header"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = idempotency_key()
+            if not key:
+                return view(*args, **kwargs)
+            def call():
+                resp = make_response(view(*args, **kwargs))
+                return resp.status_code, resp.get_data(as_text=True), resp.mimetype
+            result, replayed = store.run(f"{request.path}:{key}", call)
+            if result is None:
+                return yaml_response({"status":"error","reason":"request with this Idempotency-Key is still in progress"}, 409)
+            resp = Response(result[1], status=result[0], mimetype=result[2])
+            if replayed:
+                resp.headers["Idempotent-Replayed"] = "true"
+            return resp
+        return wrapper
+    return decorator
+
 #The orchestrator that implements your full sequence. This is the longest piece — it drives the entire interaction chain.
 # controller_ms.py
 from flask import Flask
 import os, requests, yaml, time
-from common import yaml_request_data, yaml_response, now_iso
+from common import yaml_request_data, yaml_response, now_iso, IdempotencyStore, idempotent, idempotency_key, with_deadline, hop_request, current_deadline, DeadlineExceeded
 
 app = Flask(__name__)
 
@@ -108,6 +363,14 @@ UI_CALLBACK = os.environ.get("UI_CALLBACK", "http://localhost:6001/notify_from_c
 
 HEADERS = {"Content-Type":"application/x-yaml"}
 
+# Retried request_delivery calls (same Idempotency-Key) get the original assignment back
+idempotency = IdempotencyStore(os.environ.get("CONTROLLER_IDEMPOTENCY_DB", "controller_idempotency.db"))
+
+def hop_headers(hop):
+    # Derive a per-hop key so Storage_MS can dedupe our own retries too
+    key = idempotency_key()
+    return dict(HEADERS, **{"Idempotency-Key": f"{key}:{hop}"}) if key else HEADERS
+
 def log(origin, level, message):
     try:
         payload = {"origin": origin, "level": level, "message": message, "ts": now_iso()}
@@ -116,57 +379,80 @@ def log(origin, level, message):
         pass
 
 @app.route("/request_delivery", methods=["POST"])
+@idempotent(idempotency)
+@with_deadline()
 def request_delivery():
+    # Every step below checks the budget the UI forwarded before starting, and
+    # sizes its timeout from what is left; once it runs out the caller gets 504.
     data = yaml_request_data()
+    deadline = current_deadline()
     log("Controller_MS", "INFO", "Received request_delivery from UI_MS")
     # 1) request parcel ID from IDGen_MS
     try:
-        r = requests.post(IDGEN_URL, data=yaml.safe_dump({"meta": data.get("meta")}), headers=HEADERS, timeout=5)
+        r = hop_request("POST", IDGEN_URL, 5, "idgen", data=yaml.safe_dump({"meta": data.get("meta")}), headers=HEADERS)
+        if r.status_code == 504:
+            raise DeadlineExceeded("idgen")
         idgen_resp = yaml.safe_load(r.text)
         parcel_id = idgen_resp.get("parcel_id")
         log("Controller_MS", "INFO", f"Got parcel id {parcel_id} from IDGen_MS")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return yaml_response({"status":"error","reason":"idgen_failed","error":str(e)}, 500)
 
     # 2) request car id from Car_MS (for example request specific or find available)
     requested_car = data.get("preferred_car", "CAR-100")
     try:
-        r = requests.post(CAR_URL, data=yaml.safe_dump({"car_id": requested_car}), headers=HEADERS, timeout=5)
+        r = hop_request("POST", CAR_URL, 5, "car_check", data=yaml.safe_dump({"car_id": requested_car}), headers=HEADERS)
         car_resp = yaml.safe_load(r.text)
+        if r.status_code == 504:
+            raise DeadlineExceeded("car_check")
         if r.status_code != 200 or car_resp.get("status") != "ok":
             return yaml_response({"status":"error","reason":"car_check_failed","detail":car_resp}, 400)
         car_id = car_resp.get("car_id")
         log("Controller_MS", "INFO", f"Got car id {car_id} from Car_MS")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return yaml_response({"status":"error","reason":"car_request_failed","error":str(e)}, 500)
 
     # 3) read back parcel ID and car ID from Storage_MS (as per your flow)
+    deadline.check("storage_read")
     try:
-        r1 = requests.get(f"{STORAGE_URL}/get_parcel/{parcel_id}", timeout=3)
+        r1 = hop_request("GET", f"{STORAGE_URL}/get_parcel/{parcel_id}", 3, "get_parcel")
         pinfo = yaml.safe_load(r1.text) if r1.ok else {}
-    except:
+    except DeadlineExceeded:
+        raise
+    except Exception:
         pinfo = {}
 
     try:
-        r2 = requests.get(f"{STORAGE_URL}/get_car/{car_id}", timeout=3)
+        r2 = hop_request("GET", f"{STORAGE_URL}/get_car/{car_id}", 3, "get_car")
         cinfo = yaml.safe_load(r2.text) if r2.ok else {}
-    except:
+    except DeadlineExceeded:
+        raise
+    except Exception:
         cinfo = {}
 
     # 4) assign delivery and share with Storage_MS (store_delivery into DB1)
+    deadline.check("store_delivery")
     delivery = {"parcel_id": parcel_id, "car_id": car_id, "status": "assigned", "ts": now_iso(), "meta": data.get("meta")}
     try:
-        r = requests.post(f"{STORAGE_URL}/store_delivery", data=yaml.safe_dump(delivery), headers=HEADERS, timeout=5)
+        r = hop_request("POST", f"{STORAGE_URL}/store_delivery", 5, "store_delivery", data=yaml.safe_dump(delivery), headers=hop_headers("store_delivery"))
         store_ack = yaml.safe_load(r.text) if r.ok else {"status":"error"}
         log("Controller_MS", "INFO", f"Stored delivery {parcel_id} -> {car_id}")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         store_ack = {"status":"error","error":str(e)}
         log("Controller_MS", "ERROR", f"Failed to store delivery: {e}")
 
     # 5) notify Car_MS
     try:
-        r = requests.post(os.environ.get("CAR_NOTIFY_URL", "http://localhost:6020/notify"), data=yaml.safe_dump({"parcel_id": parcel_id, "car_id": car_id, "action":"assign"}), headers=HEADERS, timeout=5)
+        r = hop_request("POST", os.environ.get("CAR_NOTIFY_URL", "http://localhost:6020/notify"), 5, "car_notify", data=yaml.safe_dump({"parcel_id": parcel_id, "car_id": car_id, "action":"assign"}), headers=HEADERS)
         car_ack = yaml.safe_load(r.text) if r.ok else {"status":"error"}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         car_ack = {"status":"error","error":str(e)}
 
@@ -174,8 +460,10 @@ def request_delivery():
 
     # 6) notify UI_MS (which will notify Sender_MS)
     try:
-        r = requests.post(UI_CALLBACK, data=yaml.safe_dump({"parcel_id": parcel_id, "car_id": car_id, "status":"assigned"}), headers=HEADERS, timeout=5)
+        r = hop_request("POST", UI_CALLBACK, 5, "ui_notify", data=yaml.safe_dump({"parcel_id": parcel_id, "car_id": car_id, "status":"assigned", "tracking_id": data.get("tracking_id")}), headers=HEADERS)
         ui_ack = yaml.safe_load(r.text) if r.ok else {"status":"error"}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         ui_ack = {"status":"error","error":str(e)}
 
@@ -196,6 +484,7 @@ def request_delivery():
 
 # Car requests delivery update from Controller_MS
 @app.route("/car_update_request", methods=["POST"])
+@with_deadline()
 def car_update_request():
     data = yaml_request_data()
     car_id = data.get("car_id")
@@ -204,13 +493,13 @@ def car_update_request():
     ack = {"status":"ack","received":data, "ts": now_iso()}
     # share delivery update with Storage_MS
     try:
-        r = requests.post(f"{STORAGE_URL}/update_delivery", data=yaml.safe_dump({"parcel_id": parcel_id, "status": data.get("status", "in_transit"), "ts": now_iso()}), headers=HEADERS, timeout=5)
+        r = hop_request("POST", f"{STORAGE_URL}/update_delivery", 5, "update_delivery", data=yaml.safe_dump({"parcel_id": parcel_id, "status": data.get("status", "in_transit"), "ts": now_iso()}), headers=HEADERS)
         storage_ack = yaml.safe_load(r.text) if r.ok else {"status":"error"}
     except Exception as e:
         storage_ack = {"status":"error","error":str(e)}
     # notify UI_MS -> which notifies Sender_MS
     try:
-        requests.post(UI_CALLBACK, data=yaml.safe_dump({"parcel_id": parcel_id, "car_id": car_id, "status": data.get("status", "in_transit")}), headers=HEADERS, timeout=5)
+        hop_request("POST", UI_CALLBACK, 5, "ui_notify", data=yaml.safe_dump({"parcel_id": parcel_id, "car_id": car_id, "status": data.get("status", "in_transit")}), headers=HEADERS)
     except:
         pass
     # log
@@ -223,7 +512,7 @@ if __name__ == "__main__":
 #Generates parcel IDs and shares with Storage_MS.
 from flask import Flask
 import os, uuid, requests
-from common import yaml_response, yaml_request_data, now_iso
+from common import yaml_response, yaml_request_data, now_iso, with_deadline, hop_request
 import yaml
 
 app = Flask(__name__)
@@ -232,6 +521,7 @@ STORAGE_MS_URL = os.environ.get("STORAGE_MS_URL", "http://localhost:6010")
 LOG_MS_URL = os.environ.get("LOG_MS_URL", "http://localhost:6006/log")
 
 @app.route("/generate", methods=["POST"])
+@with_deadline()
 def generate_id():
     req = yaml_request_data()
     # create a parcel id
@@ -240,7 +530,7 @@ def generate_id():
     # share with Storage_MS
     try:
         headers = {"Content-Type": "application/x-yaml"}
-        r = requests.post(f"{STORAGE_MS_URL}/store_id", data=yaml.safe_dump(payload), headers=headers, timeout=5)
+        r = hop_request("POST", f"{STORAGE_MS_URL}/store_id", 5, "store_id", data=yaml.safe_dump(payload), headers=headers)
         storage_ack = yaml.safe_load(r.text) if r.ok else {"status": "error"}
     except Exception as e:
         storage_ack = {"status": "error", "error": str(e)}
@@ -286,11 +576,15 @@ if __name__ == "__main__":
 # sender_ms.py
 from flask import Flask
 import os, yaml, requests
-from common import yaml_request_data, yaml_response, now_iso
+from common import yaml_request_data, yaml_response, now_iso, DEADLINE_HEADER
 
 app = Flask(__name__)
 
 UI_MS_URL = os.environ.get("UI_MS_URL", "http://localhost:6001/request_delivery")
+UI_EVENTS_URL = os.environ.get("UI_EVENTS_URL", "http://localhost:6001/events")
+SENDER_ID = os.environ.get("SENDER_ID", "Sender_MS")
+# How long this sender waits for an assignment; the services drop the request after that
+SENDER_BUDGET = float(os.environ.get("SENDER_BUDGET", 120))
 
 @app.route("/notify", methods=["POST"])
 def notify():
@@ -310,18 +604,28 @@ if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1 and sys.argv[1] == "send":
         import requests, yaml
-        payload = {"sender":"Sender_MS","pickup":"Location A","dropoff":"Location B","meta":{"weight":"2kg"}}
-        headers = {"Content-Type":"application/x-yaml"}
+        import uuid
+        payload = {"sender":SENDER_ID,"pickup":"Location A","dropoff":"Location B","meta":{"weight":"2kg"}}
+        # Safe to resend with the same key after a timeout
+        headers = {"Content-Type":"application/x-yaml", "Idempotency-Key": uuid.uuid4().hex, DEADLINE_HEADER: str(int(SENDER_BUDGET * 1000))}
         r = requests.post(UI_MS_URL, data=yaml.safe_dump(payload), headers=headers)
         print("UI response:", r.text)
         sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        # Follow every update for this sender's parcels over one SSE connection
+        import requests
+        with requests.get(f"{UI_EVENTS_URL}/{SENDER_ID}", stream=True, timeout=None) as r:
+            for line in r.iter_lines(decode_unicode=True):
+                if line and line.startswith("data: "):
+                    print("Update:", line[len("data: "):])
+        sys.exit(0)
     app.run(host="0.0.0.0", port=int(os.environ.get("SENDER_MS_PORT", 6030)))
 
 #Handles Database_1 (deliveries) and Database_2 (assignments).
 # storage_ms.py
 from flask import Flask
 import os, sqlite3, yaml
-from common import yaml_request_data, yaml_response, ensure_db, now_iso
+from common import yaml_request_data, yaml_response, ensure_db, now_iso, ReadThroughCache, cache_bypassed, IdempotencyStore, idempotent, with_deadline
 
 app = Flask(__name__)
 
@@ -338,7 +642,17 @@ DDL_DELIV = [
 conn_assign = ensure_db(DB_ASSIGN_PATH, DDL_ASSIGN)
 conn_deliv = ensure_db(DB_DELIV_PATH, DDL_DELIV)
 
+# Read-through cache for get_parcel / get_car, keyed ("parcel", id) / ("car", id).
+# Both read the assignments table, so every endpoint writing it (store_id,
+# store_car) invalidates the keys it touches before acknowledging; the
+# deliveries table is never cached.
+cache = ReadThroughCache(
+    max_entries=int(os.environ.get("STORAGE_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("STORAGE_CACHE_TTL", 60)),
+)
+
 @app.route("/store_id", methods=["POST"])
+@with_deadline()
 def store_id():
     data = yaml_request_data()
     parcel_id = data.get("parcel_id")
@@ -349,11 +663,13 @@ def store_id():
     try:
         cur.execute("INSERT OR IGNORE INTO assignments (parcel_id, car_id, ts) VALUES (?, ?, ?)", (parcel_id, None, ts))
         conn_assign.commit()
+        cache.invalidate(("parcel", parcel_id))
         return yaml_response({"status":"ok","parcel_id":parcel_id})
     except Exception as e:
         return yaml_response({"status":"error","error":str(e)}, 500)
 
 @app.route("/store_car", methods=["POST"])
+@with_deadline()
 def store_car():
     data = yaml_request_data()
     car_id = data.get("car_id")
@@ -363,35 +679,52 @@ def store_car():
         return yaml_response({"status":"error","reason":"no car_id"}, 400)
     cur = conn_assign.cursor()
     try:
+        stale = [("car", car_id)]
         # If parcel_id provided, set car for that parcel. Otherwise create separate record
         if parcel_id:
+            # the parcel's previous car may have been answering get_car from this row
+            cur.execute("SELECT car_id FROM assignments WHERE parcel_id=?", (parcel_id,))
+            row = cur.fetchone()
+            if row and row[0]:
+                stale.append(("car", row[0]))
+            stale.append(("parcel", parcel_id))
             cur.execute("UPDATE assignments SET car_id=? WHERE parcel_id=?", (car_id, parcel_id))
         else:
             cur.execute("INSERT INTO assignments (parcel_id, car_id, ts) VALUES (?, ?, ?)", (None, car_id, ts))
         conn_assign.commit()
+        cache.invalidate(*stale)
         return yaml_response({"status":"ok","car_id":car_id, "parcel_id":parcel_id})
     except Exception as e:
         return yaml_response({"status":"error","error":str(e)}, 500)
 
+def _fetch_assignment(column, value):
+    cur = conn_assign.cursor()
+    cur.execute(f"SELECT parcel_id, car_id, ts FROM assignments WHERE {column}=?", (value,))
+    return cur.fetchone()
+
 @app.route("/get_parcel/<parcel_id>", methods=["GET"])
+@with_deadline()
 def get_parcel(parcel_id):
-    cur = conn_assign.cursor()
-    cur.execute("SELECT parcel_id, car_id, ts FROM assignments WHERE parcel_id=?", (parcel_id,))
-    row = cur.fetchone()
+    # misses are cached too; store_id invalidates the key once the parcel exists
+    row = cache.get(("parcel", parcel_id), lambda: _fetch_assignment("parcel_id", parcel_id), bypass=cache_bypassed())
     if not row:
         return yaml_response({"status":"not_found","parcel_id":parcel_id}, 404)
     return yaml_response({"status":"ok","parcel_id":row[0],"car_id":row[1],"ts":row[2]})
 
 @app.route("/get_car/<car_id>", methods=["GET"])
+@with_deadline()
 def get_car(car_id):
-    cur = conn_assign.cursor()
-    cur.execute("SELECT parcel_id, car_id, ts FROM assignments WHERE car_id=?", (car_id,))
-    row = cur.fetchone()
+    row = cache.get(("car", car_id), lambda: _fetch_assignment("car_id", car_id), bypass=cache_bypassed())
     if not row:
         return yaml_response({"status":"not_found","car_id":car_id}, 404)
     return yaml_response({"status":"ok","parcel_id":row[0],"car_id":row[1],"ts":row[2]})
 
+# Duplicate store_delivery calls (same Idempotency-Key) return the first ack instead of a second row
+idempotency = IdempotencyStore(os.environ.get("STORAGE_IDEMPOTENCY_DB", "storage_idempotency.db"))
+
 @app.route("/store_delivery", methods=["POST"])
+@idempotent(idempotency)
+@with_deadline()
 def store_delivery():
     data = yaml_request_data()
     parcel_id = data.get("parcel_id")
@@ -410,6 +743,7 @@ def store_delivery():
         return yaml_response({"status":"error","error":str(e)}, 500)
 
 @app.route("/update_delivery", methods=["POST"])
+@with_deadline()
 def update_delivery():
     data = yaml_request_data()
     parcel_id = data.get("parcel_id")
@@ -422,14 +756,19 @@ def update_delivery():
     conn_deliv.commit()
     return yaml_response({"status":"ok","parcel_id":parcel_id, "new_status":status})
 
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return yaml_response({"status":"ok","cache":cache.stats(),"idempotency":idempotency.stats()})
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("STORAGE_MS_PORT", 6010)))
 
 #Receives request from Sender_MS and forwards to Controller_MS; notifies Sender_MS on updates.
 # ui_ms.py
-from flask import Flask
-import os, yaml, requests
-from common import yaml_request_data, yaml_response, now_iso
+from flask import Flask, Response, request
+import os, yaml, requests, threading, time, uuid
+from collections import deque
+from common import yaml_request_data, yaml_response, ensure_db, now_iso, IdempotencyStore, idempotent, Deadline, DeadlineExceeded, hop_request, DEADLINE_HEADER
 
 app = Flask(__name__)
 
@@ -437,42 +776,280 @@ CONTROLLER_URL = os.environ.get("CONTROLLER_URL", "http://localhost:6000/request
 SENDER_CALLBACK = os.environ.get("SENDER_CALLBACK", "http://localhost:6030/ack")
 LOG_MS_URL = os.environ.get("LOG_MS_URL", "http://localhost:6006/log")
 
-@app.route("/request_delivery", methods=["POST"])
-def request_delivery():
-    data = yaml_request_data()
-    # Forward to Controller_MS
+# Durable intake queue: /request_delivery only writes here and answers 202,
+# dispatcher threads drain it into Controller_MS.
+INTAKE_DB_PATH = os.environ.get("INTAKE_DB", "intake.db")
+DISPATCHERS = int(os.environ.get("INTAKE_DISPATCHERS", 4))
+MAX_ATTEMPTS = int(os.environ.get("INTAKE_MAX_ATTEMPTS", 5))
+RETRY_BACKOFF = float(os.environ.get("INTAKE_RETRY_BACKOFF", 2.0))
+# Budget for requests whose sender sent no deadline header (0 = wait indefinitely)
+INTAKE_BUDGET = float(os.environ.get("INTAKE_BUDGET", 0))
+
+DDL_INTAKE = [
+    "CREATE TABLE IF NOT EXISTS intake (tracking_id TEXT PRIMARY KEY, payload TEXT, status TEXT, attempts INTEGER DEFAULT 0, next_attempt REAL, created_ts TEXT, updated_ts TEXT, result TEXT, deadline REAL)",
+    "CREATE INDEX IF NOT EXISTS intake_ready ON intake (status, next_attempt)"
+]
+
+conn_intake = ensure_db(INTAKE_DB_PATH, DDL_INTAKE)
+conn_intake.execute("PRAGMA journal_mode=WAL")
+if "deadline" not in [col[1] for col in conn_intake.execute("PRAGMA table_info(intake)")]:
+    # intake.db created before deadlines were tracked
+    conn_intake.execute("ALTER TABLE intake ADD COLUMN deadline REAL")
+# Which sender (and parcel, once known) each tracking id belongs to, for push routing
+conn_intake.execute("CREATE TABLE IF NOT EXISTS routes (tracking_id TEXT PRIMARY KEY, sender_id TEXT, parcel_id TEXT)")
+conn_intake.execute("CREATE INDEX IF NOT EXISTS routes_parcel ON routes (parcel_id)")
+conn_intake.commit()
+intake_lock = threading.Lock()
+intake_ready = threading.Event()
+
+# Push channel to senders: one SSE stream (or long-poll loop) per sender carries
+# every update for that sender's parcels. Per-event callbacks are opt-in.
+PUSH_BUFFER = int(os.environ.get("PUSH_BUFFER", 256))
+PUSH_HEARTBEAT = float(os.environ.get("PUSH_HEARTBEAT", 15))
+LONG_POLL_TIMEOUT = float(os.environ.get("LONG_POLL_TIMEOUT", 25))
+LEGACY_CALLBACKS = os.environ.get("SENDER_CALLBACKS", "0") == "1"
+
+class SubscriptionHub:
+    """
+    Per-sender event buffers with blocking waits. Each sender has a bounded
+    replay buffer and its own condition, so a publish only wakes that
+    sender's watchers. Event ids start from the wall clock and only grow,
+    so a client resuming with Last-Event-ID after a UI_MS restart does not
+    skip new events.
+    """
+    def __init__(self, buffer_size=256, idle_ttl=3600):
+        self.buffer_size = buffer_size
+        self.idle_ttl = idle_ttl
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.next_id = int(time.time() * 1000)
+        self.published = 0
+
+    def _channel(self, sender_id):
+        ch = self.channels.get(sender_id)
+        if ch is None:
+            ch = self.channels[sender_id] = {"events": deque(maxlen=self.buffer_size), "cond": threading.Condition(self.lock), "watchers": 0}
+        ch["touched"] = time.time()
+        return ch
+
+    def publish(self, sender_id, event):
+        with self.lock:
+            ch = self._channel(sender_id)
+            self.next_id += 1
+            ch["events"].append(dict(event, event_id=self.next_id))
+            ch["cond"].notify_all()
+            self.published += 1
+            if self.published % 1000 == 0:
+                cutoff = time.time() - self.idle_ttl
+                for sid in [sid for sid, c in self.channels.items() if not c["watchers"] and c["touched"] < cutoff]:
+                    del self.channels[sid]
+
+    def wait(self, sender_id, after, timeout, tracking_id=None):
+        """Events for sender_id newer than `after`, blocking up to timeout for the first one"""
+        deadline = time.time() + timeout
+        with self.lock:
+            ch = self._channel(sender_id)
+            ch["watchers"] += 1
+            try:
+                while True:
+                    events = [e for e in ch["events"] if e["event_id"] > after and (tracking_id is None or e.get("tracking_id") == tracking_id)]
+                    remaining = deadline - time.time()
+                    if events or remaining <= 0:
+                        return events
+                    ch["cond"].wait(remaining)
+            finally:
+                ch["watchers"] -= 1
+                ch["touched"] = time.time()
+
+    def stats(self):
+        with self.lock:
+            return {"senders": len(self.channels), "watchers": sum(c["watchers"] for c in self.channels.values()), "published": self.published}
+
+hub = SubscriptionHub(PUSH_BUFFER)
+
+# A sender retrying /request_delivery with the same Idempotency-Key gets its original tracking_id
+idempotency = IdempotencyStore(os.environ.get("UI_IDEMPOTENCY_DB", "ui_idempotency.db"))
+
+def route_for(tracking_id=None, parcel_id=None):
+    with intake_lock:
+        if tracking_id:
+            row = conn_intake.execute("SELECT tracking_id, sender_id FROM routes WHERE tracking_id=?", (tracking_id,)).fetchone()
+            if row and parcel_id:
+                conn_intake.execute("UPDATE routes SET parcel_id=? WHERE tracking_id=?", (parcel_id, tracking_id))
+                conn_intake.commit()
+        else:
+            row = conn_intake.execute("SELECT tracking_id, sender_id FROM routes WHERE parcel_id=?", (parcel_id,)).fetchone()
+    return row
+
+def push(tracking_id, sender_id, state, **fields):
+    hub.publish(sender_id, dict(fields, tracking_id=tracking_id, state=state, ts=now_iso()))
+
+# Requests a previous run was dispatching when it stopped go back to the queue
+with intake_lock:
+    conn_intake.execute("UPDATE intake SET status='queued' WHERE status='dispatching'")
+    conn_intake.commit()
+
+def claim_next():
+    with intake_lock:
+        row = conn_intake.execute(
+            "SELECT tracking_id, payload, attempts, deadline FROM intake WHERE status='queued' AND next_attempt<=? ORDER BY next_attempt LIMIT 1",
+            (time.time(),)).fetchone()
+        if row is None:
+            return None
+        conn_intake.execute("UPDATE intake SET status='dispatching', attempts=attempts+1, updated_ts=? WHERE tracking_id=?", (now_iso(), row[0]))
+        conn_intake.commit()
+    return row[0], yaml.safe_load(row[1]), row[2] + 1, row[3]
+
+def finish(tracking_id, status, result, next_attempt=None):
+    with intake_lock:
+        conn_intake.execute(
+            "UPDATE intake SET status=?, result=?, next_attempt=COALESCE(?, next_attempt), updated_ts=? WHERE tracking_id=?",
+            (status, yaml.safe_dump(result), next_attempt, now_iso(), tracking_id))
+        conn_intake.commit()
+
+def dispatch(tracking_id, data, attempt, deadline_ts=None):
+    headers = {"Content-Type":"application/x-yaml"}
+    sender_id = data.get("sender") or "anonymous"
+    deadline = Deadline.at(deadline_ts)
     try:
-        headers = {"Content-Type":"application/x-yaml"}
-        r = requests.post(CONTROLLER_URL, data=yaml.safe_dump(data), headers=headers, timeout=10)
-        controller_resp = yaml.safe_load(r.text) if r.ok else {"status":"error"}
-        # Acknowledge Sender
-        try:
-            requests.post(SENDER_CALLBACK, data=yaml.safe_dump({"status":"forwarded","controller":controller_resp}), headers=headers, timeout=3)
-        except:
-            pass
+        # The tracking id doubles as idempotency key, so redelivering a row never assigns twice
+        r = hop_request("POST", CONTROLLER_URL, 10, "controller", deadline=deadline, data=yaml.safe_dump(dict(data, tracking_id=tracking_id)), headers=dict(headers, **{"Idempotency-Key": tracking_id}))
+        controller_resp = yaml.safe_load(r.text) if r.text else {}
+    except DeadlineExceeded:
+        r, controller_resp = None, {"status":"error","reason":"deadline_exceeded"}
     except Exception as e:
-        controller_resp = {"status":"error","error":str(e)}
-    # Acknowledge UI -> Controller
+        r, controller_resp = None, {"status":"error","error":str(e)}
+    next_attempt = time.time() + RETRY_BACKOFF * 2 ** (attempt - 1)
+    if r is not None and r.ok:
+        finish(tracking_id, "completed", controller_resp)
+        push(tracking_id, sender_id, "completed", parcel_id=controller_resp.get("parcel_id"), car_id=controller_resp.get("car_id"))
+        # Acknowledge Sender
+        if LEGACY_CALLBACKS:
+            try:
+                requests.post(SENDER_CALLBACK, data=yaml.safe_dump({"status":"forwarded","tracking_id":tracking_id,"controller":controller_resp}), headers=headers, timeout=3)
+            except:
+                pass
+    elif r is not None and r.status_code < 500:
+        # Controller rejected the request itself; retrying will not help
+        finish(tracking_id, "failed", controller_resp)
+        push(tracking_id, sender_id, "failed", reason=controller_resp.get("reason"))
+    elif deadline_ts is not None and next_attempt >= deadline_ts:
+        # The sender stops waiting before a retry could finish
+        finish(tracking_id, "expired", controller_resp)
+        push(tracking_id, sender_id, "expired", reason="deadline_exceeded")
+    elif attempt >= MAX_ATTEMPTS:
+        finish(tracking_id, "failed", controller_resp)
+        push(tracking_id, sender_id, "failed", reason="controller unavailable")
+    else:
+        finish(tracking_id, "queued", controller_resp, next_attempt)
     try:
-        requests.post(LOG_MS_URL, data=yaml.safe_dump({"origin":"UI_MS","level":"INFO","message":"Forwarded delivery request to controller","ts":now_iso()}), headers={"Content-Type":"application/x-yaml"})
+        requests.post(LOG_MS_URL, data=yaml.safe_dump({"origin":"UI_MS","level":"INFO","message":f"Dispatched {tracking_id} to controller (attempt {attempt})","ts":now_iso()}), headers=headers, timeout=3)
     except:
         pass
-    return yaml_response({"status":"ok","controller_response":controller_resp})
+
+def dispatcher():
+    while True:
+        claimed = claim_next()
+        if claimed is None:
+            intake_ready.wait(timeout=1.0)
+            intake_ready.clear()
+            continue
+        tracking_id, data, attempt, deadline_ts = claimed
+        if deadline_ts is not None and Deadline.at(deadline_ts).remaining() < 0.05:
+            # Nobody is waiting for this any more: do not spend the Controller on it
+            finish(tracking_id, "expired", {"status":"error","reason":"deadline_exceeded"})
+            push(tracking_id, data.get("sender") or "anonymous", "expired", reason="deadline_exceeded")
+            continue
+        dispatch(*claimed)
+
+for _ in range(DISPATCHERS):
+    threading.Thread(target=dispatcher, daemon=True).start()
+
+@app.route("/request_delivery", methods=["POST"])
+@idempotent(idempotency)
+def request_delivery():
+    data = yaml_request_data()
+    tracking_id = f"TRK-{uuid.uuid4().hex}"
+    sender_id = data.get("sender") or "anonymous"
+    ts = now_iso()
+    # Local wall-clock time is fine here: only this process compares against it
+    budget = request.headers.get(DEADLINE_HEADER)
+    budget = float(budget) / 1000.0 if budget else INTAKE_BUDGET
+    deadline_ts = time.time() + budget if budget else None
+    with intake_lock:
+        conn_intake.execute(
+            "INSERT INTO intake (tracking_id, payload, status, next_attempt, created_ts, updated_ts, deadline) VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+            (tracking_id, yaml.safe_dump(data), time.time(), ts, ts, deadline_ts))
+        conn_intake.execute("INSERT INTO routes (tracking_id, sender_id) VALUES (?, ?)", (tracking_id, sender_id))
+        conn_intake.commit()
+    intake_ready.set()
+    push(tracking_id, sender_id, "queued")
+    return yaml_response({"status":"accepted","tracking_id":tracking_id,"status_url":f"/request_status/{tracking_id}","events_url":f"/events/{sender_id}"}, 202)
+
+@app.route("/request_status/<tracking_id>", methods=["GET"])
+def request_status(tracking_id):
+    with intake_lock:
+        row = conn_intake.execute(
+            "SELECT status, attempts, created_ts, updated_ts, result FROM intake WHERE tracking_id=?",
+            (tracking_id,)).fetchone()
+    if row is None:
+        return yaml_response({"status":"error","reason":"unknown tracking_id"}, 404)
+    return yaml_response({
+        "tracking_id": tracking_id,
+        "state": row[0],
+        "attempts": row[1],
+        "created_ts": row[2],
+        "updated_ts": row[3],
+        "controller_response": yaml.safe_load(row[4]) if row[4] else None
+    })
 
 @app.route("/notify_from_controller", methods=["POST"])
 def notify_from_controller():
     data = yaml_request_data()
-    # Controller notifies UI to inform Sender
-    # Notify Sender_MS
-    headers = {"Content-Type":"application/x-yaml"}
-    sender_url = os.environ.get("SENDER_URL", "http://localhost:6030/notify")
-    try:
-        r = requests.post(sender_url, data=yaml.safe_dump(data), headers=headers, timeout=5)
-        sender_ack = yaml.safe_load(r.text) if r.ok else {"status":"error"}
-    except Exception as e:
-        sender_ack = {"status":"error","error":str(e)}
+    # Controller notifies UI to inform Sender: push to the sender's open stream
+    route = route_for(data.get("tracking_id"), data.get("parcel_id"))
+    if route:
+        push(route[0], route[1], data.get("status"), parcel_id=data.get("parcel_id"), car_id=data.get("car_id"))
+    sender_ack = {"status":"pushed" if route else "no_route"}
+    if LEGACY_CALLBACKS:
+        headers = {"Content-Type":"application/x-yaml"}
+        sender_url = os.environ.get("SENDER_URL", "http://localhost:6030/notify")
+        try:
+            r = requests.post(sender_url, data=yaml.safe_dump(data), headers=headers, timeout=5)
+            sender_ack = yaml.safe_load(r.text) if r.ok else {"status":"error"}
+        except Exception as e:
+            sender_ack = {"status":"error","error":str(e)}
     return yaml_response({"status":"ok","sender_ack":sender_ack})
 
+@app.route("/events/<sender_id>", methods=["GET"])
+def events(sender_id):
+    # Server-Sent Events: one long-lived connection per sender, resumable via Last-Event-ID
+    tracking_id = request.args.get("tracking_id")
+    last_id = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+    def stream():
+        after = last_id
+        while True:
+            batch = hub.wait(sender_id, after, PUSH_HEARTBEAT, tracking_id)
+            if not batch:
+                yield ": keep-alive\n\n"
+                continue
+            for event in batch:
+                after = event["event_id"]
+                yield f"id: {after}\nevent: {event['state']}\ndata: {yaml.safe_dump(event, default_flow_style=True, width=float('inf')).strip()}\n\n"
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
+
+@app.route("/poll/<sender_id>", methods=["GET"])
+def poll(sender_id):
+    # Long-poll fallback for clients that cannot hold an SSE stream
+    after = int(request.args.get("after", 0))
+    timeout = min(float(request.args.get("timeout", LONG_POLL_TIMEOUT)), LONG_POLL_TIMEOUT)
+    batch = hub.wait(sender_id, after, timeout, request.args.get("tracking_id"))
+    return yaml_response({"events": batch, "last_id": batch[-1]["event_id"] if batch else after})
+
+@app.route("/push_stats", methods=["GET"])
+def push_stats():
+    return yaml_response({"status":"ok","push":hub.stats()})
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("UI_MS_PORT", 6001)))
 
@@ -268,13 +268,91 @@ if __name__ == "__main__":
 
 # storage.py
 from flask import Flask, request, Response
-import yaml, sqlite3, os
+import yaml, sqlite3, os, threading, time
+from collections import OrderedDict
 
 DB1 = "database_1_parcels.sqlite"     # stores deliveries / parcels
 DB2 = "database_2_assignments.sqlite" # stores parcel id and car id assignments
 
+CACHE_MAX_ENTRIES = 10000
+CACHE_TTL = 60  # seconds
+
 app = Flask("Storage_MS")
 
+class ReadThroughCache:
+    """
+    Size-bounded LRU cache with TTL expiry for read-mostly lookups.
+    Writers call invalidate() before returning, so readers never see a value
+    older than the last acknowledged write.
+    """
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        # bumped on every invalidation; a load that raced with a write is not cached
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, loader, bypass=False):
+        with self._lock:
+            if bypass:
+                self.bypasses += 1
+            else:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry[0] > time.monotonic():
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return entry[1]
+                    del self._entries[key]
+                    self.expirations += 1
+                self.misses += 1
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bypasses": self.bypasses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+id_cache = ReadThroughCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+
+def cache_bypassed():
+    # callers can force a disk read with "Cache-Control: no-cache" or ?cache=bypass
+    return "no-cache" in request.headers.get("Cache-Control", "") or request.args.get("cache") == "bypass"
+
 def init_db():
     if not os.path.exists(DB1):
         conn = sqlite3.connect(DB1)
@@ -313,15 +391,20 @@ def store_id():
     c.execute("INSERT OR REPLACE INTO assignments (key,value) VALUES (?,?)", (key, value))
     conn.commit()
     conn.close()
+    id_cache.invalidate(key)
     return Response(yaml.safe_dump({"status":"ok"}), mimetype="application/x-yaml")
 
-@app.route("/get_id/<key>", methods=["GET"])
-def get_id(key):
+def fetch_id(key):
     conn = sqlite3.connect(DB2)
     c = conn.cursor()
     c.execute("SELECT value FROM assignments WHERE key=?", (key,))
     row = c.fetchone()
     conn.close()
+    return row
+
+@app.route("/get_id/<key>", methods=["GET"])
+def get_id(key):
+    row = id_cache.get(key, lambda: fetch_id(key), bypass=cache_bypassed())
     if not row:
         return Response(yaml.safe_dump({"status":"not_found"}), mimetype="application/x-yaml", status=404)
     return Response(yaml.safe_dump({"status":"ok","value":row[0]}), mimetype="application/x-yaml")
@@ -361,31 +444,118 @@ def update_delivery():
     conn.close()
     return Response(yaml.safe_dump({"status":"ok"}), mimetype="application/x-yaml")
 
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return Response(yaml.safe_dump({"status":"ok","cache":id_cache.stats()}), mimetype="application/x-yaml")
+
 if __name__ == "__main__":
     init_db()
     app.run(host="0.0.0.0", port=5003)
 
 # ui.py
 from flask import Flask, request, Response
-import yaml, requests
+import yaml, requests, sqlite3, threading, time, uuid
 import yaml as y
 
 conf = y.safe_load(open("config.yaml"))
 CONTROLLER_URL = f"http://{conf['controller_host']}:{conf['controller_port']}"
 SENDER_URL = f"http://{conf['sender_host']}:{conf['sender_port']}"
 
+# Requests are written to this queue and answered with 202; dispatcher
+# threads forward them to the controller and retry 5xx/timeouts with backoff.
+# The controller notifies the sender through /notify once a car is assigned.
+INTAKE_DB = "ui_intake.sqlite"
+INTAKE_DISPATCHERS = 4
+INTAKE_MAX_ATTEMPTS = 5
+INTAKE_BACKOFF = 1.0
+
 app = Flask("UI_MS")
 
+def init_intake():
+    conn = sqlite3.connect(INTAKE_DB)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS intake(
+        tracking_id TEXT PRIMARY KEY, payload TEXT, status TEXT,
+        attempts INTEGER DEFAULT 0, next_attempt REAL, updated_at REAL, result TEXT)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS intake_ready ON intake(status, next_attempt)")
+    # anything a previous run was forwarding when it stopped is forwarded again
+    conn.execute("UPDATE intake SET status='queued' WHERE status='dispatching'")
+    conn.commit()
+    conn.close()
+
+init_intake()
+intake_wakeup = threading.Event()
+
+def claim_next():
+    conn = sqlite3.connect(INTAKE_DB, isolation_level=None, timeout=30)
+    try:
+        with conn:
+            # BEGIN IMMEDIATE so two dispatchers never claim the same row
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tracking_id, payload, attempts FROM intake WHERE status='queued' AND next_attempt<=? ORDER BY next_attempt LIMIT 1", (time.time(),)).fetchone()
+            if row:
+                conn.execute("UPDATE intake SET status='dispatching', attempts=attempts+1, updated_at=? WHERE tracking_id=?", (time.time(), row[0]))
+    finally:
+        conn.close()
+    return row
+
+def finish(tracking_id, status, result, next_attempt=None):
+    conn = sqlite3.connect(INTAKE_DB, timeout=30)
+    conn.execute("UPDATE intake SET status=?, result=?, next_attempt=COALESCE(?, next_attempt), updated_at=? WHERE tracking_id=?",
+                 (status, result, next_attempt, time.time(), tracking_id))
+    conn.commit()
+    conn.close()
+
+def dispatch(tracking_id, payload, attempts):
+    headers = {"Content-Type":"application/x-yaml", "Idempotency-Key":tracking_id}
+    try:
+        r = requests.post(f"{CONTROLLER_URL}/handle_request_delivery", data=payload, headers=headers, timeout=30)
+    except requests.RequestException as e:
+        r, result = None, yaml.safe_dump({"status":"error", "error":str(e)})
+    else:
+        result = r.text
+    if r is not None and r.status_code < 300:
+        finish(tracking_id, "completed", result)
+    elif r is not None and r.status_code < 500:
+        finish(tracking_id, "failed", result)
+    elif attempts + 1 >= INTAKE_MAX_ATTEMPTS:
+        finish(tracking_id, "failed", result)
+    else:
+        finish(tracking_id, "queued", result, time.time() + INTAKE_BACKOFF * 2 ** attempts)
+
+def dispatcher():
+    while True:
+        intake_wakeup.clear()
+        row = claim_next()
+        if row is None:
+            intake_wakeup.wait(1.0)
+            continue
+        dispatch(*row)
+
 @app.route("/request_delivery", methods=["POST"])
 def request_delivery():
     if request.content_type != "application/x-yaml":
         return Response("Unsupported content type", status=415)
     data = yaml.safe_load(request.data)
-    # forward to controller
-    headers = {"Content-Type":"application/x-yaml"}
-    r = requests.post(f"{CONTROLLER_URL}/handle_request_delivery", data=yaml.safe_dump(data), headers=headers)
-    # forward controller's response back to sender (simulate notify)
-    return Response(r.content, mimetype="application/x-yaml", status=r.status_code)
+    tracking_id = uuid.uuid4().hex
+    conn = sqlite3.connect(INTAKE_DB, timeout=30)
+    conn.execute("INSERT INTO intake(tracking_id, payload, status, next_attempt, updated_at) VALUES (?,?,'queued',?,?)",
+                 (tracking_id, yaml.safe_dump(data), time.time(), time.time()))
+    conn.commit()
+    conn.close()
+    intake_wakeup.set()
+    body = {"status":"accepted", "tracking_id":tracking_id, "status_url":f"/request_status/{tracking_id}"}
+    return Response(yaml.safe_dump(body), mimetype="application/x-yaml", status=202)
+
+@app.route("/request_status/<tracking_id>", methods=["GET"])
+def request_status(tracking_id):
+    conn = sqlite3.connect(INTAKE_DB, timeout=30)
+    row = conn.execute("SELECT status, attempts, result FROM intake WHERE tracking_id=?", (tracking_id,)).fetchone()
+    conn.close()
+    if row is None:
+        return Response(yaml.safe_dump({"status":"unknown"}), mimetype="application/x-yaml", status=404)
+    body = {"tracking_id":tracking_id, "status":row[0], "attempts":row[1], "result":row[2]}
+    return Response(yaml.safe_dump(body), mimetype="application/x-yaml")
 
 @app.route("/notify", methods=["POST"])
 def notify_sender():
@@ -399,5 +569,7 @@ def notify_sender():
     return Response(r.content, mimetype="application/x-yaml", status=r.status_code)
 
 if __name__ == "__main__":
+    for _ in range(INTAKE_DISPATCHERS):
+        threading.Thread(target=dispatcher, daemon=True).start()
     app.run(host="0.0.0.0", port=5001)
 
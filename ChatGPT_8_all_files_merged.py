@@ -1,9 +1,10 @@
 # car_ms.py
 from flask import Flask, request
-from common import parse_yaml_request, yaml_response, HOSTS, yaml_request
+from common import parse_yaml_request, yaml_response, HOSTS, yaml_request, install_admission, run_service
 import uuid
 
 app = Flask("Car_MS")
+install_admission(app, "Car_MS")
 
 # naive car registry for demo
 CAR_REGISTRY = {"CAR-ABC": {"status":"idle"}, "CAR-123": {"status":"idle"}}
@@ -51,24 +52,275 @@ def request_update():
         return yaml_response({"status":"error", "error": str(e)}, status=500)
 
 if __name__ == "__main__":
-    app.run(port=5006)
+    run_service(app, "Car_MS", 5006)
 
 # common.py
 import yaml
 import requests
+import socket
+import urllib3
+from requests.adapters import HTTPAdapter
 from flask import request, Response
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, quote, unquote
+
+TIMEOUT = 5  # seconds for service-to-service calls (upper bound once timeouts adapt)
+MIN_TIMEOUT = 0.5
+TIMEOUT_PERCENTILE = 0.99
+TIMEOUT_MULTIPLIER = 2.0   # timeout = observed p99 x multiplier, within [MIN_TIMEOUT, TIMEOUT]
+LATENCY_WINDOW = 200       # recent successful calls kept per target
+LATENCY_MIN_SAMPLES = 20   # use TIMEOUT until this many samples are seen
+BREAKER_FAILURES = 5       # consecutive failures that open a target's circuit
+BREAKER_COOLDOWN = 10.0    # seconds a circuit stays open before one trial call
+
+class CircuitOpenError(Exception):
+    """Raised without calling the target while its circuit is open."""
+
+class Overloaded(Exception):
+    """A downstream service shed the request (429/503); carries its Retry-After."""
+    def __init__(self, url, retry_after):
+        super().__init__(f"{url} overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+def retry_after_seconds(value):
+    """Whole seconds from a Retry-After header: delta-seconds or an HTTP-date"""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return 1
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0, int(when.timestamp() - time.time() + 0.999))
+
+class LatencyTracker:
+    """
+    Rolling window of one target's recent call latencies, used to derive a
+    timeout that follows the target's observed tail instead of a constant.
+    """
+    def __init__(self):
+        self.samples = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q):
+        with self.lock:
+            if len(self.samples) < LATENCY_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def timeout(self):
+        p = self.percentile(TIMEOUT_PERCENTILE)
+        if p is None:
+            return TIMEOUT
+        return min(TIMEOUT, max(MIN_TIMEOUT, p * TIMEOUT_MULTIPLIER))
+
+class CircuitBreaker:
+    """
+    Closed -> open after BREAKER_FAILURES consecutive failures; open rejects
+    calls for BREAKER_COOLDOWN seconds, then lets a single trial call through
+    (half-open). The trial's outcome closes or re-opens the circuit.
+    """
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+                self.state = "half_open"
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= BREAKER_FAILURES:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+class Target:
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+
+_targets = {}
+_targets_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=16)
+
+def target_for(url):
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    with _targets_lock:
+        if key not in _targets:
+            _targets[key] = Target()
+        return _targets[key]
+
+def circuit_open(url):
+    """True if calls to this URL's service would currently fail fast"""
+    breaker = target_for(url).breaker
+    return breaker.state == "open" and time.monotonic() - breaker.opened_at < BREAKER_COOLDOWN
+
+def resilience_stats():
+    with _targets_lock:
+        targets = dict(_targets)
+    return {
+        key: {
+            "state": t.breaker.state,
+            "consecutive_failures": t.breaker.failures,
+            "timeout": round(t.latency.timeout(), 3),
+            "p50": t.latency.percentile(0.5),
+            "p99": t.latency.percentile(0.99),
+        }
+        for key, t in targets.items()
+    }
+
+# Same-host peers can be reached over a Unix domain socket instead of
+# loopback TCP: give the service a "unix:///path/to/service.sock" address in
+# HOSTS. Internally that becomes an http+unix:// URL whose host part is the
+# percent-encoded socket path.
+def service_url(address):
+    if address.startswith("unix://"):
+        return "http+unix://" + quote(address[len("unix://"):], safe="")
+    return address
+
+def socket_path(url):
+    """The socket path of an http+unix:// URL, else None"""
+    if not url.startswith("http+unix://"):
+        return None
+    return unquote(urlsplit(url).netloc)
+
+class _UnixConnection(urllib3.connection.HTTPConnection):
+    def __init__(self, *args, socket_path=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+class _UnixConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _UnixConnection
+
+class UnixSocketAdapter(HTTPAdapter):
+    """requests adapter for http+unix:// URLs, one keep-alive pool per socket"""
+    def __init__(self, pool_maxsize=32):
+        super().__init__()
+        self.pool_maxsize = pool_maxsize
+        self.pools = {}
+        self.pools_lock = threading.Lock()
+
+    def _pool(self, url):
+        path = socket_path(url)
+        with self.pools_lock:
+            if path not in self.pools:
+                self.pools[path] = _UnixConnectionPool("localhost", maxsize=self.pool_maxsize, socket_path=path)
+            return self.pools[path]
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool(request.url)
+
+    def get_connection(self, url, proxies=None):
+        return self._pool(url)
+
+    def close(self):
+        super().close()
+        with self.pools_lock:
+            for pool in self.pools.values():
+                pool.close()
+            self.pools.clear()
+
+# One pooled session for all service calls: connections are kept alive
+# between hops over both TCP and Unix sockets
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_maxsize=32))
+_session.mount("http+unix://", UnixSocketAdapter())
+
+def _post(url, data, headers, timeout):
+    resp = _session.post(url, data=data, headers=headers, timeout=timeout)
+    resp.raise_for_status()
+    return resp
 
-TIMEOUT = 5  # seconds for service-to-service calls
-
-def yaml_request(url, payload):
+def yaml_request(url, payload, hedge=False):
     """
     Send YAML payload and return parsed YAML or raise.
+
+    The timeout adapts to the target's observed latency, and calls to a
+    target whose circuit is open raise CircuitOpenError immediately.
+    hedge=True (idempotent reads only) sends a second copy of the request
+    if the first is slower than the target's p95 and uses whichever
+    answers first.
     """
+    target = target_for(url)
+    if not target.breaker.allow():
+        raise CircuitOpenError(f"circuit open for {url}")
     headers = {"Content-Type": "application/x-yaml", "Accept": "application/x-yaml"}
-    data = yaml.safe_dump(payload)
-    resp = requests.post(url, data=data.encode("utf-8"), headers=headers, timeout=TIMEOUT)
-    resp.raise_for_status()
+    data = yaml.safe_dump(payload).encode("utf-8")
+    timeout = target.latency.timeout()
+    started = time.monotonic()
+    try:
+        hedge_after = target.latency.percentile(0.95) if hedge else None
+        if hedge_after is None:
+            resp = _post(url, data, headers, timeout)
+        else:
+            first = _hedge_pool.submit(_post, url, data, headers, timeout)
+            done, _ = wait([first], timeout=hedge_after)
+            if done:
+                resp = first.result()
+            else:
+                second = _hedge_pool.submit(_post, url, data, headers, timeout)
+                pending = {first, second}
+                resp = None
+                while pending and resp is None:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        if f.exception() is None:
+                            resp = f.result()
+                            break
+                if resp is None:
+                    first.result()  # both failed: re-raise the first error
+    except requests.HTTPError as e:
+        # the target answered; only server errors count against it, and a
+        # deliberate load-shedding reply is backpressure rather than a fault
+        status = e.response.status_code if e.response is not None else 500
+        shed = status in (429, 503) and "Retry-After" in e.response.headers
+        if status >= 500 and not shed:
+            target.breaker.failure()
+        else:
+            target.breaker.success()
+        if shed:
+            raise Overloaded(url, retry_after_seconds(e.response.headers["Retry-After"])) from e
+        raise
+    except Exception:
+        target.breaker.failure()
+        raise
+    target.latency.record(time.monotonic() - started)
+    target.breaker.success()
     if resp.content:
         return yaml.safe_load(resp.content)
     return None
@@ -88,8 +340,139 @@ def yaml_response(obj, status=200):
     data = yaml.safe_dump(obj or {})
     return Response(data, status=status, mimetype="application/x-yaml")
 
-# Host configuration (change when deploying on different machines)
-HOSTS = {
+# Admission control: each service bounds the requests it works on at once.
+# The limit adapts (AIMD): +1 per limit's worth of requests completed within
+# the latency target, x0.9 when a request is slow or fails. Requests over
+# the limit wait in a bounded queue; a full queue answers 429 and a queue
+# wait that times out answers 503, both with Retry-After.
+ADMISSION_INITIAL_LIMIT = int(os.environ.get("ADMISSION_INITIAL_LIMIT", "16"))
+ADMISSION_MIN_LIMIT = int(os.environ.get("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = int(os.environ.get("ADMISSION_MAX_LIMIT", "128"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "1.0"))
+ADMISSION_LATENCY_TOLERANCE = 2.0   # slow = over 2x the best recent latency
+ADMISSION_LATENCY_FLOOR = 0.05      # ...but never below 50 ms
+ADMISSION_EXEMPT = {"/admission_stats", "/resilience_stats"}
+
+class AdmissionController:
+    def __init__(self, name):
+        self.name = name
+        self.limit = float(ADMISSION_INITIAL_LIMIT)
+        self.inflight = 0
+        self.waiting = 0
+        self.best_latency = None
+        self.avg_latency = ADMISSION_LATENCY_FLOOR
+        self.rejected = 0
+        self.timed_out = 0
+        self.cond = threading.Condition()
+
+    def retry_after(self):
+        # time for the current backlog to clear at the current limit, in whole seconds
+        backlog = self.inflight + self.waiting
+        return max(1, int(backlog / max(self.limit, 1) * self.avg_latency + 0.999))
+
+    def acquire(self):
+        """Return None if admitted, else (status, retry_after)"""
+        with self.cond:
+            if self.inflight < int(self.limit):
+                self.inflight += 1
+                return None
+            if self.waiting >= ADMISSION_MAX_QUEUE:
+                self.rejected += 1
+                return 429, self.retry_after()
+            self.waiting += 1
+            deadline = time.monotonic() + ADMISSION_QUEUE_TIMEOUT
+            try:
+                while self.inflight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        return 503, self.retry_after()
+                    self.cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.inflight += 1
+            return None
+
+    def release(self, latency, failed):
+        with self.cond:
+            self.inflight -= 1
+            self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+            if self.best_latency is None or latency < self.best_latency:
+                self.best_latency = latency
+            else:
+                # let the baseline drift up so one lucky fast call does not pin it
+                self.best_latency += (latency - self.best_latency) * 0.01
+            slow = latency > max(ADMISSION_LATENCY_FLOOR, self.best_latency * ADMISSION_LATENCY_TOLERANCE)
+            if failed or slow:
+                self.limit = max(ADMISSION_MIN_LIMIT, self.limit * 0.9)
+            else:
+                self.limit = min(ADMISSION_MAX_LIMIT, self.limit + 1.0 / self.limit)
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "service": self.name,
+                "limit": round(self.limit, 2),
+                "inflight": self.inflight,
+                "waiting": self.waiting,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "avg_latency": round(self.avg_latency, 4),
+            }
+
+def overloaded_response(status, retry_after):
+    resp = yaml_response({"status":"overloaded", "retry_after": retry_after}, status=status)
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+def install_admission(app, name):
+    """
+    Put an AdmissionController in front of every route of app. An
+    Overloaded error from a downstream call is answered with 503 and the
+    downstream Retry-After, so backpressure reaches the original caller.
+    """
+    from flask import g
+    admission = AdmissionController(name)
+
+    @app.before_request
+    def _admit():
+        if request.path in ADMISSION_EXEMPT:
+            return None
+        verdict = admission.acquire()
+        if verdict is not None:
+            return overloaded_response(*verdict)
+        g.admitted_at = time.monotonic()
+        g.admission_failed = False
+        return None
+
+    @app.after_request
+    def _mark(resp):
+        if resp.status_code >= 500:
+            g.admission_failed = True
+        return resp
+
+    @app.teardown_request
+    def _release(exc):
+        started = g.pop("admitted_at", None)
+        if started is not None:
+            admission.release(time.monotonic() - started, exc is not None or g.pop("admission_failed", False))
+
+    @app.errorhandler(Overloaded)
+    def _overloaded(e):
+        return overloaded_response(503, e.retry_after)
+
+    @app.route("/admission_stats", methods=["GET"])
+    def admission_stats():
+        return yaml_response({"status":"ok", **admission.stats()})
+
+    return admission
+
+# Host configuration (change when deploying on different machines).
+# Server_1 services may use "unix:///run/delivery/<name>.sock" for peers on
+# the same host; laptop services (Sender_MS, Car_MS) stay on http://
+HOSTS = {name: service_url(address) for name, address in {
     "Sender_MS": os.environ.get("SENDER_HOST", "http://localhost:5001"),
     "UI_MS": os.environ.get("UI_HOST", "http://localhost:5002"),
     "IDGen_MS": os.environ.get("IDGEN_HOST", "http://localhost:5003"),
@@ -97,14 +480,43 @@ HOSTS = {
     "Storage_MS": os.environ.get("STORAGE_HOST", "http://localhost:5005"),
     "Car_MS": os.environ.get("CAR_HOST", "http://localhost:5006"),
     "Log_MS": os.environ.get("LOG_HOST", "http://localhost:5007"),
-}
+}.items()}
+
+def run_service(app, name, port):
+    """
+    Serve app on its TCP port (for peers on other machines) and, when HOSTS
+    gives it a Unix socket, on that socket too for same-host peers.
+    """
+    path = socket_path(HOSTS.get(name, ""))
+    if path:
+        from werkzeug.serving import make_server
+        if os.path.exists(path):
+            os.unlink(path)
+        server = make_server(f"unix://{path}", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.run(port=port)
 
 # controller_ms.py
 from flask import Flask, request
-from common import parse_yaml_request, yaml_response, HOSTS, yaml_request
+from common import parse_yaml_request, yaml_response, HOSTS, yaml_request, circuit_open, resilience_stats, install_admission, Overloaded, run_service
 import uuid
+import threading
+import time
+from collections import deque
 
 app = Flask("Controller_MS")
+install_admission(app, "Controller_MS")
+
+# Assignments that could not reach Car_MS are parked here and retried in the
+# background, so a slow or unreachable car laptop does not hold request threads.
+# Each item records the next stage to run, so a retry resumes where it failed
+# instead of storing the delivery again. The queue is kept in memory only:
+# work answered with 202 "deferred" is lost if Controller_MS restarts first.
+DEFERRED_MAX = 10000
+DEFERRED_RETRY_INTERVAL = 2.0
+deferred = deque()
+deferred_lock = threading.Lock()
+deferred_dropped = 0  # items refused because the queue was full
 
 # Helpers to log via Log_MS
 def log(message, source="Controller_MS"):
@@ -132,44 +544,123 @@ def request_delivery():
     # log
     log(f"Generated parcel_id {parcel_id}")
 
-    # 2) get car id
+    # 2) get car id; if Car_MS is failing, park the assignment and answer right away
     car_url = f"{HOSTS['Car_MS']}/check_car"
-    car_resp = yaml_request(car_url, {})
-    car_id = car_resp.get("car_id")
-
-    log(f"Assigned car_id {car_id}")
-
-    # Store both via Storage_MS
-    storage_store_id = f"{HOSTS['Storage_MS']}/store_id"
-    yaml_request(storage_store_id, {"id_key": f"parcel:{parcel_id}", "id_value": parcel_id})
-    yaml_request(storage_store_id, {"id_key": f"car:{car_id}", "id_value": car_id})
-
-    # Confirm retrieval from Storage
-    # (not strictly necessary, but following your flow)
-    parcel_from_storage = yaml_request(f"{HOSTS['Storage_MS']}/get_id", {"id_key": f"parcel:{parcel_id}"})
-    car_from_storage = yaml_request(f"{HOSTS['Storage_MS']}/get_id", {"id_key": f"car:{car_id}"})
-
-    # Assign delivery
-    delivery_id = "D-" + uuid.uuid4().hex[:10]
-    # store delivery
-    yaml_request(f"{HOSTS['Storage_MS']}/store_delivery", {
-        "delivery_id": delivery_id,
-        "parcel_id": parcel_id,
-        "car_id": car_id,
-        "metadata": {"sender": sender}
-    })
+    try:
+        if circuit_open(car_url):
+            raise RuntimeError("Car_MS circuit open")
+        # not hedged: check_car may register a new car
+        car_resp = yaml_request(car_url, {})
+    except Overloaded:
+        # Car_MS is up but shedding load: pass the backpressure on instead of queueing more
+        raise
+    except Exception as e:
+        if not defer({"stage": "assign", "parcel_id": parcel_id, "sender": sender}):
+            return yaml_response({"status":"error", "error":"Car_MS unavailable and deferred queue full"}, status=503)
+        log(f"Car_MS unavailable ({e}); deferred assignment of parcel {parcel_id}")
+        return yaml_response({"status":"deferred", "parcel_id": parcel_id}, status=202)
 
-    log(f"Created delivery {delivery_id} for parcel {parcel_id} with car {car_id}")
+    item = {"stage": "store", "parcel_id": parcel_id, "car_id": car_resp.get("car_id"), "sender": sender}
+    delivery_id = complete_assignment(item)
+    return yaml_response({"status":"ok", "delivery_id": delivery_id, "parcel_id": parcel_id, "car_id": car_resp.get("car_id")})
 
-    # Notify Car_MS
-    yaml_request(f"{HOSTS['Car_MS']}/notify_assignment", {"delivery_id": delivery_id, "car_id": car_id})
-    log(f"Notified car {car_id} of delivery {delivery_id}")
+def complete_assignment(item):
+    """
+    Run the stages after a car was found. item["stage"] moves on as each
+    one succeeds, so after an error the same item resumes where it stopped.
+    """
+    parcel_id, car_id, sender = item["parcel_id"], item["car_id"], item.get("sender")
+    if item["stage"] == "store":
+        log(f"Assigned car_id {car_id}")
+
+        # Store both via Storage_MS
+        storage_store_id = f"{HOSTS['Storage_MS']}/store_id"
+        yaml_request(storage_store_id, {"id_key": f"parcel:{parcel_id}", "id_value": parcel_id})
+        yaml_request(storage_store_id, {"id_key": f"car:{car_id}", "id_value": car_id})
+
+        # Confirm retrieval from Storage
+        # (not strictly necessary, but following your flow)
+        parcel_from_storage = yaml_request(f"{HOSTS['Storage_MS']}/get_id", {"id_key": f"parcel:{parcel_id}"}, hedge=True)
+        car_from_storage = yaml_request(f"{HOSTS['Storage_MS']}/get_id", {"id_key": f"car:{car_id}"}, hedge=True)
+
+        # Assign delivery; the id is kept so a retried store replaces the same row
+        item.setdefault("delivery_id", "D-" + uuid.uuid4().hex[:10])
+        yaml_request(f"{HOSTS['Storage_MS']}/store_delivery", {
+            "delivery_id": item["delivery_id"],
+            "parcel_id": parcel_id,
+            "car_id": car_id,
+            "metadata": {"sender": sender}
+        })
+
+        log(f"Created delivery {item['delivery_id']} for parcel {parcel_id} with car {car_id}")
+
+        # Notify Car_MS (parked for retry if the car laptop is unreachable)
+        try:
+            yaml_request(f"{HOSTS['Car_MS']}/notify_assignment", {"delivery_id": item["delivery_id"], "car_id": car_id})
+            log(f"Notified car {car_id} of delivery {item['delivery_id']}")
+        except Exception as e:
+            if defer({"stage": "notify", "delivery_id": item["delivery_id"], "car_id": car_id}):
+                log(f"Deferred notifying car {car_id} of delivery {item['delivery_id']}: {e}")
+        item["stage"] = "notify_ui"
 
     # Notify UI -> UI will notify Sender
+    delivery_id = item["delivery_id"]
     yaml_request(f"{HOSTS['UI_MS']}/notify_sender", {"delivery_id": delivery_id, "parcel_id": parcel_id, "car_id": car_id, "sender": sender})
     log(f"Notified UI about delivery {delivery_id}")
-
-    return yaml_response({"status":"ok", "delivery_id": delivery_id, "parcel_id": parcel_id, "car_id": car_id})
+    item["stage"] = "done"
+    return delivery_id
+
+def defer(item, front=False):
+    """Park item for drain_deferred; False (counted and logged) if the queue is full"""
+    global deferred_dropped
+    with deferred_lock:
+        if len(deferred) < DEFERRED_MAX:
+            if front:
+                deferred.appendleft(item)
+            else:
+                deferred.append(item)
+            return True
+        deferred_dropped += 1
+    log(f"Deferred queue full; dropped {item['stage']} stage for {item.get('delivery_id') or item.get('parcel_id')}")
+    return False
+
+def drain_deferred():
+    # Retries parked work once Car_MS's circuit lets calls through again
+    while True:
+        time.sleep(DEFERRED_RETRY_INTERVAL)
+        if circuit_open(f"{HOSTS['Car_MS']}/check_car"):
+            continue
+        with deferred_lock:
+            batch = list(deferred)
+            deferred.clear()
+        for i, item in enumerate(batch):
+            try:
+                if item["stage"] == "notify":
+                    yaml_request(f"{HOSTS['Car_MS']}/notify_assignment", {"delivery_id": item["delivery_id"], "car_id": item["car_id"]})
+                    continue
+                if item["stage"] == "assign":
+                    car_resp = yaml_request(f"{HOSTS['Car_MS']}/check_car", {})
+                    item.update(stage="store", car_id=car_resp.get("car_id"))
+                delivery_id = complete_assignment(item)
+                log(f"Completed deferred assignment {delivery_id} for parcel {item['parcel_id']}")
+            except Exception as e:
+                if item["stage"] in ("assign", "notify"):
+                    # Car_MS failing again: put the rest back in order and wait;
+                    # new work may have filled the queue meanwhile, so this can drop items too
+                    for rest in reversed(batch[i:]):
+                        defer(rest, front=True)
+                    break
+                # Storage_MS or UI_MS failed: retry this item later from its stage
+                log(f"Deferred assignment of parcel {item['parcel_id']} stopped at {item['stage']}: {e}")
+                defer(item)
+
+threading.Thread(target=drain_deferred, daemon=True).start()
+
+@app.route("/resilience_stats", methods=["GET"])
+def resilience():
+    with deferred_lock:
+        pending, dropped = len(deferred), deferred_dropped
+    return yaml_response({"status":"ok", "targets": resilience_stats(), "deferred": pending, "deferred_dropped": dropped})
 
 @app.route("/car_request_update", methods=["POST"])
 def car_request_update():
@@ -187,7 +678,7 @@ def car_request_update():
     return yaml_response({"status":"ok", "ack": True})
 
 if __name__ == "__main__":
-    app.run(port=5004)
+    run_service(app, "Controller_MS", 5004)
 
 # db_init.py
 import sqlite3
@@ -237,10 +728,11 @@ if __name__ == "__main__":
 
 # idgen_ms.py
 from flask import Flask, request
-from common import parse_yaml_request, yaml_response, HOSTS, yaml_request
+from common import parse_yaml_request, yaml_response, HOSTS, yaml_request, install_admission, run_service
 import uuid
 
 app = Flask("IDGen_MS")
+install_admission(app, "IDGen_MS")
 
 @app.route("/generate", methods=["POST"])
 def generate():
@@ -258,14 +750,15 @@ def generate():
     return yaml_response({"status": "ok", "parcel_id": parcel_id})
 
 if __name__ == "__main__":
-    app.run(port=5003)
+    run_service(app, "IDGen_MS", 5003)
 
 # log_ms.py
 from flask import Flask, request
-from common import parse_yaml_request, yaml_response
+from common import parse_yaml_request, yaml_response, install_admission, run_service
 import sqlite3
 
 app = Flask("Log_MS")
+install_admission(app, "Log_MS")
 
 DB = 'db_logs.sqlite'  # Database_3
 
@@ -285,13 +778,14 @@ def log():
     return yaml_response({"status": "ok", "stored": True})
 
 if __name__ == "__main__":
-    app.run(port=5007)
+    run_service(app, "Log_MS", 5007)
 
 # sender_ms.py
 from flask import Flask, request
-from common import parse_yaml_request, yaml_response, HOSTS, yaml_request
+from common import parse_yaml_request, yaml_response, HOSTS, yaml_request, install_admission, Overloaded, overloaded_response, run_service
 
 app = Flask("Sender_MS")
+install_admission(app, "Sender_MS")
 
 @app.route("/start_request", methods=["POST"])
 def start_request():
@@ -303,6 +797,8 @@ def start_request():
     try:
         res = yaml_request(ui_url, {"sender": data.get("sender", "unknown"), "items": data.get("items", [])})
         return yaml_response({"status":"ok", "ui_response": res})
+    except Overloaded as e:
+        return overloaded_response(503, e.retry_after)
     except Exception as e:
         return yaml_response({"status":"error", "error": str(e)}, status=500)
 
@@ -313,15 +809,16 @@ def notify():
     return yaml_response({"status":"ok", "received": True, "details": data})
 
 if __name__ == "__main__":
-    app.run(port=5001)
+    run_service(app, "Sender_MS", 5001)
 
 # storage_ms.py
 from flask import Flask, request
-from common import parse_yaml_request, yaml_response
+from common import parse_yaml_request, yaml_response, install_admission, run_service
 import sqlite3
 import json
 
 app = Flask("Storage_MS")
+install_admission(app, "Storage_MS")
 DB_ASSIGN = 'db_assignments.sqlite'  # Database_2
 DB_PARCELS = 'db_parcels.sqlite'     # Database_1
 
@@ -405,13 +902,14 @@ def update_delivery_endpoint():
     return yaml_response({"status": "ok", "updated": True})
 
 if __name__ == "__main__":
-    app.run(port=5005)
+    run_service(app, "Storage_MS", 5005)
 
 # ui_ms.py
 from flask import Flask, request
-from common import parse_yaml_request, yaml_response, HOSTS, yaml_request
+from common import parse_yaml_request, yaml_response, HOSTS, yaml_request, install_admission, Overloaded, overloaded_response, run_service
 
 app = Flask("UI_MS")
+install_admission(app, "UI_MS")
 
 @app.route("/request_delivery_from_sender", methods=["POST"])
 def request_delivery_from_sender():
@@ -421,6 +919,8 @@ def request_delivery_from_sender():
     try:
         resp = yaml_request(controller_url, data)
         return yaml_response({"status":"ok", "controller_response": resp})
+    except Overloaded as e:
+        return overloaded_response(503, e.retry_after)
     except Exception as e:
         return yaml_response({"status":"error", "error": str(e)}, status=500)
 
@@ -448,5 +948,67 @@ def notify_update():
     return yaml_response({"status":"ok"})
 
 if __name__ == "__main__":
-    app.run(port=5002)
+    run_service(app, "UI_MS", 5002)
 
+
+# bench_transport.py
+"""
+Latency and CPU cost of one service hop over loopback TCP vs a Unix socket.
+Client and server run in this process, so CPU per call covers both ends.
+Usage: python bench_transport.py [calls]
+"""
+import os, sys, tempfile, threading, time
+from flask import Flask, request
+from werkzeug.serving import make_server
+from common import parse_yaml_request, yaml_response, yaml_request, service_url
+
+def echo_app():
+    app = Flask("Bench_MS")
+
+    @app.route("/echo", methods=["POST"])
+    def echo():
+        return yaml_response(parse_yaml_request(request))
+    return app
+
+def serve(app, host, port=0):
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def measure(base_url, calls, payload):
+    for _ in range(50):  # warm up connections and caches
+        yaml_request(f"{base_url}/echo", payload)
+    latencies = []
+    cpu = time.process_time()
+    for _ in range(calls):
+        started = time.perf_counter()
+        yaml_request(f"{base_url}/echo", payload)
+        latencies.append(time.perf_counter() - started)
+    cpu = time.process_time() - cpu
+    latencies.sort()
+    return {
+        "mean_us": round(sum(latencies) / calls * 1e6, 1),
+        "p50_us": round(latencies[calls // 2] * 1e6, 1),
+        "p99_us": round(latencies[int(calls * 0.99)] * 1e6, 1),
+        "cpu_us_per_call": round(cpu / calls * 1e6, 1),
+    }
+
+def main(calls=2000):
+    payload = {"delivery_id": "D-0123456789", "parcel_id": "P-0123456789ab", "car_id": "CAR-1", "status": "assigned"}
+    app = echo_app()
+    tcp = serve(app, "127.0.0.1", 0)
+    path = os.path.join(tempfile.mkdtemp(), "bench.sock")
+    serve(app, f"unix://{path}")
+    results = {
+        "tcp": measure(f"http://127.0.0.1:{tcp.server_port}", calls, payload),
+        "unix": measure(service_url(f"unix://{path}"), calls, payload),
+    }
+    for name, stats in results.items():
+        print(f"{name:5} {stats}")
+    saving = 1 - results["unix"]["mean_us"] / results["tcp"]["mean_us"]
+    cpu_saving = 1 - results["unix"]["cpu_us_per_call"] / results["tcp"]["cpu_us_per_call"]
+    print(f"unix socket: {saving:.1%} lower latency, {cpu_saving:.1%} less CPU per hop")
+    return results
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -183,9 +183,62 @@ from flask import Flask, request, Response
 import yaml
 import sqlite3
 import json
+import threading
+import time
+from collections import OrderedDict
 
 app = Flask(__name__)
 
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL = 30  # seconds
+
+class LatestKeyCache:
+    """
+    Latest key_value per key_type from Database_2, kept for ttl seconds.
+    store_id invalidates its key_type before acknowledging, and a load that
+    raced with such a write is not kept, so readers never see a value older
+    than the last acknowledged write.
+    """
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries  # key_type comes from the URL, so bound it
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key_type -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key_type, loader, bypass=False):
+        with self._lock:
+            entry = None if bypass else self._entries.get(key_type)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self._entries.pop(key_type, None)
+                self._entries[key_type] = (time.monotonic() + self.ttl, value)
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key_type):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key_type, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "ttl": self.ttl, "hits": self.hits,
+                    "misses": self.misses, "invalidations": self.invalidations}
+
+key_cache = LatestKeyCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+
 def store_assignment(key_type, key_value):
     conn = sqlite3.connect('database_2.db')
     c = conn.cursor()
@@ -217,6 +270,7 @@ def store_id():
     if not key_type or not key_value:
         return Response(yaml.safe_dump({'status':'error','reason':'missing type or value'}), mimetype='text/yaml', status=400)
     store_assignment(key_type, key_value)
+    key_cache.invalidate(key_type)
     return Response(yaml.safe_dump({'status':'ok','ack':True}), mimetype='text/yaml')
 
 @app.route('/store_delivery', methods=['POST'])
@@ -232,10 +286,16 @@ def store_delivery_endpoint():
 
 @app.route('/get_id/<key_type>', methods=['GET'])
 def get_id(key_type):
-    val = get_latest_key(key_type)
+    # "Cache-Control: no-cache" or ?cache=bypass forces a read from Database_2
+    bypass = 'no-cache' in request.headers.get('Cache-Control', '') or request.args.get('cache') == 'bypass'
+    val = key_cache.get(key_type, lambda: get_latest_key(key_type), bypass=bypass)
     resp = {'status':'ok','type':key_type, 'value': val}
     return Response(yaml.safe_dump(resp), mimetype='text/yaml')
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return Response(yaml.safe_dump({'status':'ok','cache': key_cache.stats()}), mimetype='text/yaml')
+
 if __name__ == '__main__':
     app.run(port=5004, host='0.0.0.0')
 
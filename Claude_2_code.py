@@ -3,18 +3,24 @@
 # ============================================================================
 
 import yaml
+import os
 import socket
 import threading
 import sqlite3
 import uuid
 import time
+import heapq
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import json
 
 class YAMLMessage:
     """Handles YAML message serialization/deserialization"""
     
+    # Ends each document on a subscription stream, which carries many messages
+    DOCUMENT_END = b'...\n'
+    
     @staticmethod
     def serialize(data: Dict[str, Any]) -> bytes:
         """Convert dictionary to YAML bytes"""
@@ -26,29 +32,115 @@ class YAMLMessage:
         """Convert YAML bytes to dictionary"""
         yaml_str = data.decode('utf-8')
         return yaml.safe_load(yaml_str)
+    
+    @staticmethod
+    def split_stream(buffer: bytes):
+        """Complete messages in a stream buffer, and the incomplete rest"""
+        *documents, rest = buffer.split(b'\n' + YAMLMessage.DOCUMENT_END)
+        return [YAMLMessage.deserialize(d + b'\n') for d in documents], rest
+
+class AdaptiveLimit:
+    """
+    Concurrency limit that adapts by AIMD: +1 for each limit's worth of
+    requests finished within 2x the best recent latency, x0.9 when one is
+    slow or fails
+    """
+    
+    LATENCY_TOLERANCE = 2.0
+    LATENCY_FLOOR = 0.05  # never call a request under 50 ms slow
+    
+    def __init__(self, initial: int = 16, minimum: int = 2, maximum: int = 128):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.inflight = 0
+        self.best_latency = None
+        self.avg_latency = self.LATENCY_FLOOR
+        self.lock = threading.Lock()
+        
+    def try_acquire(self) -> bool:
+        with self.lock:
+            if self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            return True
+        
+    def release(self, latency: float, failed: bool):
+        with self.lock:
+            self.inflight -= 1
+            self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+            if self.best_latency is None or latency < self.best_latency:
+                self.best_latency = latency
+            else:
+                # let the baseline drift up so one lucky fast call does not pin it
+                self.best_latency += (latency - self.best_latency) * 0.01
+            slow = latency > max(self.LATENCY_FLOOR, self.best_latency * self.LATENCY_TOLERANCE)
+            if failed or slow:
+                self.limit = max(self.minimum, self.limit * 0.9)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                
+    def cancel(self):
+        """Give back a slot without feeding the request's latency into the limit"""
+        with self.lock:
+            self.inflight -= 1
+    
+    def retry_after(self) -> int:
+        """Whole seconds for the current requests to clear at the current limit"""
+        with self.lock:
+            return max(1, int(self.inflight / max(self.limit, 1) * self.avg_latency + 0.999))
 
 class MicroserviceBase:
     """Base class for all microservices"""
     
-    def __init__(self, name: str, host: str, port: int):
+    # Requests handled at once adapt between these bounds; connections beyond
+    # the current limit are answered with 'overloaded' straight from the
+    # accept loop instead of spawning a thread
+    INITIAL_CONCURRENT_REQUESTS = 16
+    MIN_CONCURRENT_REQUESTS = 2
+    MAX_CONCURRENT_REQUESTS = 128
+    REJECT_READ_TIMEOUT = 0.2  # seconds the accept loop waits for a rejected request
+    
+    def __init__(self, name: str, host: str, port: int, socket_path: Optional[str] = None):
         self.name = name
         self.host = host
         self.port = port
+        # Same-host peers can reach us on this Unix socket instead of loopback TCP
+        self.socket_path = socket_path
         self.server_socket = None
+        self.unix_socket = None
         self.running = False
+        self.admission = AdaptiveLimit(self.INITIAL_CONCURRENT_REQUESTS, self.MIN_CONCURRENT_REQUESTS,
+                                       self.MAX_CONCURRENT_REQUESTS)
+        self.rejected = 0
         
     def start(self):
         """Start the microservice server"""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(128)
         self.running = True
         print(f"[{self.name}] Started on {self.host}:{self.port}")
         
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.unix_socket.bind(self.socket_path)
+            self.unix_socket.listen(128)
+            threading.Thread(target=self.accept_loop, args=(self.unix_socket,), daemon=True).start()
+            print(f"[{self.name}] Also listening on unix:{self.socket_path}")
+        
+        self.accept_loop(self.server_socket)
+    
+    def accept_loop(self, server_socket: socket.socket):
         while self.running:
             try:
-                client_socket, address = self.server_socket.accept()
+                client_socket, address = server_socket.accept()
+                if not self.admission.try_acquire():
+                    self.reject_client(client_socket)
+                    continue
                 thread = threading.Thread(target=self.handle_client, args=(client_socket,))
                 thread.start()
             except Exception as e:
@@ -57,27 +149,86 @@ class MicroserviceBase:
     
     def handle_client(self, client_socket: socket.socket):
         """Handle incoming client connections"""
+        started = time.monotonic()
+        failed = False
+        long_lived = False
         try:
             data = client_socket.recv(4096)
             if data:
                 message = YAMLMessage.deserialize(data)
+                if self.is_long_lived(message):
+                    # Watchers stay connected far longer than any request; they
+                    # must neither hold a request slot nor count as slow requests
+                    long_lived = True
+                    self.admission.cancel()
+                    self.serve_long_lived(message, client_socket)
+                    return
                 response = self.process_message(message)
                 if response:
                     client_socket.send(YAMLMessage.serialize(response))
         except Exception as e:
+            failed = True
             print(f"[{self.name}] Error handling client: {e}")
         finally:
             client_socket.close()
+            if not long_lived:
+                self.admission.release(time.monotonic() - started, failed)
+    
+    def is_long_lived(self, message: Dict[str, Any]) -> bool:
+        """Override to keep the connection open for subscriptions and long polls"""
+        return False
+    
+    def serve_long_lived(self, message: Dict[str, Any], client_socket: socket.socket):
+        """Override to serve a message for which is_long_lived() is True"""
+        raise NotImplementedError
+    
+    def reject_client(self, client_socket: socket.socket):
+        """Answer a connection we have no capacity for without processing it"""
+        self.rejected += 1
+        try:
+            # Read the request first: closing with unread data sends an RST,
+            # and the client would see a reset instead of 'overloaded'
+            client_socket.settimeout(self.REJECT_READ_TIMEOUT)
+            client_socket.recv(4096)
+            client_socket.sendall(YAMLMessage.serialize(self.overloaded_response()))
+            client_socket.shutdown(socket.SHUT_WR)
+            while client_socket.recv(4096):
+                pass
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+    
+    def overloaded_response(self, retry_after: int = None) -> Dict[str, Any]:
+        return {
+            'status': 'overloaded',
+            'service': self.name,
+            'retry_after': retry_after or self.admission.retry_after()
+        }
+    
+    @staticmethod
+    def is_overloaded(response: Optional[Dict[str, Any]]) -> bool:
+        return bool(response) and response.get('status') == 'overloaded'
     
     def process_message(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Override this method to process messages"""
         raise NotImplementedError
     
-    def send_message(self, host: str, port: int, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Send message to another microservice"""
-        try:
+    @staticmethod
+    def connect(host: str, port: int) -> socket.socket:
+        """Open a connection to another microservice ("unix:/path" hosts use a Unix socket)"""
+        if host.startswith('unix:'):
+            client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client_socket.connect(host[len('unix:'):])
+        else:
             client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             client_socket.connect((host, port))
+        return client_socket
+    
+    def send_message(self, host: str, port: int, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Send message to another microservice ("unix:/path" hosts use a Unix socket)"""
+        try:
+            client_socket = self.connect(host, port)
             client_socket.send(YAMLMessage.serialize(message))
             
             response_data = client_socket.recv(4096)
@@ -95,6 +246,8 @@ class MicroserviceBase:
         self.running = False
         if self.server_socket:
             self.server_socket.close()
+        if self.unix_socket:
+            self.unix_socket.close()
 
 
 # ============================================================================
@@ -104,10 +257,16 @@ class MicroserviceBase:
 class SenderMS(MicroserviceBase):
     """External microservice for requesting deliveries"""
     
+    RECONNECT_DELAY = 2.0
+    
     def __init__(self):
         super().__init__("Sender_MS", "0.0.0.0", 5001)
         self.ui_ms_host = "192.168.1.100"  # Server_1 IP
         self.ui_ms_port = 5002
+        # UI_MS pushes this sender's updates to its subscription, keyed by this id
+        self.sender_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.last_event_id = 0
+        self.watching = False
     
     def request_delivery(self, sender_name: str, recipient_name: str, 
                         pickup_address: str, delivery_address: str, parcel_weight: float):
@@ -119,6 +278,7 @@ class SenderMS(MicroserviceBase):
             'pickup_address': pickup_address,
             'delivery_address': delivery_address,
             'parcel_weight': parcel_weight,
+            'sender_id': self.sender_id,
             'timestamp': datetime.now().isoformat()
         }
         
@@ -128,6 +288,9 @@ class SenderMS(MicroserviceBase):
         if response and response.get('status') == 'success':
             print(f"[{self.name}] Delivery request accepted: {response.get('message')}")
             return response
+        elif self.is_overloaded(response):
+            print(f"[{self.name}] {response.get('service')} is overloaded, retry in {response.get('retry_after')}s")
+            return response
         else:
             print(f"[{self.name}] Delivery request failed")
             return None
@@ -148,64 +311,193 @@ class SenderMS(MicroserviceBase):
             return {'status': 'acknowledged'}
         
         return {'status': 'unknown_action'}
+    
+    def watch_updates(self):
+        """
+        Keep one subscription to UI_MS open for all of this sender's parcels,
+        reconnecting from the last event seen so nothing is missed
+        """
+        self.watching = True
+        while self.watching:
+            try:
+                client_socket = self.connect(self.ui_ms_host, self.ui_ms_port)
+                client_socket.settimeout(UI_MS.HEARTBEAT_INTERVAL * 3)
+                client_socket.send(YAMLMessage.serialize({
+                    'action': 'subscribe',
+                    'sender_id': self.sender_id,
+                    'after': self.last_event_id
+                }))
+                buffer = b''
+                while self.watching:
+                    data = client_socket.recv(4096)
+                    if not data:
+                        break
+                    events, buffer = YAMLMessage.split_stream(buffer + data)
+                    for event in events:
+                        if event.get('action') == 'heartbeat':
+                            continue
+                        self.last_event_id = event.get('event_id', self.last_event_id)
+                        self.process_message(event)
+                client_socket.close()
+            except Exception as e:
+                print(f"[{self.name}] Subscription to UI_MS lost: {e}")
+            if self.watching:
+                time.sleep(self.RECONNECT_DELAY)
 
 
 # ============================================================================
 # UI_MS (Internal - Ubuntu/Server_1)
 # ============================================================================
 
+class UpdateHub:
+    """
+    Recent updates per sender with blocking waits. Each sender has a bounded
+    replay buffer, so a watcher that reconnects with the last event id it saw
+    gets what it missed; a publish wakes only that sender's watchers.
+    """
+    
+    def __init__(self, buffer_size: int = 256):
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+        self.channels: Dict[str, Dict[str, Any]] = {}
+        # Event ids start from the clock so they keep growing across UI_MS restarts
+        self.next_event_id = int(time.time() * 1000)
+        
+    def channel(self, sender_id: str) -> Dict[str, Any]:
+        ch = self.channels.get(sender_id)
+        if ch is None:
+            ch = self.channels[sender_id] = {
+                'events': deque(maxlen=self.buffer_size),
+                'changed': threading.Condition(self.lock)
+            }
+        return ch
+    
+    def publish(self, sender_id: str, event: Dict[str, Any]):
+        with self.lock:
+            ch = self.channel(sender_id)
+            self.next_event_id += 1
+            ch['events'].append(dict(event, event_id=self.next_event_id))
+            ch['changed'].notify_all()
+            
+    def wait(self, sender_id: str, after: int, timeout: float,
+             tracking_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Events newer than after, waiting up to timeout for the first one"""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            ch = self.channel(sender_id)
+            while True:
+                events = [e for e in ch['events'] if e['event_id'] > after
+                          and (tracking_id is None or e.get('tracking_id') == tracking_id)]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                ch['changed'].wait(remaining)
+
+
 class UI_MS(MicroserviceBase):
     """User Interface microservice"""
     
+    HEARTBEAT_INTERVAL = 15.0  # idle subscriptions get a heartbeat this often
+    MAX_POLL_TIMEOUT = 30.0
+    MAX_POLL_EVENTS = 20  # per long-poll reply, which must fit the peer's single 4 KB recv
+    MAX_ROUTES = 100000  # tracking/parcel ids remembered for routing updates
+    
     def __init__(self):
         super().__init__("UI_MS", "0.0.0.0", 5002)
         self.controller_ms_host = "localhost"
         self.controller_ms_port = 5003
-        self.sender_ms_host = None  # Will be set from incoming requests
-        self.sender_ms_port = 5001
+        # Senders subscribe (or long-poll) for their updates instead of
+        # UI_MS connecting back to them per event
+        self.hub = UpdateHub()
+        self.routes = OrderedDict()  # tracking_id / parcel_id -> sender_id
+        self.routes_lock = threading.Lock()
+        
+    def add_route(self, key: str, sender_id: str):
+        with self.routes_lock:
+            self.routes[key] = sender_id
+            self.routes.move_to_end(key)
+            while len(self.routes) > self.MAX_ROUTES:
+                self.routes.popitem(last=False)
+    
+    def route(self, key: Optional[str]) -> Optional[str]:
+        with self.routes_lock:
+            return self.routes.get(key)
+    
+    def is_long_lived(self, message: Dict[str, Any]) -> bool:
+        return message.get('action') in ('subscribe', 'poll_updates')
+    
+    def serve_long_lived(self, message: Dict[str, Any], client_socket: socket.socket):
+        sender_id = message.get('sender_id')
+        after = message.get('after', 0)
+        tracking_id = message.get('tracking_id')
+        if not sender_id:
+            client_socket.send(YAMLMessage.serialize({'status': 'error', 'message': 'sender_id required'}))
+            return
+        
+        if message.get('action') == 'poll_updates':
+            # Long-poll fallback: one batch of events per request
+            timeout = min(float(message.get('timeout', self.MAX_POLL_TIMEOUT)), self.MAX_POLL_TIMEOUT)
+            events = self.hub.wait(sender_id, after, timeout, tracking_id)[:self.MAX_POLL_EVENTS]
+            client_socket.sendall(YAMLMessage.serialize({'status': 'success', 'events': events}))
+            return
+        
+        # Subscription: stream events as they are published until the sender hangs up
+        print(f"[{self.name}] Sender {sender_id} subscribed")
+        while self.running:
+            events = self.hub.wait(sender_id, after, self.HEARTBEAT_INTERVAL, tracking_id)
+            if not events:
+                events = [{'action': 'heartbeat'}]
+            for event in events:
+                after = event.get('event_id', after)
+                client_socket.sendall(YAMLMessage.serialize(event) + YAMLMessage.DOCUMENT_END)
     
     def process_message(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Process incoming messages"""
         action = message.get('action')
         
         if action == 'request_delivery':
-            # Store sender info for later notifications
             print(f"[{self.name}] Received delivery request")
+            # Remember which sender this is for; the Controller echoes the tracking id
+            tracking_id = str(uuid.uuid4())
+            sender_id = message.get('sender_id')
+            if sender_id:
+                self.add_route(tracking_id, sender_id)
             
             # Forward to Controller_MS
-            response = self.send_message(self.controller_ms_host, self.controller_ms_port, message)
+            response = self.send_message(self.controller_ms_host, self.controller_ms_port,
+                                         dict(message, tracking_id=tracking_id))
+            if response:
+                response = dict(response, tracking_id=tracking_id)
             return response
         
         elif action == 'notify_delivery_assigned':
-            # Notify Sender_MS
             parcel_id = message.get('parcel_id')
             car_id = message.get('car_id')
-            print(f"[{self.name}] Notifying sender about delivery assignment")
-            
-            notification = {
-                'action': 'delivery_assigned',
-                'parcel_id': parcel_id,
-                'car_id': car_id
-            }
-            
-            # In real implementation, track sender connection info
-            # For demo, assume sender_ms_host is known
-            if self.sender_ms_host:
-                sender_response = self.send_message(self.sender_ms_host, self.sender_ms_port, notification)
+            tracking_id = message.get('tracking_id')
+            sender_id = self.route(tracking_id)
+            if sender_id:
+                # Later updates only carry the parcel id
+                self.add_route(parcel_id, sender_id)
+                print(f"[{self.name}] Notifying sender about delivery assignment")
+                self.hub.publish(sender_id, {
+                    'action': 'delivery_assigned',
+                    'tracking_id': tracking_id,
+                    'parcel_id': parcel_id,
+                    'car_id': car_id
+                })
                 
             return {'status': 'acknowledged'}
         
         elif action == 'notify_delivery_update':
-            # Notify Sender_MS about delivery update
-            print(f"[{self.name}] Notifying sender about delivery update")
-            
-            notification = {
-                'action': 'delivery_update',
-                'delivery_status': message.get('delivery_status')
-            }
-            
-            if self.sender_ms_host:
-                sender_response = self.send_message(self.sender_ms_host, self.sender_ms_port, notification)
+            parcel_id = message.get('parcel_id')
+            sender_id = self.route(parcel_id)
+            if sender_id:
+                print(f"[{self.name}] Notifying sender about delivery update")
+                self.hub.publish(sender_id, {
+                    'action': 'delivery_update',
+                    'parcel_id': parcel_id,
+                    'delivery_status': message.get('delivery_status')
+                })
                 
             return {'status': 'acknowledged'}
         
@@ -307,6 +599,9 @@ class Controller_MS(MicroserviceBase):
         }
         idgen_response = self.send_message(self.idgen_ms_host, self.idgen_ms_port, idgen_request)
         
+        # Pass downstream backpressure back to UI_MS (and on to the sender) unchanged
+        if self.is_overloaded(idgen_response):
+            return idgen_response
         if not idgen_response or idgen_response.get('status') != 'success':
             self.log_event('delivery_request_failed', {'reason': 'ID generation failed'})
             return {'status': 'error', 'message': 'Failed to generate parcel ID'}
@@ -321,6 +616,8 @@ class Controller_MS(MicroserviceBase):
         }
         car_response = self.send_message(self.car_ms_host, self.car_ms_port, car_request)
         
+        if self.is_overloaded(car_response):
+            return car_response
         if not car_response or car_response.get('status') != 'success':
             self.log_event('car_assignment_failed', {'parcel_id': parcel_id})
             return {'status': 'error', 'message': 'Failed to assign car'}
@@ -375,7 +672,8 @@ class Controller_MS(MicroserviceBase):
         ui_notification = {
             'action': 'notify_delivery_assigned',
             'parcel_id': parcel_id,
-            'car_id': car_id
+            'car_id': car_id,
+            'tracking_id': message.get('tracking_id')
         }
         ui_resp = self.send_message(self.ui_ms_host, self.ui_ms_port, ui_notification)
         self.log_event('ui_notified', {'parcel_id': parcel_id})
@@ -618,12 +916,104 @@ class Log_MS(MicroserviceBase):
 # CAR_MS (External - Windows/Laptop_1)
 # ============================================================================
 
+class FleetRegistry:
+    """
+    Indexed registry of cars with status, capacity and current load.
+    
+    Available cars sit in a max-heap keyed by remaining capacity, so the
+    least loaded car is picked and reserve/release cost O(log n) without
+    scanning the fleet. Entries are invalidated lazily: every change bumps
+    the car's version and pushes a fresh entry, and stale entries are
+    skipped when they reach the top of the heap.
+    """
+    
+    def __init__(self):
+        self.cars = {}           # car_id -> {'status', 'capacity', 'load', 'version'}
+        self.assignments = {}    # parcel_id -> car_id
+        self.heap = []           # (-remaining, version, car_id)
+        self.lock = threading.Lock()
+    
+    def _push(self, car_id: str):
+        car = self.cars[car_id]
+        car['version'] += 1
+        remaining = car['capacity'] - car['load']
+        if car['status'] == 'available' and remaining > 0:
+            heapq.heappush(self.heap, (-remaining, car['version'], car_id))
+        # Rebuild once stale entries outnumber live ones to bound memory
+        if len(self.heap) > 2 * len(self.cars) + 64:
+            self.heap = [
+                (c['load'] - c['capacity'], c['version'], cid)
+                for cid, c in self.cars.items()
+                if c['status'] == 'available' and c['capacity'] > c['load']
+            ]
+            heapq.heapify(self.heap)
+    
+    def register_car(self, car_id: str, capacity: int = 1, status: str = 'available'):
+        """Add a car or update its capacity and status"""
+        with self.lock:
+            car = self.cars.setdefault(car_id, {'status': status, 'capacity': capacity, 'load': 0, 'version': 0})
+            car['status'] = status
+            car['capacity'] = capacity
+            self._push(car_id)
+    
+    def set_status(self, car_id: str, status: str) -> bool:
+        """Mark a car available or unavailable (e.g. 'offline', 'maintenance')"""
+        with self.lock:
+            if car_id not in self.cars:
+                return False
+            self.cars[car_id]['status'] = status
+            self._push(car_id)
+            return True
+    
+    def reserve(self, parcel_id: str) -> Optional[str]:
+        """Reserve a slot on the least loaded available car, or None if the fleet is full"""
+        with self.lock:
+            if parcel_id in self.assignments:
+                return self.assignments[parcel_id]
+            while self.heap:
+                _, version, car_id = heapq.heappop(self.heap)
+                car = self.cars[car_id]
+                if version != car['version']:
+                    continue
+                car['load'] += 1
+                self.assignments[parcel_id] = car_id
+                self._push(car_id)
+                return car_id
+            return None
+    
+    def release(self, parcel_id: str) -> Optional[str]:
+        """Free the slot held by a parcel, returning the car it was on"""
+        with self.lock:
+            car_id = self.assignments.pop(parcel_id, None)
+            if car_id is None:
+                return None
+            car = self.cars[car_id]
+            car['load'] = max(0, car['load'] - 1)
+            self._push(car_id)
+            return car_id
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Fleet totals for monitoring"""
+        with self.lock:
+            available = [c for c in self.cars.values() if c['status'] == 'available']
+            return {
+                'cars': len(self.cars),
+                'available_cars': len(available),
+                'free_slots': sum(c['capacity'] - c['load'] for c in available),
+                'assigned_parcels': len(self.assignments)
+            }
+
+
 class Car_MS(MicroserviceBase):
     """External car microservice"""
     
+    FINAL_STATUSES = ('delivered', 'cancelled', 'failed')
+    
     def __init__(self):
         super().__init__("Car_MS", "0.0.0.0", 5006)
-        self.available_cars = ['CAR-001', 'CAR-002', 'CAR-003']
+        self.fleet = FleetRegistry()
+        for car_id in ['CAR-001', 'CAR-002', 'CAR-003']:
+            self.fleet.register_car(car_id, capacity=10)
         self.storage_ms_host = "192.168.1.100"  # Server_1 IP
         self.storage_ms_port = 5005
         self.controller_ms_host = "192.168.1.100"
@@ -634,11 +1024,10 @@ class Car_MS(MicroserviceBase):
         action = message.get('action')
         
         if action == 'request_car_id':
-            # Check and assign available car
-            if self.available_cars:
-                car_id = self.available_cars[0]  # Simple assignment
-                parcel_id = message.get('parcel_id')
-                
+            # Reserve a slot on the least loaded available car
+            parcel_id = message.get('parcel_id')
+            car_id = self.fleet.reserve(parcel_id)
+            if car_id:
                 print(f"[{self.name}] Assigning car: {car_id}")
                 
                 # Share car ID with Storage_MS
@@ -656,10 +1045,23 @@ class Car_MS(MicroserviceBase):
                         'car_id': car_id
                     }
                 else:
+                    self.fleet.release(parcel_id)
                     return {'status': 'error', 'message': 'Failed to store car assignment'}
             else:
                 return {'status': 'error', 'message': 'No cars available'}
         
+        elif action == 'register_car':
+            self.fleet.register_car(message.get('car_id'), int(message.get('capacity', 1)), message.get('car_status', 'available'))
+            return {'status': 'success'}
+        
+        elif action == 'set_car_status':
+            if self.fleet.set_status(message.get('car_id'), message.get('car_status')):
+                return {'status': 'success'}
+            return {'status': 'error', 'message': 'Unknown car'}
+        
+        elif action == 'fleet_status':
+            return {'status': 'success', 'fleet': self.fleet.snapshot()}
+        
         elif action == 'notify_delivery_assignment':
             parcel_id = message.get('parcel_id')
             car_id = message.get('car_id')
@@ -681,6 +1083,8 @@ class Car_MS(MicroserviceBase):
         
         if response and response.get('status') == 'success':
             print(f"[{self.name}] Delivery update acknowledged")
+            if new_status in self.FINAL_STATUSES:
+                self.fleet.release(parcel_id)
         else:
             print(f"[{self.name}] Delivery update failed")
 
@@ -715,6 +1119,7 @@ if __name__ == "__main__":
     # Start external microservices (Laptop_1)
     print("\nStarting external microservices on Laptop_1...")
     sender_ms = SenderMS()
+    threading.Thread(target=sender_ms.watch_updates, daemon=True).start()
     car_ms = run_microservice(Car_MS)
     
     time.sleep(2)
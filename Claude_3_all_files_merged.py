@@ -2,21 +2,332 @@
 # CAR_MS (External - Windows/Laptop_1)
 # ============================================================================
 
+# car_ms/fleet_index.py
+import csv
+import math
+import threading
+
+class AddressBook:
+    """Local address -> (lat, lon) lookup table, so dispatch needs no geocoding call"""
+    
+    def __init__(self, path: str = None):
+        self.coordinates = {}
+        if path:
+            self.load_csv(path)
+    
+    @staticmethod
+    def normalize(address: str) -> str:
+        return " ".join((address or "").lower().replace(",", " ").split())
+    
+    def add(self, address: str, lat: float, lon: float):
+        self.coordinates[self.normalize(address)] = (float(lat), float(lon))
+    
+    def load_csv(self, path: str):
+        """Load rows of address,lat,lon"""
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) >= 3:
+                    self.add(row[0], row[1], row[2])
+    
+    def lookup(self, address: str):
+        return self.coordinates.get(self.normalize(address))
+
+
+class SpatialGridIndex:
+    """
+    Uniform grid over car positions for nearest-available-car queries.
+    
+    Positions are projected to kilometres around a reference latitude and
+    bucketed into square cells. Only available cars are kept in the cells,
+    so a query searches rings of cells outward from the pickup and stops as
+    soon as no unsearched cell can hold a closer car. Position and
+    availability updates move a car between cells in O(1).
+    
+    When the available cars are sparse compared with the cells between
+    them (a few cars spread over a large area), the ring walk would visit
+    mostly empty cells; once it has looked at more cells than there are
+    available cars it switches to scanning the occupied cells directly.
+    """
+    
+    KM_PER_DEG_LAT = 110.574
+    
+    def __init__(self, cell_km: float = 1.0, ref_lat: float = 0.0):
+        self.cell_km = cell_km
+        self.km_per_deg_lon = 111.320 * math.cos(math.radians(ref_lat))
+        self.cars = {}    # car_id -> (x, y, cell, available)
+        self.cells = {}   # cell -> set of available car_ids
+        self.available_count = 0
+        # Bounding box of the occupied cells; recomputed lazily once an
+        # emptied cell may have been on its edge
+        self.bounds = None
+        self.bounds_stale = False
+        self.lock = threading.Lock()
+    
+    def project(self, lat: float, lon: float):
+        return lon * self.km_per_deg_lon, lat * self.KM_PER_DEG_LAT
+    
+    def _cell(self, x: float, y: float):
+        return int(math.floor(x / self.cell_km)), int(math.floor(y / self.cell_km))
+    
+    def _unlink(self, car_id: str):
+        entry = self.cars.get(car_id)
+        if entry and entry[3]:
+            cell = entry[2]
+            members = self.cells.get(cell)
+            members.discard(car_id)
+            self.available_count -= 1
+            if not members:
+                del self.cells[cell]
+                if self.bounds and (cell[0] in (self.bounds[0], self.bounds[2]) or cell[1] in (self.bounds[1], self.bounds[3])):
+                    self.bounds_stale = True
+    
+    def _link(self, car_id: str, x: float, y: float, available: bool):
+        cell = self._cell(x, y)
+        self.cars[car_id] = (x, y, cell, available)
+        if available:
+            self.cells.setdefault(cell, set()).add(car_id)
+            self.available_count += 1
+            if self.bounds is None:
+                self.bounds = [cell[0], cell[1], cell[0], cell[1]]
+            else:
+                self.bounds = [min(self.bounds[0], cell[0]), min(self.bounds[1], cell[1]),
+                               max(self.bounds[2], cell[0]), max(self.bounds[3], cell[1])]
+    
+    def update(self, car_id: str, lat: float, lon: float, available: bool = None):
+        """Insert a car or move it to a new position; available=None keeps its availability"""
+        x, y = self.project(lat, lon)
+        with self.lock:
+            if available is None:
+                # A position alone says nothing about reservations; new cars start available
+                entry = self.cars.get(car_id)
+                available = entry[3] if entry is not None else True
+            self._unlink(car_id)
+            self._link(car_id, x, y, available)
+    
+    def set_available(self, car_id: str, available: bool) -> bool:
+        with self.lock:
+            entry = self.cars.get(car_id)
+            if entry is None:
+                return False
+            self._unlink(car_id)
+            self._link(car_id, entry[0], entry[1], available)
+            return True
+    
+    def remove(self, car_id: str):
+        with self.lock:
+            self._unlink(car_id)
+            self.cars.pop(car_id, None)
+    
+    def _live_bounds(self):
+        if self.bounds_stale:
+            xs = [cell[0] for cell in self.cells]
+            ys = [cell[1] for cell in self.cells]
+            self.bounds = [min(xs), min(ys), max(xs), max(ys)] if self.cells else None
+            self.bounds_stale = False
+        return self.bounds
+    
+    def _scan(self, x: float, y: float):
+        best_id, best_d2 = None, float('inf')
+        for members in self.cells.values():
+            for car_id in members:
+                car_x, car_y = self.cars[car_id][:2]
+                d2 = (car_x - x) ** 2 + (car_y - y) ** 2
+                if d2 < best_d2:
+                    best_id, best_d2 = car_id, d2
+        return best_id
+    
+    def _nearest(self, x: float, y: float):
+        if not self.cells:
+            return None
+        cx, cy = self._cell(x, y)
+        min_x, min_y, max_x, max_y = self._live_bounds()
+        max_ring = max(abs(cx - min_x), abs(cx - max_x), abs(cy - min_y), abs(cy - max_y))
+        best_id, best_d2 = None, float('inf')
+        visited = 0
+        for ring in range(max_ring + 1):
+            # Everything outside rings 0..ring-1 is at least (ring - 1) cells away
+            if best_id is not None and best_d2 <= ((ring - 1) * self.cell_km) ** 2:
+                break
+            visited += 8 * ring or 1
+            if visited > self.available_count:
+                # more cells than cars: scanning the cars is cheaper than finishing the walk
+                return self._scan(x, y)
+            for gx in range(cx - ring, cx + ring + 1):
+                for gy in ((cy - ring, cy + ring) if abs(gx - cx) != ring else range(cy - ring, cy + ring + 1)):
+                    for car_id in self.cells.get((gx, gy), ()):
+                        car_x, car_y = self.cars[car_id][:2]
+                        d2 = (car_x - x) ** 2 + (car_y - y) ** 2
+                        if d2 < best_d2:
+                            best_id, best_d2 = car_id, d2
+        return best_id
+    
+    def nearest(self, lat: float, lon: float) -> Optional[str]:
+        """Nearest available car to a point, or None"""
+        x, y = self.project(lat, lon)
+        with self.lock:
+            return self._nearest(x, y)
+    
+    def reserve_nearest(self, lat: float, lon: float) -> Optional[str]:
+        """Atomically pick the nearest available car and mark it unavailable"""
+        x, y = self.project(lat, lon)
+        with self.lock:
+            car_id = self._nearest(x, y)
+            if car_id is not None:
+                entry = self.cars[car_id]
+                self._unlink(car_id)
+                self._link(car_id, entry[0], entry[1], False)
+            return car_id
+    
+    def available_cars(self):
+        """Snapshot of (car_id, x, y) for every available car"""
+        with self.lock:
+            return [(car_id, entry[0], entry[1]) for car_id, entry in self.cars.items() if entry[3]]
+    
+    def nearest_linear(self, lat: float, lon: float) -> Optional[str]:
+        """Reference linear scan, used by the benchmark"""
+        x, y = self.project(lat, lon)
+        with self.lock:
+            best_id, best_d2 = None, float('inf')
+            for car_id, (car_x, car_y, _, available) in self.cars.items():
+                if available:
+                    d2 = (car_x - x) ** 2 + (car_y - y) ** 2
+                    if d2 < best_d2:
+                        best_id, best_d2 = car_id, d2
+            return best_id
+
+
+# car_ms/batch_assigner.py
+import numpy as np
+
+class BatchAssigner:
+    """
+    Assigns a window of parcels to cars in one pass.
+    
+    Cost is distance in km plus a penalty per parcel a car already carries.
+    Parcels are grouped into spatial tiles, and each tile's parcel x car cost
+    matrix is built with NumPy against the cars in a box around the tile.
+    The box grows until every parcel's cheapest candidates are provably
+    inside it, so large fleets are never scanned in full. Candidate edges
+    are then taken greedily in cost order while cars have capacity left;
+    with a rank per parcel, lower ranks (more urgent) are matched first.
+    Parcels whose candidates filled up are retried against the remaining
+    cars until nothing changes or the time budget runs out; parcels left
+    over are returned unassigned for the next window.
+    """
+    
+    def __init__(self, load_weight_km: float = 2.0, candidates: int = 8,
+                 tile_parcels: int = 64, time_budget: float = 0.5):
+        self.load_weight_km = load_weight_km
+        self.candidates = candidates
+        self.tile_parcels = tile_parcels
+        self.time_budget = time_budget
+    
+    def assign(self, parcel_xy, car_xy, car_load, car_capacity, parcel_rank=None) -> np.ndarray:
+        """Return the chosen car index per parcel, -1 where none was assigned"""
+        parcel_xy = np.asarray(parcel_xy, dtype=np.float64).reshape(-1, 2)
+        rank = np.zeros(len(parcel_xy), np.int64) if parcel_rank is None else np.asarray(parcel_rank, np.int64)
+        car_xy = np.asarray(car_xy, dtype=np.float64).reshape(-1, 2)
+        load = np.asarray(car_load, dtype=np.int64).copy()
+        remaining = np.asarray(car_capacity, dtype=np.int64) - load
+        result = np.full(len(parcel_xy), -1, dtype=np.int64)
+        deadline = time.perf_counter() + self.time_budget
+        pending = np.arange(len(parcel_xy))
+        
+        while pending.size and time.perf_counter() < deadline:
+            open_cars = np.flatnonzero(remaining > 0)
+            if not open_cars.size:
+                break
+            edges_parcel, edges_car, edges_cost = self._candidate_edges(
+                parcel_xy[pending], car_xy[open_cars], load[open_cars], deadline)
+            if not edges_cost.size:
+                break
+            order = np.lexsort((edges_cost, rank[pending[edges_parcel]]))
+            assigned = 0
+            for p, c in zip(pending[edges_parcel[order]].tolist(), open_cars[edges_car[order]].tolist()):
+                if result[p] < 0 and remaining[c] > 0:
+                    result[p] = c
+                    remaining[c] -= 1
+                    load[c] += 1
+                    assigned += 1
+            if not assigned:
+                break
+            pending = pending[result[pending] < 0]
+        return result
+    
+    def _tiles(self, parcel_xy):
+        """Split parcel indexes into spatially compact groups of about tile_parcels"""
+        low = parcel_xy.min(axis=0)
+        extent = np.maximum(parcel_xy.max(axis=0) - low, 1e-6)
+        side = max(np.sqrt(extent.prod() * self.tile_parcels / len(parcel_xy)), 1e-6)
+        cells = np.floor((parcel_xy - low) / side).astype(np.int64)
+        key = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+        order = np.argsort(key, kind='stable')
+        for group in np.split(order, np.flatnonzero(np.diff(key[order])) + 1):
+            yield from np.array_split(group, -(-len(group) // self.tile_parcels))
+    
+    def _candidate_edges(self, parcel_xy, car_xy, load, deadline):
+        cars = len(car_xy)
+        k = min(self.candidates, cars)
+        penalty = self.load_weight_km * load
+        by_x = np.argsort(car_xy[:, 0], kind='stable')
+        sorted_x = car_xy[by_x, 0]
+        parcels, chosen, costs = [], [], []
+        for group in self._tiles(parcel_xy):
+            if parcels and time.perf_counter() >= deadline:
+                break
+            block = parcel_xy[group]
+            low, high = block.min(axis=0), block.max(axis=0)
+            margin = 1.0
+            while True:
+                # Cars outside the box are at least `margin` km from every parcel in the tile
+                left = np.searchsorted(sorted_x, low[0] - margin, 'left')
+                right = np.searchsorted(sorted_x, high[0] + margin, 'right')
+                near = by_x[left:right]
+                near = near[(car_xy[near, 1] >= low[1] - margin) & (car_xy[near, 1] <= high[1] + margin)]
+                whole_fleet = len(near) == cars
+                if len(near) >= k:
+                    cost = np.hypot(block[:, None, 0] - car_xy[near, 0],
+                                    block[:, None, 1] - car_xy[near, 1]) + penalty[near]
+                    idx = np.argpartition(cost, k - 1, axis=1)[:, :k]
+                    top = np.take_along_axis(cost, idx, axis=1)
+                    if whole_fleet or top.max() <= margin:
+                        break
+                margin *= 2
+            parcels.append(np.repeat(group, k))
+            chosen.append(near[idx].ravel())
+            costs.append(top.ravel())
+        if not costs:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+        return np.concatenate(parcels), np.concatenate(chosen), np.concatenate(costs)
+
+
 # car_ms/car_service.py
 import random
 
 class Car_MS:
     """External microservice representing delivery vehicles"""
     
-    def __init__(self, message_bus: MessageBus, car_id: str = None):
+    def __init__(self, message_bus: MessageBus, car_id: str = None,
+                 fleet: SpatialGridIndex = None, address_book: AddressBook = None,
+                 car_capacity: int = 1, batch_assigner: BatchAssigner = None):
         self.message_bus = message_bus
         self.car_id = car_id or f"CAR-{random.randint(1000, 9999)}"
+        # Traffic addressed to this car (or, in fleet mode, to the cars it
+        # dispatched); bids arrive on the shared car_ms_queue
+        self.queue = car_queue(self.car_id)
         self.logger = logging.getLogger(f'Car_MS-{self.car_id}')
         self.assigned_deliveries = []
+        # Fleet mode: dispatch the nearest available car instead of self.car_id
+        self.fleet = fleet
+        self.address_book = address_book or AddressBook()
+        self.car_capacity = car_capacity
+        self.fleet_loads = {}
+        self.batch_assigner = batch_assigner or BatchAssigner()
         
     def start(self):
         """Start listening for requests"""
         self.message_bus.receive_message('car_ms_queue', self.handle_message)
+        self.message_bus.receive_message(self.queue, self.handle_message)
         self.logger.info(f"Car {self.car_id} is online")
         
     def handle_message(self, message: Dict[str, Any]):
@@ -25,27 +336,112 @@ class Car_MS:
         
         if msg_type == 'request_car_id':
             self.provide_car_id(message)
+        elif msg_type == 'request_car_ids_batch':
+            self.provide_car_ids_batch(message)
+        elif msg_type == 'car_position_update' and self.fleet:
+            self.fleet.update(message['car_id'], message['lat'], message['lon'], message.get('available'))
+        elif msg_type == 'car_positions_batch' and self.fleet:
+            for position in message.get('positions', []):
+                self.fleet.update(position['car_id'], position['lat'], position['lon'],
+                                  position.get('available'))
         elif msg_type == 'delivery_notification':
             self.acknowledge_delivery(message)
         elif msg_type == 'acknowledgment':
             self.logger.info("Received acknowledgment from Controller")
             
+    def select_car(self, message: Dict[str, Any]) -> Optional[str]:
+        """Pick the car for a request: nearest available to the pickup in fleet mode"""
+        if not self.fleet:
+            return self.car_id
+        location = self.address_book.lookup(message.get('pickup_address'))
+        if location is None:
+            self.logger.warning(f"Unknown pickup address {message.get('pickup_address')!r}")
+            return None
+        car_id = self.fleet.reserve_nearest(*location)
+        if car_id is not None:
+            self.add_load(car_id)
+        return car_id
+    
+    def add_load(self, car_id: str):
+        """Count a parcel against a fleet car, keeping it available while it has capacity"""
+        self.fleet_loads[car_id] = self.fleet_loads.get(car_id, 0) + 1
+        self.fleet.set_available(car_id, self.fleet_loads[car_id] < self.car_capacity)
+    
+    def release_load(self, car_id: str):
+        self.fleet_loads[car_id] = max(0, self.fleet_loads.get(car_id, 0) - 1)
+        self.fleet.set_available(car_id, True)
+    
+    def provide_car_ids_batch(self, message: Dict[str, Any]):
+        """Assign a whole window of parcels at once and answer with one message"""
+        parcels = message.get('parcels', [])
+        assignments, unassigned = [], []
+        if not self.fleet:
+            assignments = [dict(parcel, car_id=self.car_id) for parcel in parcels]
+        else:
+            located = []
+            for parcel in parcels:
+                location = self.address_book.lookup(parcel.get('pickup_address'))
+                if location is None:
+                    unassigned.append(parcel)
+                else:
+                    located.append((parcel, self.fleet.project(*location)))
+            cars = self.fleet.available_cars()
+            if located and cars:
+                car_ids = [car[0] for car in cars]
+                lanes = list(PriorityLanes.WEIGHTS)
+                choice = self.batch_assigner.assign(
+                    [xy for _, xy in located],
+                    [car[1:] for car in cars],
+                    [self.fleet_loads.get(car_id, 0) for car_id in car_ids],
+                    [self.car_capacity] * len(cars),
+                    # HIGH parcels get first pick of the nearby cars
+                    [lanes.index(PriorityLanes.lane_for(parcel.get('priority_lane'))) for parcel, _ in located]
+                )
+                for (parcel, _), index in zip(located, choice.tolist()):
+                    if index < 0:
+                        unassigned.append(parcel)
+                    else:
+                        self.add_load(car_ids[index])
+                        assignments.append(dict(parcel, car_id=car_ids[index]))
+            else:
+                unassigned.extend(parcel for parcel, _ in located)
+        
+        self.logger.info(f"Batch {message.get('batch_id')}: {len(assignments)} assigned, "
+                         f"{len(unassigned)} unassigned")
+        if assignments:
+            self.message_bus.send_message('storage_ms_queue', {
+                'message_type': 'store_car_ids',
+                'assignments': [{'parcel_id': a['parcel_id'], 'car_id': a['car_id']} for a in assignments],
+                'reply_to': self.queue,
+                'timestamp': datetime.now().isoformat()
+            })
+        self.message_bus.send_message('controller_ms_queue', {
+            'message_type': 'car_ids_assigned_batch',
+            'batch_id': message.get('batch_id'),
+            'routing_key': message.get('routing_key'),
+            'reply_to': self.queue,
+            'assignments': [{'request_id': a['request_id'], 'car_id': a['car_id']} for a in assignments],
+            'unassigned': [parcel['request_id'] for parcel in unassigned],
+            'timestamp': datetime.now().isoformat()
+        })
+        
     def provide_car_id(self, message: Dict[str, Any]):
         """Check availability and provide car ID"""
-        # Simulate checking availability
-        is_available = True
+        car_id = self.select_car(message)
+        is_available = car_id is not None
         
         if is_available:
             # Share car ID with Storage_MS
             storage_message = {
                 'message_type': 'store_car_id',
-                'car_id': self.car_id,
+                'car_id': car_id,
                 'parcel_id': message.get('parcel_id'),
                 'request_id': message.get('request_id'),
+                'reply_to': self.queue,
                 'timestamp': datetime.now().isoformat()
             }
             
-            self.logger.info(f"Car {self.car_id} available, sharing ID with Storage")
+            self.logger.info(f"Car {car_id} available, sharing ID with Storage")
             self.message_bus.send_message('storage_ms_queue', storage_message)
             
             # Wait for Storage acknowledgment, then acknowledge Controller
@@ -53,13 +449,24 @@ class Car_MS:
             
             controller_message = {
                 'message_type': 'car_id_assigned',
-                'car_id': self.car_id,
+                'car_id': car_id,
                 'request_id': message.get('request_id'),
+                'reply_to': self.queue,
                 'timestamp': datetime.now().isoformat()
             }
             
-            self.logger.info(f"Acknowledging Controller with car ID {self.car_id}")
+            self.logger.info(f"Acknowledging Controller with car ID {car_id}")
             self.message_bus.send_message('controller_ms_queue', controller_message)
+        else:
+            # Tell the Controller, so it can retry instead of holding the request
+            self.logger.info(f"No car available for request {message.get('request_id')}")
+            self.message_bus.send_message('controller_ms_queue', {
+                'message_type': 'car_id_unavailable',
+                'request_id': message.get('request_id'),
+                'parcel_id': message.get('parcel_id'),
+                'reply_to': self.queue,
+                'timestamp': datetime.now().isoformat()
+            })
             
     def acknowledge_delivery(self, message: Dict[str, Any]):
         """Acknowledge delivery assignment"""
@@ -79,18 +486,39 @@ class Car_MS:
         
         self.message_bus.send_message('controller_ms_queue', ack_message)
         
-    def request_delivery_update(self, parcel_id: str, status: str):
+    def report_telemetry(self, lat: float, lon: float, parcel_id: str = None,
+                         status: str = None, car_id: str = None):
+        """Stream a position (and optionally a parcel status) sample; no reply is expected"""
+        self.message_bus.send_message('controller_ms_queue', {
+            'message_type': 'car_telemetry',
+            'car_id': car_id or self.car_id,
+            'lat': lat,
+            'lon': lon,
+            'parcel_id': parcel_id,
+            'status': status,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+        if self.fleet and status == 'delivered':
+            self.release_load(car_id or self.car_id)
+        
+    def request_delivery_update(self, parcel_id: str, status: str, car_id: str = None):
         """Request delivery status update"""
+        car_id = car_id or self.car_id
         update_message = {
             'message_type': 'delivery_update_request',
-            'car_id': self.car_id,
+            'car_id': car_id,
             'parcel_id': parcel_id,
             'status': status,
+            'reply_to': self.queue,
             'timestamp': datetime.now().isoformat()
         }
         
         self.logger.info(f"Requesting delivery update for {parcel_id}: {status}")
         self.message_bus.send_message('controller_ms_queue', update_message)
+        
+        if self.fleet and status == 'delivered':
+            self.release_load(car_id)
 
 
 
@@ -121,6 +549,15 @@ class Database:
         self.connection.commit()
         return cursor
         
+    def executemany(self, query: str, params_seq: List[tuple]) -> Any:
+        """Execute a query for each parameter tuple in one transaction"""
+        if not self.connection:
+            self.connect()
+        cursor = self.connection.cursor()
+        cursor.executemany(query, params_seq)
+        self.connection.commit()
+        return cursor
+        
     def fetchone(self, query: str, params: tuple = ()) -> Optional[Dict]:
         """Fetch one result"""
         cursor = self.execute(query, params)
@@ -140,6 +577,107 @@ class Database:
 # ============================================================================
 # COMMON UTILITIES AND BASE CLASSES
 # ============================================================================
+
+# common/ids.py
+import os
+import socket
+import threading
+import time
+import zlib
+
+class SortableIdGenerator:
+    """
+    Coordination-free, time-ordered ID generator.
+
+    Each ID packs a 64-bit integer: 41 bits of milliseconds since ID_EPOCH_MS,
+    10 bits of node ID and a 12-bit per-millisecond sequence. IDs from one
+    node are strictly increasing, and IDs from all nodes sort by creation
+    time, so new keys land at the right edge of B-tree indexes instead of
+    on random pages. The string form keeps the existing PKG- prefix with a
+    fixed-width Crockford base32 body, so string order matches numeric order.
+    """
+
+    ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z, good for ~69 years
+    NODE_BITS = 10
+    SEQUENCE_BITS = 12
+    MAX_NODE_ID = (1 << NODE_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+    ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+    WIDTH = 13  # ceil(64 / 5) base32 digits
+
+    def __init__(self, node_id: int = None, prefix: str = "PKG-"):
+        if node_id is None:
+            node_id = self.default_node_id()
+        if not 0 <= node_id <= self.MAX_NODE_ID:
+            raise ValueError(f"node_id must be between 0 and {self.MAX_NODE_ID}")
+        self.node_id = node_id
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.last_ms = -1
+        self.sequence = 0
+
+    @classmethod
+    def default_node_id(cls) -> int:
+        """
+        Node ID from IDGEN_NODE_ID, else a CRC32 of host name and PID.
+
+        Unlike hash(), this does not depend on the hash seed. Two generators
+        still get the same one with a 1/1024 chance per pair, and may then
+        issue the same ID in the same millisecond: set IDGEN_NODE_ID to a
+        distinct value on every generator when more than one is running.
+        """
+        configured = os.environ.get('IDGEN_NODE_ID')
+        if configured is not None:
+            return int(configured)
+        return zlib.crc32(f'{socket.gethostname()}/{os.getpid()}'.encode()) & cls.MAX_NODE_ID
+
+    def next_int(self) -> int:
+        """Return the next ID as an integer"""
+        with self.lock:
+            now_ms = int(time.time() * 1000)
+            # If the wall clock steps backwards keep issuing from the last
+            # timestamp so IDs never go back in time or repeat
+            if now_ms < self.last_ms:
+                now_ms = self.last_ms
+            if now_ms == self.last_ms:
+                self.sequence = (self.sequence + 1) & self.MAX_SEQUENCE
+                if self.sequence == 0:
+                    # Sequence exhausted for this millisecond, wait for the next one
+                    while now_ms <= self.last_ms:
+                        time.sleep(0.0001)
+                        now_ms = max(int(time.time() * 1000), now_ms)
+            else:
+                self.sequence = 0
+            self.last_ms = now_ms
+            return ((now_ms - self.ID_EPOCH_MS) << (self.NODE_BITS + self.SEQUENCE_BITS)
+                    | self.node_id << self.SEQUENCE_BITS
+                    | self.sequence)
+
+    def next_id(self) -> str:
+        """Return the next ID in string form, e.g. PKG-01HV3K8Q2M0A4"""
+        return self.format(self.next_int())
+
+    def format(self, value: int) -> str:
+        """Encode an integer ID as prefix plus fixed-width base32"""
+        digits = []
+        for _ in range(self.WIDTH):
+            digits.append(self.ALPHABET[value & 31])
+            value >>= 5
+        return self.prefix + "".join(reversed(digits))
+
+    def parse(self, parcel_id: str) -> Dict[str, int]:
+        """Decode a string ID into its timestamp, node and sequence fields"""
+        value = 0
+        for char in parcel_id[len(self.prefix):]:
+            value = value * 32 + self.ALPHABET.index(char)
+        return {
+            'timestamp_ms': (value >> (self.NODE_BITS + self.SEQUENCE_BITS)) + self.ID_EPOCH_MS,
+            'node_id': (value >> self.SEQUENCE_BITS) & self.MAX_NODE_ID,
+            'sequence': value & self.MAX_SEQUENCE,
+        }
+# ============================================================================
+# COMMON UTILITIES AND BASE CLASSES
+# ============================================================================
 import yaml
 import pika
 import json
@@ -150,11 +688,29 @@ from abc import ABC, abstractmethod
 class MessageBus:
     """Handles YAML-based messaging between microservices using RabbitMQ"""
     
-    def __init__(self, host='localhost', port=5672):
+    # Queues declared as RabbitMQ priority queues (name -> x-max-priority);
+    # every publisher and consumer must declare them with the same arguments
+    PRIORITY_QUEUES = {'controller_ms_intake': 10}
+    
+    def __init__(self, host='localhost', port=5672, prefetch_count=16, max_retries=5, retry_delay=1.0):
         self.host = host
         self.port = port
+        # Unacked messages RabbitMQ will push to this consumer at once; the
+        # rest wait in the broker queue instead of piling up in our process
+        self.prefetch_count = prefetch_count
+        # A message whose handler raises comes back after retry_delay,
+        # 2 * retry_delay, 4 * retry_delay ... seconds; after max_retries
+        # it goes to <queue>.parked until someone replays it
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.retry_queues = set()   # delay queues declared on this channel
         self.connection = None
         self.channel = None
+        self.consumer_tags = {}   # queue_name -> consumer tag, for cancel()
+        # stop_consuming() lets call_later callbacks already scheduled run until this deadline
+        self.pending_timers = 0
+        self.drain_deadline = 0.0
+        self.logger = logging.getLogger('MessageBus')
         
     def connect(self):
         """Establish connection to RabbitMQ"""
@@ -166,14 +722,22 @@ class MessageBus:
         )
         self.connection = pika.BlockingConnection(parameters)
         self.channel = self.connection.channel()
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        
+    def declare_queue(self, queue_name: str):
+        max_priority = self.PRIORITY_QUEUES.get(base_queue(queue_name))
+        arguments = {'x-max-priority': max_priority} if max_priority else None
+        self.channel.queue_declare(queue=queue_name, durable=True, arguments=arguments)
         
-    def send_message(self, queue_name: str, message: Dict[str, Any]):
+    def send_message(self, queue_name: str, message: Dict[str, Any], priority: int = None):
         """Send YAML message to a queue"""
         if not self.channel:
             self.connect()
             
-        self.channel.queue_declare(queue=queue_name, durable=True)
-        yaml_message = yaml.dump(message)
+        queue_name = route_queue(queue_name, message)
+        self.declare_queue(queue_name)
+        envelope = Envelope(queue_name, message, priority)
+        yaml_message = yaml.dump(envelope.body)
         
         self.channel.basic_publish(
             exchange='',
@@ -181,6 +745,9 @@ class MessageBus:
             body=yaml_message,
             properties=pika.BasicProperties(
                 delivery_mode=2,  # make message persistent
+                priority=envelope.priority,
+                message_id=envelope.message_id,
+                timestamp=int(envelope.sent_at)
             )
         )
         
@@ -189,59 +756,1749 @@ class MessageBus:
         if not self.channel:
             self.connect()
             
-        self.channel.queue_declare(queue=queue_name, durable=True)
+        self.declare_queue(queue_name)
         
         def wrapper_callback(ch, method, properties, body):
-            message = yaml.safe_load(body)
-            callback(message)
+            try:
+                message = yaml.safe_load(body)
+            except yaml.YAMLError as e:
+                # Unreadable: no retry will fix it
+                self.park(queue_name, body, properties, e)
+            else:
+                try:
+                    callback(message)
+                except Exception as e:
+                    self.logger.exception(f"Handler for {queue_name} failed")
+                    self.retry_later(queue_name, body, properties, e)
+            # Acked either way: a failed message now lives in a retry or parking queue
             ch.basic_ack(delivery_tag=method.delivery_tag)
             
-        self.channel.basic_consume(
+        self.consumer_tags[queue_name] = self.channel.basic_consume(
             queue=queue_name,
             on_message_callback=wrapper_callback
         )
         
+    def cancel(self, queue_name: str):
+        """Stop consuming a queue; its unacked messages go back to the broker"""
+        consumer_tag = self.consumer_tags.pop(queue_name, None)
+        if consumer_tag:
+            self.channel.basic_cancel(consumer_tag)
+            
+    def redeliver_cancelled(self):
+        """After start_consuming returned: hand back deliveries cancelled consumers never handled"""
+        if not self.channel:
+            return
+        if self.channel.consumer_tags:
+            # Live consumers would later ack deliveries the broker had already requeued
+            self.logger.warning("redeliver_cancelled called while still consuming; nothing handed back")
+            return
+        # Deliveries still unacked on a channel go back to their queues when it closes
+        self.channel.close()
+        self.channel = self.connection.channel()
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.retry_queues.clear()
+        
+    def retry_later(self, queue_name: str, body: bytes, properties, error: Exception):
+        """Republish a failed message to the delay queue for its attempt, or park it"""
+        headers = dict(properties.headers or {})
+        attempt = headers.get('x-retry-count', 0) + 1
+        if attempt > self.max_retries:
+            self.park(queue_name, body, properties, error)
+            return
+        delay_ms = int(self.retry_delay * 2 ** (attempt - 1) * 1000)
+        retry_queue = f'{queue_name}.retry.{delay_ms}ms'
+        if retry_queue not in self.retry_queues:
+            # One queue per delay with a queue-wide TTL, so messages expire in
+            # order; expired ones dead-letter back onto queue_name
+            self.channel.queue_declare(queue=retry_queue, durable=True, arguments={
+                'x-message-ttl': delay_ms,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': queue_name
+            })
+            self.retry_queues.add(retry_queue)
+        headers.update({'x-retry-count': attempt, 'x-last-error': repr(error)[:500]})
+        self._republish(retry_queue, body, properties, headers)
+        
+    def park(self, queue_name: str, body: bytes, properties, error: Exception):
+        """Move a message that keeps failing to <queue_name>.parked"""
+        headers = dict(properties.headers or {})
+        headers.update({'x-last-error': repr(error)[:500], 'x-parked-at': datetime.now().isoformat()})
+        self.logger.error(f"Parking a message from {queue_name} after {headers.get('x-retry-count', 0)} "
+                          f"retries: {error!r}")
+        self.channel.queue_declare(queue=f'{queue_name}.parked', durable=True)
+        self._republish(f'{queue_name}.parked', body, properties, headers)
+        
+    def park_message(self, queue_name: str, message: Dict[str, Any], retries: int, error: Exception):
+        """Park a message whose handler ran outside pika (an InProcessBus service)"""
+        if not self.channel:
+            self.connect()
+        envelope = Envelope(queue_name, message)
+        properties = pika.BasicProperties(message_id=envelope.message_id, timestamp=int(envelope.sent_at),
+                                          headers={'x-retry-count': retries})
+        self.park(queue_name, yaml.dump(envelope.body), properties, error)
+        
+    def take_parked(self, queue_name: str, limit: int = None) -> List[Dict[str, Any]]:
+        """Remove up to limit parked messages of queue_name and return their bodies"""
+        if not self.channel:
+            self.connect()
+        waiting = self.channel.queue_declare(queue=f'{queue_name}.parked', durable=True).method.message_count
+        messages = []
+        while len(messages) < min(waiting, limit if limit is not None else waiting):
+            method, properties, body = self.channel.basic_get(f'{queue_name}.parked')
+            if method is None:
+                break
+            messages.append(yaml.safe_load(body))
+            self.channel.basic_ack(delivery_tag=method.delivery_tag)
+        return messages
+        
+    def _republish(self, queue_name: str, body: bytes, properties, headers: Dict[str, Any]):
+        self.channel.basic_publish(
+            exchange='',
+            routing_key=queue_name,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                priority=properties.priority,
+                message_id=properties.message_id,
+                timestamp=properties.timestamp,
+                headers=headers
+            )
+        )
+        
+    def parked_messages(self, queue_name: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Look at up to limit parked messages of queue_name; they stay parked"""
+        if not self.channel:
+            self.connect()
+        # A channel of its own: a nack on the consuming channel with multiple=True
+        # would also requeue deliveries its handlers have not acked yet
+        channel = self.connection.channel()
+        try:
+            channel.queue_declare(queue=f'{queue_name}.parked', durable=True)
+            return self._peek(channel, f'{queue_name}.parked', limit)
+        finally:
+            # Closing the channel puts everything we fetched back, in order
+            channel.close()
+    
+    @staticmethod
+    def _peek(channel, parked_queue: str, limit: int) -> List[Dict[str, Any]]:
+        parked = []
+        for _ in range(limit):
+            method, properties, body = channel.basic_get(parked_queue)
+            if method is None:
+                break
+            headers = properties.headers or {}
+            parked.append({
+                'message_id': properties.message_id,
+                'retries': headers.get('x-retry-count', 0),
+                'error': headers.get('x-last-error'),
+                'parked_at': headers.get('x-parked-at'),
+                'body': body.decode(errors='replace')
+            })
+        return parked
+    
+    def replay_parked(self, queue_name: str, limit: int = None) -> int:
+        """Put parked messages back on queue_name with a fresh retry budget"""
+        if not self.channel:
+            self.connect()
+        # Only what is parked now: a replayed message failing again and
+        # coming back must not keep this loop going
+        waiting = self.channel.queue_declare(queue=f'{queue_name}.parked', durable=True).method.message_count
+        self.declare_queue(queue_name)
+        replayed = 0
+        while replayed < min(waiting, limit if limit is not None else waiting):
+            method, properties, body = self.channel.basic_get(f'{queue_name}.parked')
+            if method is None:
+                break
+            headers = {key: value for key, value in (properties.headers or {}).items() if not key.startswith('x-')}
+            self._republish(queue_name, body, properties, headers)
+            self.channel.basic_ack(delivery_tag=method.delivery_tag)
+            replayed += 1
+        return replayed
+        
+    def publish(self, topic: str, message: Dict[str, Any]):
+        """Send a YAML message to every current subscriber of topic (fanout exchange)"""
+        if not self.channel:
+            self.connect()
+        self.channel.exchange_declare(exchange=topic, exchange_type='fanout')
+        self.channel.basic_publish(exchange=topic, routing_key='', body=yaml.dump(message))
+        
+    def subscribe(self, topic: str, callback: Callable):
+        """Receive what is published to topic from now on, on a private queue"""
+        if not self.channel:
+            self.connect()
+        self.channel.exchange_declare(exchange=topic, exchange_type='fanout')
+        private_queue = self.channel.queue_declare(queue='', exclusive=True).method.queue
+        self.channel.queue_bind(exchange=topic, queue=private_queue)
+        def wrapper_callback(ch, method, properties, body):
+            try:
+                callback(yaml.safe_load(body))
+            except Exception:
+                self.logger.exception(f"Subscriber to {topic} failed")
+                
+        self.channel.basic_consume(queue=private_queue, on_message_callback=wrapper_callback, auto_ack=True)
+        
     def start_consuming(self):
         """Start listening for messages"""
         self.channel.start_consuming()
+        self.consumer_tags.clear()
+        # stop_consuming() cancelled the consumers; work already scheduled with
+        # call_later (batch windows, flushes, timeouts) still runs until the deadline
+        while self.pending_timers and time.monotonic() < self.drain_deadline:
+            self.connection.process_data_events(time_limit=min(0.5, self.drain_deadline - time.monotonic()))
+        
+    def stop_consuming(self, drain_timeout: float = 5.0):
+        """
+        Stop taking deliveries and make start_consuming return once pending
+        call_later callbacks have run, or after drain_timeout. Deliveries not
+        handled yet go back to the broker.
+        """
+        if self.connection:
+            self.drain_deadline = time.monotonic() + drain_timeout
+            self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+        
+    def call_later(self, delay: float, callback: Callable):
+        """Run callback on the consuming thread after delay seconds"""
+        if not self.connection:
+            self.connect()
+        self.pending_timers += 1
+        
+        def run():
+            self.pending_timers -= 1
+            callback()
+        self.connection.call_later(delay, run)
         
     def close(self):
         """Close connection"""
         if self.connection:
             self.connection.close()
+
+
+# common/shm_ring.py
+import bisect
+import itertools
+import marshal
+import select
+import struct
+from multiprocessing import shared_memory
+
+_FRAME_LEN = struct.Struct('<I')
+
+class ShmRing:
+    """
+    Single-producer, single-consumer message ring in POSIX shared memory.
+    
+    Messages are length-framed (u32 length + payload) into a power-of-two
+    byte stream; a frame may straddle the end of the data area, so a batch
+    is one join plus at most two slice copies on each side. head (bytes
+    written) and tail (bytes read) only grow, live on separate cache lines,
+    are each written by one side only, and move once per batch - head
+    always on a frame boundary.
+    
+    Neither side spins: a consumer with nothing to read (or a producer facing
+    a full ring) raises its waiting flag and blocks on an eventfd, and the
+    other side only pays the eventfd write when that flag is up. A full ring
+    is the backpressure signal - put/put_many give up after `timeout`.
+    Without eventfd (non-Linux, or a peer started with spawn) both sides poll.
+    
+    Create the ring (and its eventfds) in the parent before forking the peer.
+    """
+    
+    HEADER = 256
+    HEAD, TAIL, DATA_WAITING, SPACE_WAITING, CAPACITY = 0, 64, 128, 192, 200
+    
+    def __init__(self, name: str = None, capacity: int = 1 << 22, create: bool = False, eventfds: tuple = None):
+        if create:
+            if capacity & (capacity - 1):
+                raise ValueError("capacity must be a power of two")
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.HEADER + capacity)
+            self.shm.buf[:self.HEADER] = bytes(self.HEADER)
+            struct.pack_into('<Q', self.shm.buf, self.CAPACITY, capacity)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.data = self.buf[self.HEADER:]
+        self.capacity = struct.unpack_from('<Q', self.buf, self.CAPACITY)[0]
+        self.mask = self.capacity - 1
+        # (data available, space available); None means poll
+        self.eventfds = eventfds or (None, None)
+        # Each side keeps its own index locally and only reads the other's
+        self.head = self._load(self.HEAD)
+        self.tail = self._load(self.TAIL)
+        
+    @classmethod
+    def create(cls, capacity: int = 1 << 22) -> 'ShmRing':
+        eventfds = None
+        if hasattr(os, 'eventfd'):
+            eventfds = (os.eventfd(0, os.EFD_NONBLOCK), os.eventfd(0, os.EFD_NONBLOCK))
+        return cls(capacity=capacity, create=True, eventfds=eventfds)
+    
+    def _load(self, offset: int) -> int:
+        return struct.unpack_from('<Q', self.buf, offset)[0]
+    
+    def _store(self, offset: int, value: int):
+        struct.pack_into('<Q', self.buf, offset, value)
+        
+    def _signal(self, flag: int, eventfd: int):
+        if self.buf[flag] and eventfd is not None:
+            os.eventfd_write(eventfd, 1)
+            
+    def _block(self, flag: int, eventfd: int, ready: Callable[[], bool], deadline: float = None) -> bool:
+        """Sleep until ready() or the deadline; the flag asks the peer for a wakeup"""
+        self.buf[flag] = 1
+        try:
+            while True:
+                # Re-check after raising the flag so a publish in between is not missed
+                if ready():
+                    return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                if eventfd is None:
+                    time.sleep(0.0005)
+                elif select.select([eventfd], [], [], remaining)[0]:
+                    os.eventfd_read(eventfd)
+        finally:
+            self.buf[flag] = 0
+            
+    def put(self, payload: bytes, timeout: float = None) -> bool:
+        return self.put_many((payload,), timeout) == 1
+    
+    def put_many(self, payloads, timeout: float = None) -> int:
+        """Write messages in order; returns how many fit before timeout (None = wait)"""
+        payloads = list(payloads)
+        if not payloads:
+            return 0
+        if max(map(len, payloads)) + 4 > self.capacity // 2:
+            raise ValueError("message does not fit the ring")
+        blob = memoryview(b''.join([_FRAME_LEN.pack(len(payload)) + payload for payload in payloads]))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        head, sent, ends = self.head, 0, None
+        while sent < len(blob):
+            tail = self._load(self.TAIL)
+            free = self.capacity - (head - tail)
+            if len(blob) - sent <= free:
+                size = len(blob) - sent
+            else:
+                # Only whole frames may be published: take the longest prefix that fits
+                if ends is None:
+                    ends = list(itertools.accumulate(len(payload) + 4 for payload in payloads))
+                fit = bisect.bisect_right(ends, sent + free)
+                size = ends[fit - 1] - sent if fit else 0
+            if size > 0:
+                self._copy_in(head, blob[sent:sent + size])
+                head += size
+                sent += size
+            else:
+                # Full: let the consumer see what we have, then wait for it to drain
+                self._publish(head)
+                if not self._block(self.SPACE_WAITING, self.eventfds[1],
+                                   lambda: self._load(self.TAIL) != tail, deadline):
+                    break
+        self._publish(head)
+        return len(payloads) if sent == len(blob) else bisect.bisect_right(ends, sent)
+    
+    def _copy_in(self, head: int, view: memoryview):
+        pos = head & self.mask
+        first = min(len(view), self.capacity - pos)
+        self.data[pos:pos + first] = view[:first]
+        if first < len(view):
+            self.data[:len(view) - first] = view[first:]
+            
+    def _publish(self, head: int):
+        if head != self.head:
+            self.head = head
+            self._store(self.HEAD, head)
+            self._signal(self.DATA_WAITING, self.eventfds[0])
+            
+    def get_many(self, max_items: int = 4096, timeout: float = None) -> List[bytes]:
+        """Read up to max_items messages, waiting up to timeout for the first"""
+        if self._load(self.HEAD) == self.tail:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            self._block(self.DATA_WAITING, self.eventfds[0],
+                        lambda: self._load(self.HEAD) != self.tail, deadline)
+        head = self._load(self.HEAD)
+        tail, items = self.tail, []
+        if head == tail:
+            return items
+        # One copy out of shared memory (two if the span wraps), then split locally
+        pos, pending = tail & self.mask, head - tail
+        first = min(pending, self.capacity - pos)
+        chunk = bytes(self.data[pos:pos + first])
+        if first < pending:
+            chunk += bytes(self.data[:pending - first])
+        offset = 0
+        while offset < pending and len(items) < max_items:
+            size = _FRAME_LEN.unpack_from(chunk, offset)[0]
+            items.append(chunk[offset + 4:offset + 4 + size])
+            offset += 4 + size
+        tail += offset
+        if tail != self.tail:
+            self.tail = tail
+            self._store(self.TAIL, tail)
+            self._signal(self.SPACE_WAITING, self.eventfds[1])
+        return items
+    
+    def close(self):
+        self.data.release()
+        self.buf = self.data = None
+        self.shm.close()
+        
+    def unlink(self):
+        self.shm.unlink()
+        for eventfd in self.eventfds:
+            if eventfd is not None:
+                os.close(eventfd)
+
+
+# common/transport.py
+import copy
+import heapq
+import queue
+import uuid
+from collections import deque
+
+class Envelope:
+    """
+    What every transport carries: the service message plus routing metadata.
+    Services only ever see `body`; queue and priority are for the transport,
+    message_id and sent_at for tracing. Network transports put the whole
+    envelope on the wire as YAML, RabbitMQ maps the metadata onto AMQP
+    properties, and the in-process transport never serializes it at all.
+    """
+    
+    __slots__ = ('queue_name', 'body', 'priority', 'message_id', 'sent_at')
+    
+    def __init__(self, queue_name: str, body: Dict[str, Any], priority: int = None,
+                 message_id: str = None, sent_at: float = None):
+        self.queue_name = queue_name
+        self.body = body
+        self.priority = priority
+        self.message_id = message_id or uuid.uuid4().hex
+        self.sent_at = sent_at or time.time()
+        
+    def encode(self) -> bytes:
+        return yaml.dump({
+            'queue': self.queue_name,
+            'priority': self.priority,
+            'message_id': self.message_id,
+            'sent_at': self.sent_at,
+            'body': self.body
+        }).encode()
+    
+    @classmethod
+    def decode(cls, data: bytes) -> 'Envelope':
+        envelope = yaml.safe_load(data)
+        return cls(envelope['queue'], envelope['body'], envelope.get('priority'),
+                   envelope.get('message_id'), envelope.get('sent_at'))
+
+
+class DispatchLoop:
+    """
+    Consumer side shared by the transports that run handlers themselves
+    (everything but RabbitMQ, where pika does it): incoming messages land in
+    one bounded priority inbox and a single start_consuming() loop runs the
+    handlers and call_later callbacks, so each service still handles one
+    message at a time, as with pika. A full inbox blocks whoever delivers
+    into it, which is the backpressure.
+    """
+    
+    def __init__(self, maxsize: int = 10000, put_timeout: float = 30.0, max_retries: int = 5,
+                 retry_delay: float = 1.0, max_parked: int = 10000):
+        self.put_timeout = put_timeout
+        self.inbox = queue.PriorityQueue(maxsize)
+        self.handlers = {}
+        # Same retry policy as MessageBus, with call_later timers for the
+        # delays and this bounded list as the parking queue. It only lives as
+        # long as the process and drops the oldest entry when full; InProcessBus
+        # parks in RabbitMQ instead when it has a remote transport
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.parked = deque(maxlen=max_parked)
+        self.timers = []
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.running = False
+        self.drain_deadline = 0.0
+        self.logger = logging.getLogger(type(self).__name__)
+        
+    def connect(self):
+        """Nothing to connect up front; kept for MessageBus compatibility"""
+        
+    def _next(self) -> int:
+        with self.lock:
+            self.sequence += 1
+            return self.sequence
+        
+    def deliver(self, queue_name: str, message: Dict[str, Any], priority: int = None, timeout: float = None):
+        # Higher priority first, FIFO within a priority
+        self.inbox.put((-(priority or 0), self._next(), queue_name, message),
+                       timeout=self.put_timeout if timeout is None else timeout)
+        
+    def call_later(self, delay: float, callback: Callable):
+        with self.lock:
+            heapq.heappush(self.timers, (time.monotonic() + delay, self.sequence, callback))
+            self.sequence += 1
+            
+    def start_consuming(self):
+        """Run handlers for delivered messages until stop_consuming() or close()"""
+        self.running = True
+        while self.running or (not self.inbox.empty() and time.monotonic() < self.drain_deadline):
+            due = None
+            with self.lock:
+                if self.timers and self.timers[0][0] <= time.monotonic():
+                    due = heapq.heappop(self.timers)[2]
+                wait = min(self.timers[0][0] - time.monotonic(), 0.5) if self.timers else 0.5
+            if due is not None:
+                self._run(due)
+                continue
+            try:
+                _, _, queue_name, message = self.inbox.get(timeout=max(wait, 0))
+            except queue.Empty:
+                continue
+            self.handle(queue_name, message)
+            
+    def handle(self, queue_name: str, message: Dict[str, Any], attempt: int = 0):
+        """Run the queue's handler; retry it later with backoff if it raises"""
+        handler = self.handlers.get(queue_name)
+        if handler is None:
+            self.unrouted(queue_name, message)
+            return
+        try:
+            handler(message)
+        except Exception as e:
+            self.logger.exception(f"Handler for {queue_name} failed")
+            if attempt < self.max_retries:
+                self.call_later(self.retry_delay * 2 ** attempt,
+                                lambda: self.handle(queue_name, message, attempt + 1))
+                return
+            self.park(queue_name, message, attempt, e)
+            
+    def park(self, queue_name: str, message: Dict[str, Any], retries: int, error: Exception):
+        """Keep a message that ran out of retries in the parked list"""
+        self.logger.error(f"Parking a message from {queue_name} after {retries} retries: {error!r}")
+        with self.lock:
+            if len(self.parked) == self.parked.maxlen:
+                self.logger.error(f"Parked list full ({self.parked.maxlen}): dropping the oldest parked "
+                                  f"message, from {self.parked[0]['queue']}")
+            self.parked.append({'queue': queue_name, 'retries': retries, 'error': repr(error)[:500],
+                                'parked_at': datetime.now().isoformat(), 'body': message})
+            
+    def parked_messages(self, queue_name: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Look at up to limit parked messages of queue_name; they stay parked"""
+        with self.lock:
+            return [entry for entry in self.parked if entry['queue'] == queue_name][:limit]
+        
+    def replay_parked(self, queue_name: str, limit: int = None) -> int:
+        """Put parked messages back on queue_name with a fresh retry budget"""
+        with self.lock:
+            replay = [entry for entry in self.parked if entry['queue'] == queue_name][:limit]
+            for entry in replay:
+                self.parked.remove(entry)
+        for entry in replay:
+            self.deliver(queue_name, entry['body'])
+        return len(replay)
+    
+    def unrouted(self, queue_name: str, message: Dict[str, Any]):
+        """A message for a queue cancelled after it was delivered here"""
+        self.logger.warning(f"Dropping message for {queue_name}: no longer consumed here")
+        
+    def cancel(self, queue_name: str):
+        """Stop handling queue_name"""
+        self.handlers.pop(queue_name, None)
+        
+    def redeliver_cancelled(self):
+        """After start_consuming returned: pass on what is still queued here for cancelled queues"""
+        pending = []
+        while True:
+            try:
+                pending.append(self.inbox.get_nowait())
+            except queue.Empty:
+                break
+        for item in pending:
+            if item[2] in self.handlers:
+                self.inbox.put_nowait(item)
+            else:
+                self.unrouted(item[2], item[3])
+                
+    def _run(self, callback: Callable, *args):
+        try:
+            callback(*args)
+        except Exception:
+            self.logger.exception("Handler failed")
+            
+    def stop_consuming(self, drain_timeout: float = 5.0):
+        """Make start_consuming return once what is already in the inbox is handled"""
+        self.drain_deadline = time.monotonic() + drain_timeout
+        self.running = False
+        
+    def close(self):
+        self.running = False
+
+
+class InProcessHub:
+    """
+    Registry of the queues consumed by InProcessBus instances in this process.
+    Sends to an `expected` queue whose service has not subscribed yet wait
+    for it briefly, so start-up order between service threads does not matter.
+    """
+    
+    def __init__(self, expected=(), startup_wait: float = 10.0):
+        self.consumers = {}   # queue_name -> InProcessBus
+        self.subscribers = {}   # topic -> [InProcessBus]
+        self.expected = set(expected)
+        self.startup_wait = startup_wait
+        self.registered = threading.Condition()
+        
+    def register(self, queue_name: str, bus: 'InProcessBus'):
+        with self.registered:
+            self.consumers[queue_name] = bus
+            self.registered.notify_all()
+            
+    def unregister(self, queue_name: str, bus: 'InProcessBus'):
+        with self.registered:
+            if self.consumers.get(queue_name) is bus:
+                del self.consumers[queue_name]
+                
+    def subscribe(self, topic: str, bus: 'InProcessBus'):
+        with self.registered:
+            self.subscribers.setdefault(topic, []).append(bus)
+            
+    def unsubscribe(self, bus: 'InProcessBus'):
+        with self.registered:
+            for buses in self.subscribers.values():
+                if bus in buses:
+                    buses.remove(bus)
+                    
+    def consumer(self, queue_name: str) -> Optional['InProcessBus']:
+        # A partition queue between owners is expected like its base queue
+        bus = self.consumers.get(queue_name)
+        if bus is None and base_queue(queue_name) in self.expected:
+            with self.registered:
+                self.registered.wait_for(lambda: queue_name in self.consumers, self.startup_wait)
+                bus = self.consumers.get(queue_name)
+        return bus
+
+
+class InProcessBus(DispatchLoop):
+    """
+    MessageBus for services that share a process (run_server on Server_1).
+    
+    A message for a queue consumed in this process is handed straight to the
+    consumer's inbox: no YAML, no broker round trip, only an optional deep
+    copy so sender and receiver never share mutable state.
+    
+    Queues with no local consumer go to RabbitMQ through `remote`. Queues
+    listed in remote_inbound are also consumed from RabbitMQ, for peers on
+    other machines (Car_MS, Sender_MS); those messages are acked once they
+    are in the inbox.
+    
+    For a service in another process on the same host, `rings` maps a queue
+    to the ShmRing that process reads (marshal-encoded, see attach_ring).
+    """
+    
+    def __init__(self, hub: InProcessHub, remote: MessageBus = None, remote_inbound=(),
+                 maxsize: int = 10000, copy_messages: bool = True, put_timeout: float = 30.0,
+                 rings: Dict[str, ShmRing] = None):
+        super().__init__(maxsize, put_timeout)
+        self.hub = hub
+        self.remote = remote
+        self.remote_inbound = set(remote_inbound)
+        self.remote_consumer = None
+        self.rings = dict(rings or {})
+        self.copy_messages = copy_messages
+        
+    def send_message(self, queue_name: str, message: Dict[str, Any], priority: int = None):
+        """Hand the message to a local consumer, or publish it to RabbitMQ"""
+        queue_name = route_queue(queue_name, message)
+        target = self.hub.consumer(queue_name)
+        if target is not None:
+            target.deliver(queue_name, copy.deepcopy(message) if self.copy_messages else message, priority)
+        elif queue_name in self.rings:
+            if not self.rings[queue_name].put(marshal.dumps(message), self.put_timeout):
+                raise TimeoutError(f"Shared-memory ring for {queue_name} stayed full")
+        elif self.remote is not None:
+            self.remote.send_message(queue_name, message, priority)
+        else:
+            raise LookupError(f"No consumer for {queue_name} in this process and no remote transport")
+        
+    def receive_message(self, queue_name: str, callback: Callable):
+        self.handlers[queue_name] = callback
+        self.hub.register(queue_name, self)
+        if base_queue(queue_name) in self.remote_inbound and self.remote is not None:
+            if self.remote_consumer is None:
+                self.remote_consumer = MessageBus(self.remote.host, self.remote.port, self.remote.prefetch_count)
+            self.remote_consumer.receive_message(
+                queue_name, lambda message, name=queue_name: self.deliver(name, message))
+            
+    def cancel(self, queue_name: str):
+        super().cancel(queue_name)
+        self.hub.unregister(queue_name, self)
+        if self.remote_consumer is not None and queue_name in self.remote_consumer.consumer_tags:
+            # pika is not thread-safe; the bridge thread does the cancel
+            self.remote_consumer.connection.add_callback_threadsafe(
+                lambda: self.remote_consumer.cancel(queue_name))
+            
+    def unrouted(self, queue_name: str, message: Dict[str, Any]):
+        # Whoever consumes the queue now gets it (a partition's next owner)
+        self.send_message(queue_name, message)
+        
+    def park(self, queue_name: str, message: Dict[str, Any], retries: int, error: Exception):
+        # In RabbitMQ's <queue>.parked the message survives a restart and
+        # `python script.py parked <queue>` can see it
+        if self.remote is None:
+            super().park(queue_name, message, retries, error)
+            return
+        try:
+            self.remote.park_message(queue_name, message, retries, error)
+        except Exception:
+            self.logger.exception(f"Could not park a message from {queue_name} in RabbitMQ; keeping it in memory")
+            super().park(queue_name, message, retries, error)
+            
+    def parked_messages(self, queue_name: str, limit: int = 100) -> List[Dict[str, Any]]:
+        parked = self.remote.parked_messages(queue_name, limit) if self.remote is not None else []
+        return parked + super().parked_messages(queue_name, limit - len(parked))
+    
+    def replay_parked(self, queue_name: str, limit: int = None) -> int:
+        """Deliver parked messages to the local consumer again, with a fresh retry budget"""
+        replayed = 0
+        if self.remote is not None:
+            for message in self.remote.take_parked(queue_name, limit):
+                self.deliver(queue_name, message)
+                replayed += 1
+        return replayed + super().replay_parked(queue_name, None if limit is None else limit - replayed)
+        
+    def publish(self, topic: str, message: Dict[str, Any]):
+        """Deliver message to every bus in this process subscribed to topic, ahead of queued work"""
+        for bus in list(self.hub.subscribers.get(topic, ())):
+            bus.deliver(topic, copy.deepcopy(message) if self.copy_messages else message, priority=255)
+            
+    def subscribe(self, topic: str, callback: Callable):
+        self.handlers[topic] = callback
+        self.hub.subscribe(topic, self)
+        
+    def attach_ring(self, queue_name: str, ring: ShmRing):
+        """Feed messages a co-located process writes into `ring` to this bus's queue_name handler"""
+        def pump():
+            while True:
+                for payload in ring.get_many(timeout=1.0):
+                    self.deliver(queue_name, marshal.loads(payload))
+        threading.Thread(target=pump, name=f'ring-{queue_name}', daemon=True).start()
+        
+    def start_consuming(self):
+        """Run handlers for local (and bridged remote) messages until close()"""
+        if self.remote_consumer is not None:
+            threading.Thread(target=self.remote_consumer.start_consuming, daemon=True).start()
+        super().start_consuming()
+        
+    def close(self):
+        super().close()
+        self.hub.unsubscribe(self)
+        if self.remote_consumer is not None:
+            self.remote_consumer.close()
+        if self.remote is not None:
+            self.remote.close()
+
+
+# common/partitions.py
+import zlib
+
+# Controller_MS request ownership is split into this many partitions. With
+# more than one, messages for PARTITIONED_QUEUES go to one queue per
+# partition (controller_ms_queue.p03, ...), picked by hashing the first
+# PARTITION_KEYS field the message has: every message about a request
+# reaches the instance that owns it, and a car's telemetry and route
+# queries always reach the same one. Set the same value in every process.
+CONTROLLER_PARTITIONS = int(os.environ.get('CONTROLLER_PARTITIONS', '1'))
+PARTITIONED_QUEUES = ('controller_ms_intake', 'controller_ms_queue')
+PARTITION_KEYS = ('routing_key', 'request_id', 'car_id', 'parcel_id')
+
+def partition_for(key: Any, partitions: int = None) -> int:
+    """Partition of a key; crc32 rather than hash() so every process agrees"""
+    return zlib.crc32(str(key).encode()) % (partitions or CONTROLLER_PARTITIONS)
+
+def partition_queue(queue_name: str, partition: int) -> str:
+    return f'{queue_name}.p{partition:02d}'
+
+def base_queue(queue_name: str) -> str:
+    """controller_ms_queue.p03 -> controller_ms_queue"""
+    return queue_name.split('.', 1)[0]
+
+def route_queue(queue_name: str, message: Dict[str, Any]) -> str:
+    """The queue a message for queue_name actually goes to"""
+    if CONTROLLER_PARTITIONS <= 1 or queue_name not in PARTITIONED_QUEUES:
+        return queue_name
+    key = next((message[field] for field in PARTITION_KEYS if message.get(field)), None)
+    return partition_queue(queue_name, partition_for(key if key is not None else uuid.uuid4().hex))
+
+
+# common/car_queues.py
+def car_queue(car_id: str) -> str:
+    """
+    Queue for messages addressed to one car. Only bids (request_car_id,
+    request_car_ids_batch) and fleet position batches use the shared
+    car_ms_queue, where any Car_MS may take them; notifications and acks
+    go to the queue of the car they are for, which Car_MS.start declares.
+    Car_MS puts its own queue in `reply_to` of what it sends, so a fleet
+    dispatcher gets the traffic of the cars it assigned.
+    """
+    return f'car_ms_queue.{car_id}'
+
+
+# common/net_transport.py
+import http.client
+import itertools
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def _split_address(address: str):
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+def _route(routes: Dict[str, str], queue_name: str) -> Optional[str]:
+    """Address of queue_name; per-car and partition queues live with their base queue"""
+    return routes.get(queue_name) or routes.get(base_queue(queue_name))
+
+def bind_listener(address: str, backlog: int = 128) -> socket.socket:
+    """Listening socket for a host:port or unix:/path route"""
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.exists(path):
+            os.unlink(path)
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(path)
+    else:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind(_split_address(address))
+    server_socket.listen(backlog)
+    return server_socket
+
+
+class _PeerConnections:
+    """
+    Per-thread client connections, `fanout` per peer address used in turn.
+    A peer whose listening socket is shared by several pre-forked workers
+    gets a connection to each of them in practice, instead of every message
+    from this thread landing on whichever worker accepted the first one.
+    """
+    
+    def __init__(self, connect: Callable, fanout: int = 1):
+        self.connect = connect
+        self.fanout = max(1, fanout)
+        self.local = threading.local()
+        
+    def get(self, address: str):
+        pools = getattr(self.local, 'pools', None)
+        if pools is None:
+            pools = self.local.pools = {}
+        pool, turn = pools.setdefault(address, ([], itertools.count()))
+        if len(pool) < self.fanout:
+            pool.append(self.connect(address))
+            return pool[-1]
+        return pool[next(turn) % len(pool)]
+    
+    def discard(self, address: str, connection):
+        connection.close()
+        pool = self.local.pools.get(address, ([],))[0]
+        if connection in pool:
+            pool.remove(connection)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection to a unix:/path route"""
+    
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+        
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class HttpBus(DispatchLoop):
+    """
+    MessageBus over YAML-over-HTTP, the way the Flask services talk.
+    
+    `routes` maps each queue to the host:port (or unix:/path) of the
+    service consuming it.
+    receive_message() starts a listener on the queue's route (services with
+    two queues share one); a POST to /queues/<name> with an encoded Envelope
+    lands in the inbox and is answered 202, or 503 if the inbox stayed full.
+    Senders keep keep-alive connections per peer per thread.
+    
+    A POST waits for inbox space at most a fifth of the sender's timeout,
+    so the sender always gets the 503 instead of timing out on a message
+    that may still be delivered. A sender resends only when the peer closed
+    the connection without answering, and the receiver drops envelopes
+    whose message_id it has recently accepted, so that resend cannot
+    deliver twice.
+    """
+    
+    RECENT_IDS = 100000
+    
+    def __init__(self, routes: Dict[str, str], maxsize: int = 10000, put_timeout: float = 30.0,
+                 timeout: float = 10.0, fanout: int = 1, listeners: Dict[str, socket.socket] = None):
+        super().__init__(maxsize, put_timeout)
+        self.routes = dict(routes)
+        self.timeout = timeout
+        self.accept_wait = min(put_timeout, timeout / 5)
+        self.recent_ids = {}   # message_ids accepted lately, oldest first
+        # Sockets bound before fork, shared with this service's other workers
+        self.prebound = dict(listeners or {})
+        self.servers = {}   # address -> ThreadingHTTPServer
+        self.connections = _PeerConnections(self._connect, fanout)
+        
+    def receive_message(self, queue_name: str, callback: Callable):
+        self.handlers[queue_name] = callback
+        self.listen(_route(self.routes, queue_name))
+        
+    def listen(self, address: str):
+        if address in self.servers:
+            return
+        bus = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def do_POST(self):
+                queue_name = self.path.rpartition('/')[2]
+                envelope = Envelope.decode(self.rfile.read(int(self.headers['Content-Length'])))
+                if queue_name not in bus.handlers:
+                    self.reply(404)
+                    return
+                if not bus.first_delivery(envelope.message_id):
+                    self.reply(202)   # a resend of something already in the inbox
+                    return
+                try:
+                    bus.deliver(queue_name, envelope.body, envelope.priority, bus.accept_wait)
+                except queue.Full:
+                    bus.forget_delivery(envelope.message_id)
+                    self.reply(503)
+                    return
+                self.reply(202)
+                
+            def reply(self, status: int):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                
+            def log_message(self, format, *args):
+                pass
+            
+        # The server's own socket is replaced by the bound listener, so its
+        # address only matters for TCP
+        server_address = ('localhost', 0) if address.startswith('unix:') else _split_address(address)
+        server = ThreadingHTTPServer(server_address, Handler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = self.prebound.get(address) or bind_listener(address)
+        server.daemon_threads = True
+        self.servers[address] = server
+        threading.Thread(target=server.serve_forever, name=f'http-{address}', daemon=True).start()
+        
+    def send_message(self, queue_name: str, message: Dict[str, Any], priority: int = None):
+        """POST the envelope to the service consuming queue_name"""
+        address = _route(self.routes, queue_name)
+        if address is None:
+            raise LookupError(f"No HTTP route for {queue_name}")
+        body = Envelope(queue_name, message, priority).encode()
+        for attempt in range(2):
+            connection = self.connections.get(address)
+            try:
+                connection.request('POST', f'/queues/{queue_name}', body,
+                                   {'Content-Type': 'application/x-yaml'})
+                response = connection.getresponse()
+                response.read()
+                break
+            except ConnectionError:
+                # Peer closed the keep-alive connection without answering:
+                # reconnect once (the receiver drops the copy if it got one)
+                self.connections.discard(address, connection)
+                if attempt:
+                    raise
+            except (http.client.HTTPException, OSError):
+                # Timed out: it may still be delivered, so never resend
+                self.connections.discard(address, connection)
+                raise
+        if response.status != 202:
+            raise ConnectionError(f"{address} answered {response.status} for {queue_name}")
+        
+    def first_delivery(self, message_id: str) -> bool:
+        """Remember message_id; False if it was accepted recently"""
+        with self.lock:
+            if message_id in self.recent_ids:
+                return False
+            self.recent_ids[message_id] = None
+            if len(self.recent_ids) > self.RECENT_IDS:
+                del self.recent_ids[next(iter(self.recent_ids))]
+            return True
+        
+    def forget_delivery(self, message_id: str):
+        with self.lock:
+            self.recent_ids.pop(message_id, None)
+            
+    def _connect(self, address: str) -> http.client.HTTPConnection:
+        if address.startswith('unix:'):
+            return _UnixHTTPConnection(address[len('unix:'):], self.timeout)
+        host, port = _split_address(address)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+    
+    def _close_listeners(self):
+        servers, self.servers = self.servers, {}
+        for server in servers.values():
+            server.shutdown()
+            server.server_close()
+            
+    def stop_consuming(self, drain_timeout: float = 5.0):
+        self._close_listeners()
+        super().stop_consuming(drain_timeout)
+        
+    def close(self):
+        super().close()
+        self._close_listeners()
+
+
+class SocketBus(DispatchLoop):
+    """
+    MessageBus over raw sockets, the MicroserviceBase way but with
+    persistent connections: each encoded Envelope is sent as a u32 length
+    plus payload, one way, with no per-message reply. A reader thread per
+    inbound connection delivers into the inbox; when that is full the
+    reader stops reading and TCP flow control pushes back on the sender.
+    
+    Routes are host:port, or unix:/path for a peer on the same host.
+    """
+    
+    def __init__(self, routes: Dict[str, str], maxsize: int = 10000, put_timeout: float = 30.0,
+                 timeout: float = 10.0, fanout: int = 1, listeners: Dict[str, socket.socket] = None):
+        super().__init__(maxsize, put_timeout)
+        self.routes = dict(routes)
+        self.timeout = timeout
+        # Sockets bound before fork, shared with this service's other workers
+        self.prebound = dict(listeners or {})
+        self.listeners = {}   # address -> listening socket
+        self.connections = _PeerConnections(self._connect, fanout)
+        
+    def receive_message(self, queue_name: str, callback: Callable):
+        self.handlers[queue_name] = callback
+        self.listen(_route(self.routes, queue_name))
+        
+    def listen(self, address: str):
+        if address in self.listeners:
+            return
+        server_socket = self.prebound.get(address) or bind_listener(address)
+        self.listeners[address] = server_socket
+        threading.Thread(target=self.accept_loop, args=(server_socket,), name=f'socket-{address}',
+                         daemon=True).start()
+        
+    def accept_loop(self, server_socket: socket.socket):
+        while True:
+            try:
+                client_socket, _ = server_socket.accept()
+            except OSError:
+                return   # listener closed
+            threading.Thread(target=self.read_loop, args=(client_socket,), daemon=True).start()
+            
+    def read_loop(self, client_socket: socket.socket):
+        stream = client_socket.makefile('rb')
+        try:
+            while True:
+                header = stream.read(4)
+                if len(header) < 4:
+                    return
+                envelope = Envelope.decode(stream.read(struct.unpack('<I', header)[0]))
+                if envelope.queue_name not in self.handlers:
+                    self.logger.warning(f"Dropping message for unknown queue {envelope.queue_name}")
+                    continue
+                # No timeout: a reader stuck on a full inbox is the backpressure
+                self.inbox.put((-(envelope.priority or 0), self._next(), envelope.queue_name, envelope.body))
+        finally:
+            stream.close()
+            client_socket.close()
+            
+    def send_message(self, queue_name: str, message: Dict[str, Any], priority: int = None):
+        """Write the framed envelope to the service consuming queue_name"""
+        address = _route(self.routes, queue_name)
+        if address is None:
+            raise LookupError(f"No socket route for {queue_name}")
+        payload = Envelope(queue_name, message, priority).encode()
+        frame = struct.pack('<I', len(payload)) + payload
+        for attempt in range(2):
+            connection = self.connections.get(address)
+            try:
+                connection.sendall(frame)
+                return
+            except OSError:
+                # Peer went away; reconnect once
+                self.connections.discard(address, connection)
+                if attempt:
+                    raise
+                
+    def _connect(self, address: str) -> socket.socket:
+        if address.startswith('unix:'):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(address[len('unix:'):])
+        else:
+            connection = socket.create_connection(_split_address(address), self.timeout)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+    
+    def _close_listeners(self):
+        listeners, self.listeners = self.listeners, {}
+        for address, server_socket in listeners.items():
+            # shutdown() wakes accept(), but on a socket shared with other
+            # workers it would stop them accepting too
+            if address not in self.prebound:
+                try:
+                    server_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            server_socket.close()
+            
+    def stop_consuming(self, drain_timeout: float = 5.0):
+        self._close_listeners()
+        super().stop_consuming(drain_timeout)
+        
+    def close(self):
+        super().close()
+        self._close_listeners()
+
+
+# Deployment config for run_server: which transport the Server_1 services use
+# ('inprocess', 'rabbitmq', 'http' or 'socket'), which queues they consume,
+# and which of those laptop peers publish to. The http and socket transports
+# reach every queue, laptop ones included, at its TRANSPORT_ROUTES address.
+SERVER_TRANSPORT = os.environ.get('SERVER_TRANSPORT', 'inprocess')
+CO_LOCATED_QUEUES = os.environ.get(
+    'CO_LOCATED_QUEUES',
+    'ui_ms_queue,controller_ms_intake,controller_ms_queue,idgen_ms_queue,storage_ms_queue,log_ms_queue').split(',')
+REMOTE_INBOUND_QUEUES = os.environ.get(
+    'REMOTE_INBOUND_QUEUES', 'ui_ms_queue,controller_ms_queue,storage_ms_queue').split(',')
+
+TRANSPORT_ROUTES = dict(route.split('=', 1) for route in os.environ.get(
+    'TRANSPORT_ROUTES',
+    'ui_ms_queue=SERVER_1_IP_ADDRESS:7101,controller_ms_intake=SERVER_1_IP_ADDRESS:7102,'
+    'controller_ms_queue=SERVER_1_IP_ADDRESS:7102,idgen_ms_queue=SERVER_1_IP_ADDRESS:7103,'
+    'storage_ms_queue=SERVER_1_IP_ADDRESS:7104,log_ms_queue=SERVER_1_IP_ADDRESS:7105,'
+    'car_ms_queue=LAPTOP_1_IP_ADDRESS:7106,sender_ms_queue=LAPTOP_1_IP_ADDRESS:7107').split(','))
+
+# Connections each sender opens per http/socket peer; set it to the largest
+# worker count under run_supervisor so every pre-forked worker gets traffic
+TRANSPORT_FANOUT = int(os.environ.get('TRANSPORT_FANOUT', '1'))
+
+def create_bus(transport: str, routes: Dict[str, str] = None, host: str = 'localhost', port: int = 5672,
+               fanout: int = None, listeners: Dict[str, socket.socket] = None):
+    """Bus for a service that is not sharing an InProcessHub"""
+    fanout = fanout or TRANSPORT_FANOUT
+    if transport == 'http':
+        return HttpBus(routes or TRANSPORT_ROUTES, fanout=fanout, listeners=listeners)
+    if transport == 'socket':
+        return SocketBus(routes or TRANSPORT_ROUTES, fanout=fanout, listeners=listeners)
+    return MessageBus(host=host, port=port)
+
+def check_partitioned_transport(transport: str):
+    """
+    Partitioned Controller_MS instances coordinate over publish/subscribe,
+    which only RabbitMQ and the in-process transport provide
+    """
+    if CONTROLLER_PARTITIONS > 1 and transport in ('http', 'socket'):
+        raise ValueError(f"CONTROLLER_PARTITIONS={CONTROLLER_PARTITIONS} needs the rabbitmq or inprocess "
+                         f"transport; {transport} has no publish/subscribe")
+
+def create_server_bus(hub: InProcessHub, host: str = 'localhost', port: int = 5672):
+    """Bus for one Server_1 service according to the deployment config"""
+    check_partitioned_transport(SERVER_TRANSPORT)
+    if SERVER_TRANSPORT != 'inprocess':
+        return create_bus(SERVER_TRANSPORT, host=host, port=port)
+    return InProcessBus(hub, remote=MessageBus(host=host, port=port), remote_inbound=REMOTE_INBOUND_QUEUES)
 # ============================================================================
 # CONTROLLER_MS (Internal - Ubuntu/Server_1)
 # ============================================================================
 
+# controller_ms/position_history.py
+import glob
+import re
+from array import array
+
+class PositionHistory:
+    """
+    Compact per-car position history for route analytics.
+    
+    Each car appends to typed arrays (int64 epoch ms, float32 lat, float32
+    lon: 16 bytes per sample, float32 keeps ~1 m precision). Once the open
+    chunk reaches chunk_size samples it is sorted by time and sealed; with
+    a directory, sealed chunks are written as flat binary files and mapped
+    back read-only with np.memmap, so old history costs page cache rather
+    than heap. Range queries skip chunks by their time bounds and binary
+    search within them.
+    
+    The car id names the car's directory, so only ids made of letters,
+    digits, '_' and '-' are accepted. The open chunk lives in memory until
+    it fills up; call flush() on shutdown or it is lost.
+    """
+    
+    DTYPE = np.dtype([('t', '<i8'), ('lat', '<f4'), ('lon', '<f4')])
+    CAR_ID = re.compile(r'[A-Za-z0-9_-]+')
+    
+    def __init__(self, directory: str = None, chunk_size: int = 65536):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.sealed = {}   # car_id -> [(t_min, t_max, array)]
+        self.open = {}     # car_id -> (array('q'), array('f'), array('f'))
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.load()
+            
+    def load(self):
+        """Map chunks written by a previous run"""
+        for path in sorted(glob.glob(os.path.join(self.directory, '*', '*.bin'))):
+            car_id = os.path.basename(os.path.dirname(path))
+            if not self.CAR_ID.fullmatch(car_id):
+                continue
+            chunk = np.memmap(path, dtype=self.DTYPE, mode='r')
+            if len(chunk):
+                self.sealed.setdefault(car_id, []).append((int(chunk['t'][0]), int(chunk['t'][-1]), chunk))
+                
+    def append(self, car_id: str, timestamp_ms: int, lat: float, lon: float):
+        """Record one sample"""
+        if not isinstance(car_id, str) or not self.CAR_ID.fullmatch(car_id):
+            raise ValueError(f"Invalid car id for position history: {car_id!r}")
+        with self.lock:
+            columns = self.open.get(car_id)
+            if columns is None:
+                columns = self.open[car_id] = (array('q'), array('f'), array('f'))
+            columns[0].append(timestamp_ms)
+            columns[1].append(lat)
+            columns[2].append(lon)
+            if len(columns[0]) >= self.chunk_size:
+                self._seal(car_id)
+                
+    def _seal(self, car_id: str):
+        times, lats, lons = self.open.pop(car_id)
+        chunk = np.empty(len(times), dtype=self.DTYPE)
+        chunk['t'] = np.frombuffer(times, dtype=np.int64)
+        chunk['lat'] = np.frombuffer(lats, dtype=np.float32)
+        chunk['lon'] = np.frombuffer(lons, dtype=np.float32)
+        chunk.sort(order='t', kind='stable')
+        if self.directory:
+            car_dir = os.path.join(self.directory, car_id)
+            os.makedirs(car_dir, exist_ok=True)
+            path = os.path.join(car_dir, f"{chunk['t'][0]:015d}-{uuid.uuid4().hex[:6]}.bin")
+            chunk.tofile(path)
+            chunk = np.memmap(path, dtype=self.DTYPE, mode='r')
+        self.sealed.setdefault(car_id, []).append((int(chunk['t'][0]), int(chunk['t'][-1]), chunk))
+        
+    def flush(self):
+        """Seal every open chunk, e.g. before shutdown"""
+        with self.lock:
+            for car_id in list(self.open):
+                self._seal(car_id)
+                
+    def query(self, car_id: str, start_ms: int, end_ms: int) -> np.ndarray:
+        """Samples of one car with start_ms <= t <= end_ms, ordered by time"""
+        with self.lock:
+            parts = []
+            for t_min, t_max, chunk in self.sealed.get(car_id, []):
+                if t_max < start_ms or t_min > end_ms:
+                    continue
+                lo = np.searchsorted(chunk['t'], start_ms, 'left')
+                hi = np.searchsorted(chunk['t'], end_ms, 'right')
+                parts.append(np.array(chunk[lo:hi]))
+            columns = self.open.get(car_id)
+            if columns:
+                times = np.frombuffer(columns[0], dtype=np.int64)
+                mask = (times >= start_ms) & (times <= end_ms)
+                tail = np.empty(int(mask.sum()), dtype=self.DTYPE)
+                tail['t'] = times[mask]
+                tail['lat'] = np.frombuffer(columns[1], dtype=np.float32)[mask]
+                tail['lon'] = np.frombuffer(columns[2], dtype=np.float32)[mask]
+                parts.append(tail)
+                # Drop the buffer view so appends can resize the array again
+                del times
+        if not parts:
+            return np.empty(0, dtype=self.DTYPE)
+        result = np.concatenate(parts)
+        result.sort(order='t', kind='stable')
+        return result
+        
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            sealed = sum(len(chunk) for chunks in self.sealed.values() for _, _, chunk in chunks)
+            pending = sum(len(columns[0]) for columns in self.open.values())
+        return {
+            'cars': len(set(self.sealed) | set(self.open)),
+            'samples': sealed + pending,
+            'bytes': (sealed + pending) * self.DTYPE.itemsize
+        }
+
+
+# controller_ms/telemetry.py
+class TelemetryCoalescer:
+    """
+    Collects car telemetry between flushes, keeping only the latest position
+    per car and the latest status per parcel. On drain, statuses are compared
+    with the last status seen for each parcel so callers only act on real
+    transitions. Parcels that reach a final status are forgotten.
+    """
+    
+    FINAL_STATUSES = ('delivered', 'cancelled', 'failed')
+    
+    def __init__(self):
+        self.positions = {}     # car_id -> latest position sample
+        self.statuses = {}      # parcel_id -> latest status sample
+        self.last_status = {}   # parcel_id -> status already written
+        self.received = 0
+        self.lock = threading.Lock()
+        
+    def add(self, message: Dict[str, Any]):
+        """Fold one telemetry sample into the pending state"""
+        car_id = message.get('car_id')
+        timestamp = message.get('timestamp', '')
+        with self.lock:
+            self.received += 1
+            if message.get('lat') is not None and message.get('lon') is not None:
+                current = self.positions.get(car_id)
+                if current is None or current['timestamp'] <= timestamp:
+                    position = {
+                        'car_id': car_id,
+                        'lat': message['lat'],
+                        'lon': message['lon'],
+                        'timestamp': timestamp
+                    }
+                    # Availability only travels when a sample states it;
+                    # otherwise the fleet index keeps what it has
+                    if message.get('available') is not None:
+                        position['available'] = message['available']
+                    elif current is not None and 'available' in current:
+                        position['available'] = current['available']
+                    self.positions[car_id] = position
+            parcel_id = message.get('parcel_id')
+            if parcel_id and message.get('status'):
+                current = self.statuses.get(parcel_id)
+                if current is None or current['timestamp'] <= timestamp:
+                    self.statuses[parcel_id] = {
+                        'parcel_id': parcel_id,
+                        'car_id': car_id,
+                        'status': message['status'],
+                        'timestamp': timestamp
+                    }
+                    
+    def drain(self):
+        """Return (positions, status transitions, samples received) and reset"""
+        with self.lock:
+            positions, statuses, received = self.positions, self.statuses, self.received
+            self.positions, self.statuses, self.received = {}, {}, 0
+            changes = []
+            for parcel_id, sample in statuses.items():
+                if self.last_status.get(parcel_id) != sample['status']:
+                    changes.append(sample)
+                if sample['status'] in self.FINAL_STATUSES:
+                    self.last_status.pop(parcel_id, None)
+                else:
+                    self.last_status[parcel_id] = sample['status']
+        return list(positions.values()), changes, received
+
+
+# controller_ms/priority_lanes.py
+from collections import deque
+
+class PriorityLanes:
+    """
+    Per-priority FIFO lanes with weighted fair dequeueing.
+    
+    pop() uses smooth weighted round robin over the non-empty lanes, so with
+    weights 8/3/1 a saturated Controller starts about 8 HIGH requests for
+    every NORMAL 3 and BULK 1, and BULK still makes progress. Each lane
+    keeps the queueing delay of its recent requests for reporting.
+    """
+    
+    WEIGHTS = {'HIGH': 8, 'NORMAL': 3, 'BULK': 1}
+    # RabbitMQ message priority per lane (intake queue has x-max-priority 10)
+    BROKER_PRIORITY = {'HIGH': 9, 'NORMAL': 5, 'BULK': 1}
+    ALIASES = {'URGENT': 'HIGH', 'EXPRESS': 'HIGH', 'LOW': 'BULK', 'STANDARD': 'NORMAL'}
+    
+    def __init__(self, weights: Dict[str, int] = None, delay_samples: int = 1024):
+        self.weights = dict(weights or self.WEIGHTS)
+        self.lanes = {lane: deque() for lane in self.weights}
+        self.current = {lane: 0 for lane in self.weights}
+        self.delays = {lane: deque(maxlen=delay_samples) for lane in self.weights}
+        self.dequeued = {lane: 0 for lane in self.weights}
+        
+    @classmethod
+    def lane_for(cls, priority) -> str:
+        """Map a request's 'priority' field (name or 0-9 number) to a lane"""
+        if isinstance(priority, (int, float)):
+            return 'HIGH' if priority >= 7 else 'BULK' if priority <= 2 else 'NORMAL'
+        name = str(priority or 'NORMAL').upper()
+        name = cls.ALIASES.get(name, name)
+        return name if name in cls.WEIGHTS else 'NORMAL'
+    
+    def push(self, lane: str, item: Any):
+        self.lanes[lane].append((time.monotonic(), item))
+        
+    def pop(self):
+        """Return (lane, item, seconds queued), or None when every lane is empty"""
+        total, best = 0, None
+        for lane, weight in self.weights.items():
+            if not self.lanes[lane]:
+                continue
+            self.current[lane] += weight
+            total += weight
+            if best is None or self.current[lane] > self.current[best]:
+                best = lane
+        if best is None:
+            return None
+        self.current[best] -= total
+        enqueued, item = self.lanes[best].popleft()
+        waited = time.monotonic() - enqueued
+        self.delays[best].append(waited)
+        self.dequeued[best] += 1
+        if not self.lanes[best]:
+            self.current[best] = 0
+        return best, item, waited
+    
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes.values())
+    
+    def remove_if(self, predicate: Callable) -> List[tuple]:
+        """Take out every queued item matching predicate, as (lane, item)"""
+        removed = []
+        for lane, entries in self.lanes.items():
+            kept = deque()
+            for entry in entries:
+                if predicate(entry[1]):
+                    removed.append((lane, entry[1]))
+                else:
+                    kept.append(entry)
+            self.lanes[lane] = kept
+        return removed
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Depth, throughput and queueing delay (ms) per lane"""
+        report = {}
+        for lane in self.weights:
+            delays = sorted(self.delays[lane])
+            report[lane] = {
+                'depth': len(self.lanes[lane]),
+                'dequeued': self.dequeued[lane],
+                'oldest_ms': round((time.monotonic() - self.lanes[lane][0][0]) * 1000, 1) if self.lanes[lane] else 0.0,
+                'avg_delay_ms': round(sum(delays) / len(delays) * 1000, 1) if delays else 0.0,
+                'p95_delay_ms': round(delays[int(0.95 * (len(delays) - 1))] * 1000, 1) if delays else 0.0,
+                'max_delay_ms': round(delays[-1] * 1000, 1) if delays else 0.0,
+            }
+        return report
+
+
+# controller_ms/partitions.py
+class PartitionTable:
+    """
+    Live Controller_MS instances and which request partitions each owns.
+    
+    Instances announce themselves with heartbeats and one not heard from
+    for `expiry` seconds has left. Ownership is rendezvous hashing over the
+    live members: every instance computes the same owners from the same
+    member list, and a join or leave moves only the partitions that the
+    joining or leaving instance gains or gives up.
+    """
+    
+    def __init__(self, partitions: int, expiry: float = 3.0):
+        self.partitions = partitions
+        self.expiry = expiry
+        self.members = {}   # instance_id -> last heartbeat (monotonic)
+        
+    def observe(self, instance_id: str) -> bool:
+        """Record a heartbeat; True if the instance is new"""
+        new = instance_id not in self.members
+        self.members[instance_id] = time.monotonic()
+        return new
+    
+    def forget(self, instance_id: str) -> bool:
+        return self.members.pop(instance_id, None) is not None
+    
+    def expire(self, keep: str) -> List[str]:
+        """Drop and return the members whose heartbeats stopped"""
+        cutoff = time.monotonic() - self.expiry
+        gone = [member for member, seen in self.members.items() if seen < cutoff and member != keep]
+        for member in gone:
+            del self.members[member]
+        return gone
+    
+    def owner(self, partition: int, exclude: str = None) -> Optional[str]:
+        candidates = [member for member in self.members if member != exclude]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda member: (zlib.crc32(f'{member}/{partition}'.encode()), member))
+    
+    def owned_by(self, instance_id: str) -> set:
+        return {partition for partition in range(self.partitions) if self.owner(partition) == instance_id}
+
+
 # controller_ms/controller_service.py
 class Controller_MS:
     """Internal microservice coordinating the delivery process"""
     
-    def __init__(self, message_bus: MessageBus):
+    MAX_ASSIGNMENT_ATTEMPTS = 3
+    ASSIGNMENT_RETRY_DELAY = 1.0   # seconds before asking Car_MS again after no car was free
+    # Fanout topic the instances of a partitioned Controller talk over
+    MEMBERSHIP_TOPIC = 'controller_ms_membership'
+    
+    def __init__(self, message_bus: MessageBus, batch_window: float = 0.0, max_batch: int = 5000,
+                 telemetry_window: float = 1.0, position_history: PositionHistory = None,
+                 max_inflight: int = 0, inflight_timeout: float = 60.0,
+                 lane_report_interval: float = 60.0, instance_id: str = None,
+                 heartbeat_interval: float = 1.0, handoff_timeout: float = 5.0):
         self.message_bus = message_bus
         self.logger = logging.getLogger('Controller_MS')
         self.active_requests = {}
+        # New requests wait in priority lanes; at most max_inflight (0 = no
+        # limit) are between intake and delivery assignment at any time
+        self.lanes = PriorityLanes()
+        self.max_inflight = max_inflight
+        self.inflight_timeout = inflight_timeout
+        self.inflight = {}   # request_id -> start time
+        self.lane_report_interval = lane_report_interval
+        self.lane_report_scheduled = False
+        # Batch mode: collect parcels for batch_window seconds and assign them together
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.pending_batch = []
+        self.batch_scheduled = False
+        # Car telemetry is coalesced and flushed once per telemetry_window
+        self.telemetry_window = telemetry_window
+        self.telemetry = TelemetryCoalescer()
+        self.telemetry_scheduled = False
+        # Every raw position sample is kept here, before coalescing
+        self.position_history = position_history
+        # With CONTROLLER_PARTITIONS > 1 several instances share the work:
+        # each consumes only the partition queues it owns, and hands a
+        # partition's request state to the next owner when it moves
+        self.partitions = PartitionTable(CONTROLLER_PARTITIONS, expiry=3 * heartbeat_interval)
+        self.instance_id = instance_id or f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        self.heartbeat_interval = heartbeat_interval
+        self.handoff_timeout = handoff_timeout
+        self.owned = set()
+        self.awaiting = {}   # partition -> deadline for its handoff
+        self.departing = set()   # instances that announced they are leaving
+        self.assignment = None   # partition -> owner, as of the last rebalance
         
     def start(self):
         """Start listening for requests"""
-        self.message_bus.receive_message('controller_ms_queue', self.handle_message)
-        self.message_bus.start_consuming()
+        if self.partitions.partitions <= 1:
+            self.message_bus.receive_message('controller_ms_intake', self.handle_message)
+            self.message_bus.receive_message('controller_ms_queue', self.handle_message)
+            self.message_bus.start_consuming()
+        else:
+            self.message_bus.subscribe(self.MEMBERSHIP_TOPIC, self.handle_membership)
+            self.heartbeat()
+            # Hear from the running instances before claiming any partition
+            self.message_bus.call_later(2 * self.heartbeat_interval, self.rebalance)
+            self.message_bus.start_consuming()
+            self.leave()
+        if self.position_history:
+            self.position_history.flush()
+        
+    def heartbeat(self):
+        """Announce this instance; notice the ones that stopped announcing"""
+        self.message_bus.publish(self.MEMBERSHIP_TOPIC, {'message_type': 'controller_heartbeat',
+                                                         'instance_id': self.instance_id})
+        self.partitions.observe(self.instance_id)
+        gone = self.partitions.expire(keep=self.instance_id)
+        if gone:
+            self.logger.warning(f"Controller instances gone without handoff: {', '.join(gone)}")
+        if self.assignment is not None:
+            self.rebalance()
+        self.message_bus.call_later(self.heartbeat_interval, self.heartbeat)
+        
+    def handle_membership(self, message: Dict[str, Any]):
+        """Heartbeats, departures and partition handoffs from the other instances"""
+        msg_type = message.get('message_type')
+        sender = message.get('instance_id')
+        if sender == self.instance_id:
+            return
+        if msg_type == 'controller_leaving':
+            self.partitions.forget(sender)
+            self.departing.add(sender)
+        elif msg_type == 'controller_heartbeat':
+            if not self.partitions.observe(sender):
+                return
+            self.logger.info(f"Controller instance {sender} joined")
+            
+        if msg_type == 'partition_handoff' and message.get('to') == self.instance_id:
+            self.absorb(message)
+        if self.assignment is not None:
+            self.rebalance()
+        if msg_type == 'handoff_request' and message.get('owner') == self.instance_id \
+                and message['partition'] not in self.owned:
+            # Already released (or never held): nothing to wait for
+            self.message_bus.publish(self.MEMBERSHIP_TOPIC, {
+                'message_type': 'partition_handoff', 'instance_id': self.instance_id,
+                'to': sender, 'partition': message['partition']})
+            
+    def rebalance(self):
+        """Give up partitions that moved away; claim the ones that moved here"""
+        if self.assignment is None:
+            # First time: who held each partition before this instance joined
+            self.assignment = {partition: self.partitions.owner(partition, exclude=self.instance_id)
+                               for partition in range(self.partitions.partitions)}
+        target = self.partitions.owned_by(self.instance_id)
+        for partition in sorted(self.owned - target):
+            self.release(partition, self.partitions.owner(partition))
+        now = time.monotonic()
+        for partition in list(self.awaiting):
+            if partition not in target:
+                del self.awaiting[partition]
+        for partition in sorted(target - self.owned):
+            previous = self.assignment.get(partition)
+            if partition in self.awaiting:
+                if now >= self.awaiting[partition]:
+                    del self.awaiting[partition]
+                    self.logger.warning(f"No handoff for partition {partition}; claiming it without state")
+                    self.acquire(partition)
+            elif previous and previous != self.instance_id and (previous in self.partitions.members
+                                                                 or previous in self.departing):
+                # Its current owner is alive (or leaving): consume only once it handed over
+                self.awaiting[partition] = now + self.handoff_timeout
+                self.message_bus.publish(self.MEMBERSHIP_TOPIC, {
+                    'message_type': 'handoff_request', 'instance_id': self.instance_id,
+                    'owner': previous, 'partition': partition})
+            else:
+                self.acquire(partition)
+        self.assignment = {partition: self.partitions.owner(partition)
+                           for partition in range(self.partitions.partitions)}
+        
+    def acquire(self, partition: int):
+        self.owned.add(partition)
+        for queue_name in PARTITIONED_QUEUES:
+            self.message_bus.receive_message(partition_queue(queue_name, partition), self.handle_message)
+        self.logger.info(f"Owning partition {partition} ({len(self.owned)} owned)")
+        
+    def release(self, partition: int, new_owner: Optional[str]):
+        """Stop consuming a partition and send its request state to new_owner"""
+        for queue_name in PARTITIONED_QUEUES:
+            self.message_bus.cancel(partition_queue(queue_name, partition))
+        self.owned.discard(partition)
+        ours = lambda request_id: partition_for(request_id, self.partitions.partitions) == partition
+        requests = {request_id: self.active_requests.pop(request_id)
+                    for request_id in [r for r in self.active_requests if ours(r)]}
+        inflight = [request_id for request_id in self.inflight if ours(request_id)]
+        for request_id in inflight:
+            del self.inflight[request_id]
+        queued = self.lanes.remove_if(lambda message: ours(message.get('request_id')))
+        batch = [request_id for request_id in self.pending_batch if ours(request_id)]
+        self.pending_batch = [request_id for request_id in self.pending_batch if not ours(request_id)]
+        self.logger.info(f"Handing partition {partition} to {new_owner}: {len(requests)} requests, "
+                         f"{len(queued)} queued")
+        if new_owner is not None:
+            self.message_bus.publish(self.MEMBERSHIP_TOPIC, {
+                'message_type': 'partition_handoff', 'instance_id': self.instance_id,
+                'to': new_owner, 'partition': partition, 'requests': requests,
+                'inflight': inflight, 'queued': [[lane, message] for lane, message in queued],
+                'batch': batch})
+        self.admit_requests()
+        
+    def absorb(self, message: Dict[str, Any]):
+        """Take over a partition with the request state its last owner sent"""
+        partition = message['partition']
+        self.active_requests.update(message.get('requests') or {})
+        now = time.monotonic()
+        for request_id in message.get('inflight') or []:
+            self.inflight[request_id] = now
+        for lane, queued in message.get('queued') or []:
+            self.lanes.push(lane, queued)
+        for request_id in message.get('batch') or []:
+            self.enqueue_for_batch(request_id)
+        self.awaiting.pop(partition, None)
+        if partition not in self.owned:
+            self.acquire(partition)
+        self.admit_requests()
+        
+    def leave(self):
+        """Hand every owned partition to its next owner before exiting"""
+        # Announced first, so the next owners wait for the handoffs
+        self.message_bus.publish(self.MEMBERSHIP_TOPIC, {'message_type': 'controller_leaving',
+                                                         'instance_id': self.instance_id})
+        self.partitions.forget(self.instance_id)
+        for partition in sorted(self.owned):
+            self.release(partition, self.partitions.owner(partition))
+        self.message_bus.redeliver_cancelled()
         
     def handle_message(self, message: Dict[str, Any]):
         """Handle incoming messages"""
         msg_type = message.get('message_type')
         
         if msg_type == 'delivery_request':
-            self.process_delivery_request(message)
+            self.enqueue_delivery_request(message)
         elif msg_type == 'parcel_id_generated':
             self.handle_parcel_id_generated(message)
         elif msg_type == 'car_id_assigned':
             self.handle_car_id_assigned(message)
+        elif msg_type == 'car_ids_assigned_batch':
+            self.handle_car_ids_assigned_batch(message)
+        elif msg_type == 'car_id_unavailable':
+            self.handle_car_id_unavailable(message)
         elif msg_type == 'delivery_update_request':
             self.handle_delivery_update(message)
+        elif msg_type == 'car_telemetry':
+            self.ingest_telemetry(message)
+        elif msg_type == 'position_history_request':
+            self.handle_position_history_request(message)
+        elif msg_type == 'lane_stats_request':
+            self.message_bus.send_message(message.get('reply_to', 'ui_ms_queue'), {
+                'message_type': 'lane_stats_response',
+                'request_id': message.get('request_id'),
+                'lanes': self.lanes.stats(),
+                'inflight': len(self.inflight),
+                'timestamp': datetime.now().isoformat()
+            })
         elif msg_type == 'acknowledgment':
             self.handle_acknowledgment(message)
             
+    def enqueue_delivery_request(self, message: Dict[str, Any]):
+        """Queue a new request in its priority lane and start what capacity allows"""
+        lane = message.get('priority_lane') or PriorityLanes.lane_for(message.get('priority'))
+        self.lanes.push(lane, message)
+        if not self.lane_report_scheduled:
+            self.lane_report_scheduled = True
+            self.message_bus.call_later(self.lane_report_interval, self.report_lanes)
+        self.admit_requests()
+        
+    def admit_requests(self):
+        """Start queued requests, highest weighted lane first, while under max_inflight"""
+        now = time.monotonic()
+        for request_id, started in list(self.inflight.items()):
+            if now - started > self.inflight_timeout:
+                # Never got a car (e.g. Car_MS unreachable): free the slot
+                del self.inflight[request_id]
+                self.active_requests.pop(request_id, None)
+                self.log_action('delivery_request_timed_out', {'request_id': request_id})
+        while not self.max_inflight or len(self.inflight) < self.max_inflight:
+            entry = self.lanes.pop()
+            if entry is None:
+                break
+            lane, message, waited = entry
+            message['priority_lane'] = lane
+            message['queued_ms'] = round(waited * 1000, 1)
+            self.inflight[message.get('request_id')] = now
+            self.process_delivery_request(message)
+            
+    def finish_request(self, request_id: str):
+        """A request left the assignment pipeline: let the next one in"""
+        self.active_requests.pop(request_id, None)
+        if self.inflight.pop(request_id, None) is not None:
+            self.admit_requests()
+            
+    def report_lanes(self):
+        """Send per-lane depth and queueing delay to Log_MS"""
+        self.lane_report_scheduled = False
+        self.log_action('priority_lane_stats', {'lanes': self.lanes.stats(), 'inflight': len(self.inflight)})
+        if len(self.lanes) or self.inflight:
+            self.lane_report_scheduled = True
+            self.message_bus.call_later(self.lane_report_interval, self.report_lanes)
+            
     def process_delivery_request(self, message: Dict[str, Any]):
         """Process new delivery request"""
         request_id = message.get('request_id')
@@ -264,37 +2521,158 @@ class Controller_MS:
         request_id = message.get('request_id')
         parcel_id = message.get('parcel_id')
         
-        if request_id in self.active_requests:
-            self.active_requests[request_id]['parcel_id'] = parcel_id
-            
+        if request_id not in self.active_requests:
+            self.logger.warning(f"Parcel ID for unknown request {request_id} (owner lost its state?)")
+            return
+        self.active_requests[request_id]['parcel_id'] = parcel_id
+        
         self.log_action('parcel_id_generated', message)
         
-        # Request car ID from Car_MS
+        if self.batch_window > 0:
+            self.enqueue_for_batch(request_id)
+            return
+        
+        self.request_car_id(request_id)
+        
+    def request_car_id(self, request_id: str):
+        """Ask Car_MS for a car for one request"""
+        request_data = self.active_requests.get(request_id)
+        if request_data is None:
+            return
         car_request = {
             'message_type': 'request_car_id',
             'request_id': request_id,
-            'parcel_id': parcel_id,
-            'pickup_address': self.active_requests[request_id]['pickup_address'],
-            'delivery_address': self.active_requests[request_id]['delivery_address'],
+            'parcel_id': request_data['parcel_id'],
+            'pickup_address': request_data['pickup_address'],
+            'delivery_address': request_data['delivery_address'],
+            'priority_lane': request_data.get('priority_lane', 'NORMAL'),
             'timestamp': datetime.now().isoformat()
         }
         
-        self.logger.info(f"Requesting car ID for parcel {parcel_id}")
+        self.logger.info(f"Requesting car ID for parcel {request_data['parcel_id']}")
         self.message_bus.send_message('car_ms_queue', car_request)
         
+    def handle_car_id_unavailable(self, message: Dict[str, Any]):
+        """No car was free for a request: ask again later, or give up on it"""
+        request_id = message.get('request_id')
+        request_data = self.active_requests.get(request_id)
+        if request_data is None:
+            self.logger.warning(f"No car for unknown request {request_id} (owner lost its state?)")
+            return
+        request_data['assignment_attempts'] = request_data.get('assignment_attempts', 0) + 1
+        if request_data['assignment_attempts'] < self.MAX_ASSIGNMENT_ATTEMPTS:
+            self.message_bus.call_later(self.ASSIGNMENT_RETRY_DELAY, lambda: self.request_car_id(request_id))
+        else:
+            self.log_action('car_assignment_failed', {'request_id': request_id,
+                                                      'parcel_id': request_data.get('parcel_id')})
+            self.finish_request(request_id)
+            
     def handle_car_id_assigned(self, message: Dict[str, Any]):
         """Handle car ID assignment confirmation"""
         request_id = message.get('request_id')
         car_id = message.get('car_id')
         
-        if request_id in self.active_requests:
-            self.active_requests[request_id]['car_id'] = car_id
-            
+        if request_id not in self.active_requests:
+            self.logger.warning(f"Car ID for unknown request {request_id} (owner lost its state?)")
+            return
+        self.active_requests[request_id]['car_id'] = car_id
+        self.active_requests[request_id]['car_queue'] = message.get('reply_to')
+        
         self.log_action('car_id_assigned', message)
         
         # Get parcel ID from Storage
         self.request_delivery_info(request_id)
         
+    def enqueue_for_batch(self, request_id: str):
+        """Hold a parcel for the current assignment window"""
+        self.pending_batch.append(request_id)
+        if len(self.pending_batch) >= self.max_batch:
+            self.flush_batch()
+        elif not self.batch_scheduled:
+            self.batch_scheduled = True
+            self.message_bus.call_later(self.batch_window, self.flush_batch)
+            
+    def flush_batch(self):
+        """Send every pending parcel to Car_MS in one batch request"""
+        self.batch_scheduled = False
+        if not self.pending_batch:
+            return
+        request_ids, self.pending_batch = self.pending_batch, []
+        if self.partitions.partitions <= 1:
+            self.send_batch(request_ids)
+            return
+        # The reply is routed by its routing_key, so a batch only holds
+        # requests of one partition
+        groups = {}
+        for request_id in request_ids:
+            groups.setdefault(partition_for(request_id, self.partitions.partitions), []).append(request_id)
+        for group in groups.values():
+            self.send_batch(group)
+            
+    def send_batch(self, request_ids: List[str]):
+        parcels = []
+        for request_id in request_ids:
+            request_data = self.active_requests[request_id]
+            parcels.append({
+                'request_id': request_id,
+                'parcel_id': request_data['parcel_id'],
+                'pickup_address': request_data['pickup_address'],
+                'delivery_address': request_data['delivery_address'],
+                'priority_lane': request_data.get('priority_lane', 'NORMAL')
+            })
+        batch_request = {
+            'message_type': 'request_car_ids_batch',
+            'batch_id': str(uuid.uuid4()),
+            'routing_key': request_ids[0],
+            'parcels': parcels,
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        self.logger.info(f"Requesting car IDs for a batch of {len(parcels)} parcels")
+        self.message_bus.send_message('car_ms_queue', batch_request)
+        
+    def handle_car_ids_assigned_batch(self, message: Dict[str, Any]):
+        """Handle the assignments for a whole batch"""
+        self.log_action('car_ids_assigned_batch', {
+            'batch_id': message.get('batch_id'),
+            'assigned': len(message.get('assignments', [])),
+            'unassigned': len(message.get('unassigned', []))
+        })
+        for assignment in message.get('assignments', []):
+            request_id = assignment['request_id']
+            if request_id in self.active_requests:
+                self.active_requests[request_id]['car_id'] = assignment['car_id']
+                self.active_requests[request_id]['car_queue'] = message.get('reply_to')
+                self.request_delivery_info(request_id)
+        
+        # No car could take these in this window: retry in the next one
+        for request_id in message.get('unassigned', []):
+            request_data = self.active_requests.get(request_id)
+            if request_data is None:
+                continue
+            request_data['assignment_attempts'] = request_data.get('assignment_attempts', 0) + 1
+            if request_data['assignment_attempts'] < self.MAX_ASSIGNMENT_ATTEMPTS:
+                self.enqueue_for_batch(request_id)
+            else:
+                self.log_action('car_assignment_failed', {'request_id': request_id,
+                                                          'parcel_id': request_data.get('parcel_id')})
+                self.finish_request(request_id)
+        
+    def handle_position_history_request(self, message: Dict[str, Any]):
+        """Answer a route query for one car and time window (epoch ms)"""
+        samples = []
+        if self.position_history:
+            samples = self.position_history.query(message.get('car_id'), int(message.get('start_ms', 0)),
+                                                  int(message.get('end_ms', 2 ** 62)))
+        response = {
+            'message_type': 'position_history_response',
+            'request_id': message.get('request_id'),
+            'car_id': message.get('car_id'),
+            'samples': [[int(t), float(lat), float(lon)] for t, lat, lon in samples.tolist()] if len(samples) else [],
+            'timestamp': datetime.now().isoformat()
+        }
+        self.message_bus.send_message(message.get('reply_to', 'ui_ms_queue'), response)
+        
     def request_delivery_info(self, request_id: str):
         """Request parcel and car IDs from Storage and assign delivery"""
         request_data = self.active_requests[request_id]
@@ -321,13 +2699,15 @@ class Controller_MS:
         self.log_action('delivery_assigned', delivery_data)
         
         # Notify Car_MS
-        self.notify_car(car_id, parcel_id, request_id)
+        self.notify_car(car_id, parcel_id, request_id, request_data.get('car_queue'))
         
         # Notify UI_MS
         self.notify_ui(request_id, parcel_id, car_id)
         
-    def notify_car(self, car_id: str, parcel_id: str, request_id: str):
-        """Notify Car_MS about delivery assignment"""
+        self.finish_request(request_id)
+        
+    def notify_car(self, car_id: str, parcel_id: str, request_id: str, reply_to: str = None):
+        """Notify the assigned car (or the Car_MS that dispatched it) about the delivery"""
         notification = {
             'message_type': 'delivery_notification',
             'car_id': car_id,
@@ -337,7 +2717,7 @@ class Controller_MS:
         }
         
         self.logger.info(f"Notifying Car {car_id} about delivery")
-        self.message_bus.send_message('car_ms_queue', notification)
+        self.message_bus.send_message(reply_to or car_queue(car_id), notification)
         
     def notify_ui(self, request_id: str, parcel_id: str, car_id: str):
         """Notify UI_MS about delivery assignment"""
@@ -362,7 +2742,7 @@ class Controller_MS:
             'request_id': message.get('request_id'),
             'timestamp': datetime.now().isoformat()
         }
-        self.message_bus.send_message('car_ms_queue', ack_message)
+        self.message_bus.send_message(message.get('reply_to') or car_queue(message.get('car_id')), ack_message)
         
         # Share delivery update with Storage_MS
         update_message = {
@@ -385,6 +2765,51 @@ class Controller_MS:
         }
         self.message_bus.send_message('ui_ms_queue', ui_notification)
         
+    def ingest_telemetry(self, message: Dict[str, Any]):
+        """Buffer a telemetry sample; the window flush does the fan-out"""
+        self.telemetry.add(message)
+        if self.position_history and message.get('lat') is not None and message.get('lon') is not None:
+            # A malformed sample is dropped from the history; it must not fail the batch
+            try:
+                timestamp = datetime.fromisoformat(message['timestamp']) if message.get('timestamp') else datetime.now()
+                self.position_history.append(message.get('car_id'), int(timestamp.timestamp() * 1000),
+                                             message['lat'], message['lon'])
+            except (ValueError, TypeError) as e:
+                self.logger.warning(f"Telemetry from {message.get('car_id')!r} not recorded: {e}")
+        if not self.telemetry_scheduled:
+            self.telemetry_scheduled = True
+            self.message_bus.call_later(self.telemetry_window, self.flush_telemetry)
+            
+    def flush_telemetry(self):
+        """Fan out the coalesced telemetry of one window"""
+        self.telemetry_scheduled = False
+        positions, changes, received = self.telemetry.drain()
+        
+        if positions:
+            self.message_bus.send_message('car_ms_queue', {
+                'message_type': 'car_positions_batch',
+                'positions': positions,
+                'timestamp': datetime.now().isoformat()
+            })
+            
+        if changes:
+            self.message_bus.send_message('storage_ms_queue', {
+                'message_type': 'update_deliveries',
+                'updates': [{'parcel_id': c['parcel_id'], 'status': c['status']} for c in changes],
+                'timestamp': datetime.now().isoformat()
+            })
+            self.message_bus.send_message('ui_ms_queue', {
+                'message_type': 'delivery_status_changes',
+                'changes': changes,
+                'timestamp': datetime.now().isoformat()
+            })
+            
+        self.log_action('telemetry_flushed', {
+            'samples': received,
+            'positions': len(positions),
+            'status_changes': len(changes)
+        })
+        
     def handle_acknowledgment(self, message: Dict[str, Any]):
         """Handle acknowledgments from other services"""
         self.log_action('acknowledgment_received', message)
@@ -409,7 +2834,6 @@ class Controller_MS:
 # ============================================================================
 
 # idgen_ms/idgen_service.py
-import hashlib
 from datetime import datetime
 
 class IDGen_MS:
@@ -418,7 +2842,7 @@ class IDGen_MS:
     def __init__(self, message_bus: MessageBus):
         self.message_bus = message_bus
         self.logger = logging.getLogger('IDGen_MS')
-        self.counter = 0
+        self.id_generator = SortableIdGenerator()
         
     def start(self):
         """Start listening for ID generation requests"""
@@ -434,12 +2858,8 @@ class IDGen_MS:
             self.store_parcel_id(parcel_id, message)
             
     def generate_parcel_id(self, request_id: str) -> str:
-        """Generate a unique parcel ID"""
-        self.counter += 1
-        timestamp = datetime.now().isoformat()
-        data = f"{request_id}-{timestamp}-{self.counter}"
-        hash_object = hashlib.sha256(data.encode())
-        parcel_id = f"PKG-{hash_object.hexdigest()[:12].upper()}"
+        """Generate a unique, time-ordered parcel ID"""
+        parcel_id = self.id_generator.next_id()
         
         self.logger.info(f"Generated parcel ID: {parcel_id}")
         return parcel_id
@@ -543,7 +2963,7 @@ class SenderMS:
         
     def request_delivery(self, sender_name: str, recipient_name: str, 
                         pickup_address: str, delivery_address: str, 
-                        package_description: str):
+                        package_description: str, priority: str = 'NORMAL'):
         """Request a delivery through UI_MS"""
         request_id = str(uuid.uuid4())
         
@@ -555,7 +2975,8 @@ class SenderMS:
             'recipient_name': recipient_name,
             'pickup_address': pickup_address,
             'delivery_address': delivery_address,
-            'package_description': package_description
+            'package_description': package_description,
+            'priority': priority
         }
         
         self.logger.info(f"Sending delivery request: {request_id}")
@@ -650,6 +3071,8 @@ class Storage_MS:
             self.store_parcel_id(message)
         elif msg_type == 'store_car_id':
             self.store_car_id(message)
+        elif msg_type == 'store_car_ids':
+            self.store_car_ids(message)
         elif msg_type == 'get_parcel_id':
             self.get_parcel_id(message)
         elif msg_type == 'get_car_id':
@@ -658,6 +3081,8 @@ class Storage_MS:
             self.store_delivery(message)
         elif msg_type == 'update_delivery':
             self.update_delivery(message)
+        elif msg_type == 'update_deliveries':
+            self.update_deliveries(message)
             
     def store_parcel_id(self, message: Dict[str, Any]):
         """Store parcel ID in Database_2"""
@@ -696,7 +3121,25 @@ class Storage_MS:
             'car_id': car_id,
             'timestamp': datetime.now().isoformat()
         }
-        self.message_bus.send_message('car_ms_queue', ack_message)
+        self.message_bus.send_message(message.get('reply_to') or car_queue(car_id), ack_message)
+        
+    def store_car_ids(self, message: Dict[str, Any]):
+        """Store a batch of car assignments in Database_2 in one transaction"""
+        assignments = message.get('assignments', [])
+        
+        self.db2.executemany(
+            'UPDATE assignments SET car_id = ? WHERE parcel_id = ?',
+            [(a['car_id'], a['parcel_id']) for a in assignments]
+        )
+        
+        self.logger.info(f"Stored {len(assignments)} car IDs in Database_2")
+        
+        ack_message = {
+            'message_type': 'storage_acknowledgment',
+            'count': len(assignments),
+            'timestamp': datetime.now().isoformat()
+        }
+        self.message_bus.send_message(message.get('reply_to', 'car_ms_queue'), ack_message)
         
     def get_parcel_id(self, message: Dict[str, Any]):
         """Retrieve parcel ID and send to Controller"""
@@ -780,6 +3223,25 @@ class Storage_MS:
             'timestamp': datetime.now().isoformat()
         }
         self.message_bus.send_message('controller_ms_queue', ack_message)
+        
+    def update_deliveries(self, message: Dict[str, Any]):
+        """Apply a batch of delivery status updates in Database_1 in one transaction"""
+        updates = message.get('updates', [])
+        now = datetime.now().isoformat()
+        
+        self.db1.executemany(
+            'UPDATE parcels SET status = ?, updated_at = ? WHERE parcel_id = ?',
+            [(u['status'], now, u['parcel_id']) for u in updates]
+        )
+        
+        self.logger.info(f"Updated delivery status for {len(updates)} parcels")
+        
+        ack_message = {
+            'message_type': 'storage_acknowledgment',
+            'count': len(updates),
+            'timestamp': datetime.now().isoformat()
+        }
+        self.message_bus.send_message('controller_ms_queue', ack_message)
 
 
 
@@ -806,15 +3268,18 @@ class UI_MS:
         
         if msg_type == 'delivery_request':
             self.forward_to_controller(message)
-        elif msg_type == 'delivery_notification':
+        elif msg_type in ('delivery_notification', 'delivery_status_changes'):
             self.notify_sender(message)
         elif msg_type == 'acknowledgment':
             self.forward_ack_to_controller(message)
             
     def forward_to_controller(self, message: Dict[str, Any]):
-        """Forward delivery request to Controller_MS"""
-        self.logger.info(f"Forwarding delivery request {message.get('request_id')} to Controller")
-        self.message_bus.send_message('controller_ms_queue', message)
+        """Forward delivery request to Controller_MS's priority intake queue"""
+        lane = PriorityLanes.lane_for(message.get('priority'))
+        message['priority_lane'] = lane
+        self.logger.info(f"Forwarding {lane} delivery request {message.get('request_id')} to Controller")
+        self.message_bus.send_message('controller_ms_intake', message,
+                                      priority=PriorityLanes.BROKER_PRIORITY[lane])
         
     def notify_sender(self, message: Dict[str, Any]):
         """Notify sender about delivery status"""
@@ -842,8 +3307,9 @@ def run_sender():
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
-    # Connect to message bus (RabbitMQ should be accessible from both locations)
-    message_bus = MessageBus(host='SERVER_1_IP_ADDRESS', port=5672)
+    # Connect to message bus (RabbitMQ should be accessible from both locations,
+    # unless Server_1 runs the http or socket transport)
+    message_bus = create_bus(SERVER_TRANSPORT, host='SERVER_1_IP_ADDRESS', port=5672)
     message_bus.connect()
     
     sender = SenderMS(message_bus)
@@ -877,7 +3343,7 @@ def run_car():
     )
     
     # Connect to message bus
-    message_bus = MessageBus(host='SERVER_1_IP_ADDRESS', port=5672)
+    message_bus = create_bus(SERVER_TRANSPORT, host='SERVER_1_IP_ADDRESS', port=5672)
     message_bus.connect()
     
     car = Car_MS(message_bus, car_id="CAR-1001")
@@ -898,23 +3364,29 @@ Run this on Ubuntu/Server_1 for all internal microservices
 """
 import threading
 
+# Sealed position history chunks go here; set it empty to keep no history
+POSITION_HISTORY_DIR = os.environ.get('POSITION_HISTORY_DIR', 'position_history')
+
 def run_server():
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
-    # Create separate message bus connections for each service
-    ui_bus = MessageBus(host='localhost', port=5672)
-    idgen_bus = MessageBus(host='localhost', port=5672)
-    controller_bus = MessageBus(host='localhost', port=5672)
-    storage_bus = MessageBus(host='localhost', port=5672)
-    log_bus = MessageBus(host='localhost', port=5672)
+    # One bus per service; with the in-process transport, services in this
+    # process call each other directly and only laptop traffic uses RabbitMQ
+    hub = InProcessHub(expected=CO_LOCATED_QUEUES)
+    ui_bus = create_server_bus(hub)
+    idgen_bus = create_server_bus(hub)
+    controller_bus = create_server_bus(hub)
+    storage_bus = create_server_bus(hub)
+    log_bus = create_server_bus(hub)
     
     # Initialize all internal microservices
     ui_ms = UI_MS(ui_bus)
     idgen_ms = IDGen_MS(idgen_bus)
-    controller_ms = Controller_MS(controller_bus)
+    position_history = PositionHistory(POSITION_HISTORY_DIR) if POSITION_HISTORY_DIR else None
+    controller_ms = Controller_MS(controller_bus, max_inflight=200, position_history=position_history)
     storage_ms = Storage_MS(storage_bus)
     log_ms = Log_MS(log_bus)
     
@@ -948,9 +3420,196 @@ def run_server():
             thread.join()
     except KeyboardInterrupt:
         print("\nShutting down all services...")
+        if position_history:
+            position_history.flush()
         sys.exit(0)
 
 
+# run_supervisor.py
+"""
+Run this on Ubuntu/Server_1 instead of run_server to give each internal
+service its own worker processes, so they stop sharing one GIL
+"""
+import multiprocessing
+import signal
+
+SERVICE_FACTORIES = {
+    'UI_MS': UI_MS,
+    'IDGen_MS': IDGen_MS,
+    'Controller_MS': lambda bus: Controller_MS(bus, max_inflight=200),
+    'Storage_MS': Storage_MS,
+    'Log_MS': Log_MS
+}
+SERVICE_QUEUES = {
+    'UI_MS': ['ui_ms_queue'],
+    'IDGen_MS': ['idgen_ms_queue'],
+    'Controller_MS': ['controller_ms_intake', 'controller_ms_queue'],
+    'Storage_MS': ['storage_ms_queue'],
+    'Log_MS': ['log_ms_queue']
+}
+
+# Worker processes per service, and optional CPU pinning hints: a CPU or an
+# inclusive range per service, whose workers take those CPUs in turn
+SERVICE_WORKERS = dict(item.split('=', 1) for item in os.environ.get(
+    'SERVICE_WORKERS', 'UI_MS=2,IDGen_MS=2,Controller_MS=1,Storage_MS=1,Log_MS=2').split(','))
+SERVICE_CPUS = dict(item.split('=', 1) for item in os.environ.get('SERVICE_CPUS', '').split(',') if item)
+
+class Supervisor:
+    """
+    Pre-forking process supervisor for the Server_1 services.
+    
+    With the http and socket transports every listening socket is bound
+    before forking, so a service's workers share one accept queue and
+    peers reach them all through TRANSPORT_FANOUT connections. With
+    RabbitMQ the workers are competing consumers on the service's queues.
+    The in-process transport cannot span processes; it is replaced by
+    RabbitMQ here, which is what laptop peers use with it anyway.
+    
+    Controller_MS keeps per-request state in memory, so several of its
+    workers need CONTROLLER_PARTITIONS > 1 (and RabbitMQ): each then owns
+    a share of the request partitions. Storage_MS relies on store_parcel_id
+    arriving before store_car_id for a parcel, so it defaults to one
+    worker; UI_MS, IDGen_MS and Log_MS scale out freely.
+    
+    A worker that exits is restarted with exponential backoff. stop() asks
+    every worker to stop taking work, drain its inbox and exit, and kills
+    whatever is still running after `grace` seconds.
+    """
+    
+    RESTART_BACKOFF_MAX = 30.0
+    STABLE_AFTER = 60.0  # seconds a worker must run before its backoff resets
+    # Intake first, sinks last, so draining workers still reach their peers
+    STOP_ORDER = ['UI_MS', 'Controller_MS', 'IDGen_MS', 'Storage_MS', 'Log_MS']
+    
+    def __init__(self, workers: Dict[str, int], cpus: Dict[str, str] = None, transport: str = None,
+                 grace: float = 10.0):
+        unknown = set(workers) - set(SERVICE_FACTORIES)
+        if unknown:
+            raise ValueError(f"Unknown services: {', '.join(sorted(unknown))}")
+        self.workers = {name: int(count) for name, count in workers.items() if int(count) > 0}
+        self.cpus = {name: self.parse_cpus(spec) for name, spec in (cpus or {}).items()}
+        self.transport = transport or (SERVER_TRANSPORT if SERVER_TRANSPORT in ('http', 'socket') else 'rabbitmq')
+        if self.workers.get('Controller_MS', 0) > 1 and (CONTROLLER_PARTITIONS < 2 or self.transport != 'rabbitmq'):
+            raise ValueError("Several Controller_MS workers need CONTROLLER_PARTITIONS > 1 and RabbitMQ")
+        if 'Controller_MS' in self.workers:
+            check_partitioned_transport(self.transport)
+        self.fanout = max(self.workers.values())
+        self.grace = grace
+        self.context = multiprocessing.get_context('fork')
+        self.listeners = {}   # address -> socket bound before fork
+        self.processes = {}   # (service, index) -> Process
+        self.started_at = {}
+        self.failures = {}
+        self.restart_at = {}
+        self.stopping = threading.Event()
+        self.logger = logging.getLogger('Supervisor')
+        
+    @staticmethod
+    def parse_cpus(spec: str) -> List[int]:
+        first, _, last = spec.partition('-')
+        return list(range(int(first), int(last or first) + 1))
+    
+    def start(self):
+        """Bind shared listeners, then fork every worker"""
+        if self.transport in ('http', 'socket'):
+            for name in self.workers:
+                for queue_name in SERVICE_QUEUES[name]:
+                    address = TRANSPORT_ROUTES[queue_name]
+                    if address not in self.listeners:
+                        self.listeners[address] = bind_listener(address)
+        for name, count in self.workers.items():
+            for index in range(count):
+                self.spawn(name, index)
+                
+    def spawn(self, name: str, index: int):
+        process = self.context.Process(target=self.run_worker, args=(name, index), name=f'{name}-{index}')
+        process.start()
+        self.processes[(name, index)] = process
+        self.started_at[(name, index)] = time.monotonic()
+        self.logger.info(f"Started {process.name} (pid {process.pid})")
+        
+    def run_worker(self, name: str, index: int):
+        """Body of one worker process"""
+        # Ctrl+C reaches the whole process group; only the supervisor acts on it
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        cpus = self.cpus.get(name)
+        if cpus and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+        if name == 'IDGen_MS':
+            # Two workers with one node ID could mint the same parcel ID
+            os.environ['IDGEN_NODE_ID'] = str(int(os.environ.get('IDGEN_NODE_ID', '0')) + index)
+        # Fork handed us every service's listener; holding another service's
+        # open would keep accepting (and never serving) its connections
+        own = {TRANSPORT_ROUTES[queue_name] for queue_name in SERVICE_QUEUES[name]}
+        for address, server_socket in self.listeners.items():
+            if address not in own:
+                server_socket.close()
+        listeners = {address: self.listeners[address] for address in own if address in self.listeners}
+        bus = create_bus(self.transport, fanout=self.fanout, listeners=listeners)
+        signal.signal(signal.SIGTERM, lambda signum, frame: bus.stop_consuming(self.grace / 2))
+        SERVICE_FACTORIES[name](bus).start()
+        bus.close()
+        
+    def supervise(self):
+        """Restart workers that exit until stop is requested"""
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            for key, process in self.processes.items():
+                if process.is_alive() or key in self.restart_at:
+                    continue
+                quick = now - self.started_at[key] < self.STABLE_AFTER
+                self.failures[key] = self.failures.get(key, 0) + 1 if quick else 0
+                delay = min(self.RESTART_BACKOFF_MAX, 0.5 * 2 ** self.failures[key])
+                self.logger.warning(f"{process.name} exited with code {process.exitcode}; "
+                                    f"restarting in {delay:.1f}s")
+                self.restart_at[key] = now + delay
+            for key, due in list(self.restart_at.items()):
+                if due <= now:
+                    del self.restart_at[key]
+                    self.spawn(*key)
+            self.stopping.wait(0.5)
+            
+    def stop(self):
+        """SIGTERM workers service by service (drain and exit); kill stragglers after grace"""
+        self.stopping.set()
+        # Drop our copies of the shared listeners first: once a service's
+        # workers close theirs, sends to it are refused instead of hanging
+        # in an accept queue nobody serves
+        for server_socket in self.listeners.values():
+            server_socket.close()
+        deadline = time.monotonic() + self.grace
+        for name in self.STOP_ORDER:
+            workers = [process for (service, _), process in self.processes.items() if service == name]
+            for process in workers:
+                if process.is_alive():
+                    process.terminate()
+            for process in workers:
+                process.join(max(0.0, deadline - time.monotonic()))
+        for process in self.processes.values():
+            if process.is_alive():
+                self.logger.warning(f"{process.name} still running after {self.grace}s; killing it")
+                process.kill()
+                process.join()
+            
+def run_supervisor():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    supervisor = Supervisor(SERVICE_WORKERS, SERVICE_CPUS)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: supervisor.stopping.set())
+    supervisor.start()
+    
+    print(f"\nSupervising {sum(supervisor.workers.values())} workers over {supervisor.transport}: "
+          + ", ".join(f"{name} x{count}" for name, count in supervisor.workers.items()))
+    print("Press Ctrl+C to stop\n")
+    
+    supervisor.supervise()
+    print("\nShutting down all services...")
+    supervisor.stop()
+
 
 # ============================================================================
 # TESTING SCRIPT
@@ -1047,6 +3706,363 @@ def test_full_workflow():
     print("=" * 70)
 
 
+# ============================================================================
+# BENCHMARKS
+# ============================================================================
+
+# benchmarks/bench_ids.py
+"""
+Parcel ID benchmark: generation rate and primary-key insert locality of the
+sortable generator against the ID schemes currently used across the system
+"""
+import hashlib
+import tempfile
+
+def legacy_uuid_ids(count: int) -> List[str]:
+    """Random 8-hex-digit IDs, as generated by the HTTP variants"""
+    return [f"PKG-{uuid.uuid4().hex[:8].upper()}" for _ in range(count)]
+
+def legacy_sha256_ids(count: int) -> List[str]:
+    """Truncated sha256 IDs, as previously generated by IDGen_MS"""
+    ids = []
+    for counter in range(1, count + 1):
+        data = f"REQ-{counter}-{datetime.now().isoformat()}-{counter}"
+        ids.append(f"PKG-{hashlib.sha256(data.encode()).hexdigest()[:12].upper()}")
+    return ids
+
+def sortable_ids(count: int) -> List[str]:
+    generator = SortableIdGenerator(node_id=1)
+    return [generator.next_id() for _ in range(count)]
+
+def measure_insert_locality(ids: List[str]) -> Dict[str, Any]:
+    """
+    Insert IDs into a parcels-style primary key and report how B-tree friendly
+    the sequence is: the share of inserts that append at the right edge of the
+    index, the resulting page count, and elapsed time
+    """
+    appends = 0
+    highest = ""
+    for parcel_id in ids:
+        if parcel_id > highest:
+            appends += 1
+            highest = parcel_id
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        db.execute("CREATE TABLE parcels (parcel_id TEXT PRIMARY KEY, payload TEXT) WITHOUT ROWID")
+        start = time.perf_counter()
+        cursor = db.connection.cursor()
+        for offset in range(0, len(ids), 1000):
+            cursor.executemany(
+                "INSERT OR IGNORE INTO parcels VALUES (?, ?)",
+                [(parcel_id, "x" * 64) for parcel_id in ids[offset:offset + 1000]]
+            )
+            db.connection.commit()
+        elapsed = time.perf_counter() - start
+        stored = db.fetchone("SELECT COUNT(*) AS n FROM parcels")['n']
+        pages = db.fetchone("PRAGMA page_count")['page_count']
+        db.close()
+    return {
+        'append_ratio': appends / len(ids),
+        'pages': pages,
+        'insert_seconds': elapsed,
+        'collisions': len(ids) - stored,
+    }
+
+def measure_concurrent_generation(threads: int, per_thread: int) -> Dict[str, Any]:
+    """Generate from one shared generator on several threads and check uniqueness"""
+    generator = SortableIdGenerator(node_id=2)
+    results = [[] for _ in range(threads)]
+
+    def worker(bucket):
+        for _ in range(per_thread):
+            bucket.append(generator.next_int())
+
+    workers = [threading.Thread(target=worker, args=(results[i],)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - start
+    total = threads * per_thread
+    unique = len(set(value for bucket in results for value in bucket))
+    return {'ids_per_second': total / elapsed, 'duplicates': total - unique}
+
+def run_id_benchmark(count: int = 200000):
+    """Print generation rate and insert locality for each ID scheme"""
+    print("=" * 70)
+    print(f"PARCEL ID BENCHMARK ({count} ids per scheme)")
+    print("=" * 70)
+    schemes = [
+        ("uuid4 hex[:8]", legacy_uuid_ids),
+        ("sha256[:12]", legacy_sha256_ids),
+        ("sortable", sortable_ids),
+    ]
+    print(f"{'scheme':<16}{'ids/s':>12}{'append %':>10}{'pages':>8}{'insert s':>10}{'collisions':>12}")
+    for name, generate in schemes:
+        start = time.perf_counter()
+        ids = generate(count)
+        rate = count / (time.perf_counter() - start)
+        locality = measure_insert_locality(ids)
+        print(f"{name:<16}{rate:>12,.0f}{locality['append_ratio'] * 100:>9.1f}%"
+              f"{locality['pages']:>8}{locality['insert_seconds']:>10.2f}{locality['collisions']:>12}")
+    concurrent = measure_concurrent_generation(threads=8, per_thread=count // 8)
+    print(f"\nsortable, 8 threads: {concurrent['ids_per_second']:,.0f} ids/s, "
+          f"{concurrent['duplicates']} duplicates")
+    print("=" * 70)
+
+
+# benchmarks/bench_spatial.py
+"""
+Nearest-car benchmark: grid index query time against a linear scan
+"""
+
+def run_spatial_benchmark(fleet_sizes=(1000, 10000, 100000), queries: int = 1000):
+    """Print per-query latency of SpatialGridIndex.nearest vs a linear scan"""
+    print("=" * 70)
+    print(f"NEAREST CAR BENCHMARK ({queries} queries per fleet size)")
+    print("=" * 70)
+    # Cars spread over a ~50 km square around a city centre
+    center_lat, center_lon, spread = 24.7136, 46.6753, 0.25
+    rng = random.Random(42)
+    print(f"{'cars':>8}{'grid ms':>12}{'scan ms':>12}{'speedup':>10}{'mismatches':>12}")
+    for size in fleet_sizes:
+        index = SpatialGridIndex(cell_km=1.0, ref_lat=center_lat)
+        for i in range(size):
+            index.update(f"CAR-{i}", center_lat + rng.uniform(-spread, spread),
+                         center_lon + rng.uniform(-spread, spread), available=rng.random() < 0.8)
+        points = [(center_lat + rng.uniform(-spread, spread), center_lon + rng.uniform(-spread, spread))
+                  for _ in range(queries)]
+        start = time.perf_counter()
+        grid = [index.nearest(lat, lon) for lat, lon in points]
+        grid_ms = (time.perf_counter() - start) * 1000 / queries
+        scan_queries = points[:max(10, queries // (size // 1000 or 1))]
+        start = time.perf_counter()
+        scan = [index.nearest_linear(lat, lon) for lat, lon in scan_queries]
+        scan_ms = (time.perf_counter() - start) * 1000 / len(scan_queries)
+        mismatches = sum(1 for a, b in zip(grid, scan) if a != b)
+        print(f"{size:>8}{grid_ms:>12.4f}{scan_ms:>12.4f}{scan_ms / grid_ms:>9.0f}x{mismatches:>12}")
+    print("=" * 70)
+
+
+# benchmarks/bench_batch.py
+"""
+Batch assignment benchmark: BatchAssigner runtime and assignment quality
+"""
+
+def run_batch_benchmark(cases=((1000, 1000), (1000, 10000), (5000, 10000), (5000, 100000))):
+    """Print assignment time and mean pickup distance per window size"""
+    print("=" * 70)
+    print("BATCH ASSIGNMENT BENCHMARK")
+    print("=" * 70)
+    rng = np.random.default_rng(42)
+    assigner = BatchAssigner(time_budget=5.0)
+    print(f"{'parcels':>8}{'cars':>8}{'seconds':>10}{'assigned':>10}{'mean km':>10}")
+    for parcel_count, car_count in cases:
+        parcel_xy = rng.uniform(0, 50, size=(parcel_count, 2))
+        car_xy = rng.uniform(0, 50, size=(car_count, 2))
+        load = rng.integers(0, 2, size=car_count)
+        start = time.perf_counter()
+        choice = assigner.assign(parcel_xy, car_xy, load, np.full(car_count, 3))
+        elapsed = time.perf_counter() - start
+        assigned = choice >= 0
+        distance = np.hypot(*(parcel_xy[assigned] - car_xy[choice[assigned]]).T).mean()
+        print(f"{parcel_count:>8}{car_count:>8}{elapsed:>10.3f}{assigned.sum():>10}{distance:>10.2f}")
+    print("=" * 70)
+
+
+# benchmarks/bench_shm.py
+"""
+Cross-process IPC benchmark: shared-memory ring vs Unix socket pair, moving
+the same small log messages from a producer to a forked consumer process
+"""
+import multiprocessing
+import socket
+
+def _sample_log(i: int) -> Dict[str, Any]:
+    return {'message_type': 'store_log', 'service_name': 'Controller_MS', 'action': 'delivery_assigned',
+            'request_id': f'req-{i}', 'timestamp': '2025-01-01T00:00:00'}
+
+def _ring_consumer(ring_name: str, eventfds: tuple, count: int, decode: bool, done):
+    ring = ShmRing(ring_name, eventfds=eventfds)
+    received = 0
+    while received < count:
+        batch = ring.get_many(timeout=1.0)
+        if decode:
+            for payload in batch:
+                marshal.loads(payload)
+        received += len(batch)
+    done.put(received)
+    ring.close()
+    
+def _socket_consumer(sock, count: int, decode: bool, done):
+    received, pending = 0, b''
+    while received < count:
+        pending += sock.recv(1 << 20)
+        offset = 0
+        while len(pending) - offset >= 4:
+            size = struct.unpack_from('<I', pending, offset)[0]
+            if len(pending) - offset - 4 < size:
+                break
+            if decode:
+                marshal.loads(pending[offset + 4:offset + 4 + size])
+            offset += 4 + size
+            received += 1
+        pending = pending[offset:]
+    done.put(received)
+    
+def run_shm_benchmark(count: int = 1000000, batch: int = 256):
+    """Print messages/second for each channel, with and without decoding"""
+    print("=" * 70)
+    print("SHARED-MEMORY RING BENCHMARK")
+    print("=" * 70)
+    ctx = multiprocessing.get_context('fork')
+    payloads = [marshal.dumps(_sample_log(i)) for i in range(count)]
+    print(f"{count} messages of ~{len(payloads[0])} bytes, producer batches of {batch}")
+    print(f"{'channel':<34}{'msgs/s':>14}{'MB/s':>10}")
+    for decode in (False, True):
+        ring = ShmRing.create(1 << 20)
+        done = ctx.Queue()
+        consumer = ctx.Process(target=_ring_consumer, args=(ring.name, ring.eventfds, count, decode, done))
+        consumer.start()
+        start = time.perf_counter()
+        for i in range(0, count, batch):
+            ring.put_many(payloads[i:i + batch])
+        done.get()
+        elapsed = time.perf_counter() - start
+        consumer.join()
+        ring.close()
+        ring.unlink()
+        label = 'shm ring' + (' + marshal.loads' if decode else '')
+        print(f"{label:<34}{count / elapsed:>14,.0f}{count * len(payloads[0]) / elapsed / 1e6:>10.1f}")
+        
+        producer_sock, consumer_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        consumer = ctx.Process(target=_socket_consumer, args=(consumer_sock, count, decode, done))
+        consumer.start()
+        start = time.perf_counter()
+        for i in range(0, count, batch):
+            producer_sock.sendall(b''.join(struct.pack('<I', len(p)) + p for p in payloads[i:i + batch]))
+        done.get()
+        elapsed = time.perf_counter() - start
+        consumer.join()
+        producer_sock.close()
+        consumer_sock.close()
+        label = 'unix socketpair' + (' + marshal.loads' if decode else '')
+        print(f"{label:<34}{count / elapsed:>14,.0f}{count * len(payloads[0]) / elapsed / 1e6:>10.1f}")
+    print("=" * 70)
+
+
+# benchmarks/bench_transports.py
+"""
+Same workload on every transport: the real Storage_MS and Log_MS, each on
+its own bus, driven by a client that keeps `window` parcels in flight. Each
+parcel is a store_parcel_id round trip (Storage writes Database_2 and acks
+back) plus a one-way store_log to Log_MS.
+"""
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+    
+def _bus_factory(transport: str, queues: List[str]) -> Optional[Callable]:
+    if transport == 'inprocess':
+        hub = InProcessHub(expected=queues)
+        return lambda: InProcessBus(hub)
+    if transport in ('http', 'socket'):
+        routes = {queue_name: f'127.0.0.1:{_free_port()}' for queue_name in queues}
+        return lambda: create_bus(transport, routes)
+    try:
+        MessageBus().connect()
+    except Exception as e:
+        print(f"{transport:<12}skipped ({type(e).__name__}: {e})")
+        return None
+    return lambda: MessageBus()
+
+def _run_transport_workload(make_bus: Callable, count: int, window: int) -> Dict[str, float]:
+    buses = [make_bus() for _ in range(4)]
+    storage_ms, log_ms = Storage_MS(buses[0]), Log_MS(buses[1])
+    client_in, client_out = buses[2], buses[3]
+    sent_at, latencies = {}, []
+    slots, done = threading.Semaphore(window), threading.Event()
+    
+    def on_ack(message: Dict[str, Any]):
+        started = sent_at.pop(message.get('parcel_id'), None)
+        if started is None:
+            return   # left over from an earlier run on a durable queue
+        latencies.append(time.perf_counter() - started)
+        slots.release()
+        if len(latencies) == count:
+            done.set()
+            
+    client_in.receive_message('idgen_ms_queue', on_ack)
+    threads = [threading.Thread(target=client_in.start_consuming, daemon=True)]
+    threads += [threading.Thread(target=service.start, daemon=True) for service in (storage_ms, log_ms)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)  # Give services time to start
+    
+    start = time.perf_counter()
+    for i in range(count):
+        slots.acquire()
+        parcel_id = f'PCL-BENCH-{i}'
+        sent_at[parcel_id] = time.perf_counter()
+        client_out.send_message('storage_ms_queue', {
+            'message_type': 'store_parcel_id',
+            'parcel_id': parcel_id,
+            'request_id': f'req-{i}',
+            'timestamp': datetime.now().isoformat()
+        })
+        client_out.send_message('log_ms_queue', {
+            'message_type': 'store_log',
+            'service_name': 'Bench',
+            'action': 'parcel_stored',
+            'request_id': f'req-{i}',
+            'details': {'parcel_id': parcel_id},
+            'timestamp': datetime.now().isoformat()
+        })
+    done.wait(120)
+    elapsed = time.perf_counter() - start
+    # Log writes trail the Storage acks: let the services finish what is
+    # queued and stop before the caller deletes their databases
+    for bus in buses:
+        bus.stop_consuming(drain_timeout=30)
+    for thread in threads:
+        thread.join(60)
+    latencies.sort()
+    return {
+        'completed': len(latencies),
+        'per_second': len(latencies) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+    }
+
+def run_transport_benchmark(count: int = 2000, window: int = 32,
+                            transports=('inprocess', 'socket', 'http', 'rabbitmq')):
+    """Print parcels/second and round-trip latency for each transport"""
+    print("=" * 70)
+    print("TRANSPORT BENCHMARK")
+    print("=" * 70)
+    print(f"{count} parcels (Storage round trip + Log write), {window} in flight")
+    print(f"{'transport':<12}{'done':>8}{'parcels/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    queues = ['storage_ms_queue', 'log_ms_queue', 'idgen_ms_queue']
+    workdir = os.getcwd()
+    for transport in transports:
+        make_bus = _bus_factory(transport, queues)
+        if make_bus is None:
+            continue
+        # Fresh databases per transport
+        with tempfile.TemporaryDirectory() as scratch:
+            os.chdir(scratch)
+            try:
+                result = _run_transport_workload(make_bus, count, window)
+            finally:
+                os.chdir(workdir)
+        print(f"{transport:<12}{result['completed']:>8}{result['per_second']:>12,.0f}"
+              f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+    print("=" * 70)
+
+
 if __name__ == "__main__":
     # Run appropriate script based on context
     import sys
@@ -1056,22 +4072,53 @@ if __name__ == "__main__":
         
         if mode == "server":
             run_server()
+        elif mode == "supervisor":
+            run_supervisor()
         elif mode == "sender":
             run_sender()
         elif mode == "car":
             run_car()
         elif mode == "test":
             test_full_workflow()
+        elif mode == "parked" and len(sys.argv) > 2:
+            # Messages that ran out of retries, in RabbitMQ as <queue>.parked.
+            # run_server's in-process services park there too, but replay puts
+            # messages on RabbitMQ <queue>, which they only read for the queues
+            # in REMOTE_INBOUND_QUEUES; with SERVER_TRANSPORT=http or socket,
+            # parked messages stay in the service's memory and are lost on restart
+            bus = MessageBus()
+            if len(sys.argv) > 3 and sys.argv[3] == "replay":
+                print(f"Replayed {bus.replay_parked(sys.argv[2])} messages onto {sys.argv[2]}")
+            else:
+                for entry in bus.parked_messages(sys.argv[2]):
+                    print(yaml.dump(entry))
+            bus.close()
+        elif mode == "bench":
+            suite = sys.argv[2] if len(sys.argv) > 2 else "all"
+            if suite in ("ids", "all"):
+                run_id_benchmark()
+            if suite in ("spatial", "all"):
+                run_spatial_benchmark()
+            if suite in ("batch", "all"):
+                run_batch_benchmark()
+            if suite in ("shm", "all"):
+                run_shm_benchmark()
+            if suite in ("transports", "all"):
+                run_transport_benchmark()
         else:
-            print("Usage: python script.py [server|sender|car|test]")
+            print("Usage: python script.py [server|supervisor|sender|car|test|parked <queue> [replay]|"
+                  "bench [ids|spatial|batch|shm|transports]]")
     else:
         print("\nDelivery Management Microservices System")
         print("=" * 50)
         print("\nUsage:")
         print("  python script.py server  - Run all internal services")
+        print("  python script.py supervisor - Run internal services as worker processes")
         print("  python script.py sender  - Run sender service")
         print("  python script.py car     - Run car service")
         print("  python script.py test    - Run system tests")
+        print("  python script.py parked <queue> [replay] - Show (or replay) messages that ran out of retries")
+        print("  python script.py bench   - Run benchmarks (ids, spatial, batch, shm, transports or all)")
         print("\nMake sure RabbitMQ is running first!")
         print("  docker-compose up -d")
         print("=" * 50)